@@ -3,6 +3,7 @@ import requests
 import os
 import io
 import json # JSON işlemleri için
+import time
 
 # BASE_URL'i env. değişkeninden veya varsayılan bir değerle al
 # Bu, hem yerel hem de Render'daki backend için geçerli olacaktır.
@@ -34,6 +35,8 @@ if "edit_chatbot_id" not in st.session_state:
     st.session_state.edit_chatbot_id = None
 if "show_edit_bot_form" not in st.session_state:
     st.session_state.show_edit_bot_form = False
+if "chat_session_ids" not in st.session_state:
+    st.session_state.chat_session_ids = {} # Bu tarayıcı oturumunun her chatbot için açtığı sohbet oturumu
 
 # --- Backend'den Chatbot Listesini Çekme Fonksiyonu ---
 @st.cache_data(ttl=60) # 60 saniye boyunca önbellekte tut
@@ -47,6 +50,61 @@ def fetch_chatbots():
         st.error(f"Chatbot'lar alınırken hata oluştu: {e}. Backend'in çalıştığından emin olun.")
         return []
 
+# --- Belge Yükleme İşlerini Takip Etme ---
+INGESTION_POLL_INTERVAL_SECONDS = 1.0
+INGESTION_POLL_TIMEOUT_SECONDS = 600
+
+def wait_for_ingestion_job(chatbot_id, job_id):
+    """Backend'deki belge işleme işi bitene (succeeded/failed) kadar durumunu sorgular ve son durumu döndürür."""
+    deadline = time.time() + INGESTION_POLL_TIMEOUT_SECONDS
+    while True:
+        response = requests.get(f"{BASE_URL}/chatbots/{chatbot_id}/ingestion_jobs/{job_id}")
+        response.raise_for_status()
+        job = response.json()
+        if job["status"] in ("succeeded", "failed") or time.time() > deadline:
+            return job
+        time.sleep(INGESTION_POLL_INTERVAL_SECONDS)
+
+def upload_documents_and_wait(chatbot_id, uploaded_files):
+    """
+    Belgelerin hepsini tek istekte toplu yükleme uç noktasına gönderir, işin bitmesini bekler
+    ve dosya bazındaki sonuçlara göre (başarılı, başarısız) sayılarını döndürür.
+    """
+    success_count = 0
+    fail_count = 0
+    files = [("files", (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)) for uploaded_file in uploaded_files]
+    try:
+        upload_response = requests.post(f"{BASE_URL}/chatbots/{chatbot_id}/upload_documents/", files=files)
+        upload_response.raise_for_status()
+        upload_result = upload_response.json()
+        for rejected in upload_result["rejected"]:
+            st.error(f"'{rejected['filename']}' belgesi yüklenemedi: {rejected['error']}")
+            fail_count += 1
+
+        with st.spinner(f"{len(upload_result['accepted'])} belge işleniyor..."):
+            job = wait_for_ingestion_job(chatbot_id, upload_result["job_id"])
+    except requests.exceptions.RequestException as e:
+        st.error(f"Belgeler yüklenirken hata oluştu: {e}")
+        return success_count, fail_count + len(uploaded_files)
+
+    if job["status"] == "failed":
+        st.error(f"Belgeler işlenirken hata oluştu: {job['error']}")
+        fail_count += len(upload_result["accepted"])
+    elif job["status"] == "succeeded":
+        for file_result in job["result"]["files"]:
+            if file_result["status"] == "succeeded":
+                st.success(f"'{file_result['filename']}' belgesi başarıyla yüklendi ({file_result['chunks']} yeni, {file_result['kept']} değişmeyen, {file_result['removed']} kaldırılan parça).")
+                success_count += 1
+            elif file_result["status"] == "unchanged":
+                st.info(f"'{file_result['filename']}' belgesi değişmemiş, yeniden işlenmedi.")
+                success_count += 1
+            else:
+                st.error(f"'{file_result['filename']}' belgesi işlenirken hata oluştu: {file_result['error']}")
+                fail_count += 1
+    else:
+        st.warning(f"Belgeler hâlâ işleniyor (aşama: {job['stage']}).")
+    return success_count, fail_count
+
 # --- Yeni Chatbot Oluşturma Formu ---
 def create_new_bot_form():
     """Yeni bir chatbot oluşturma formunu gösterir."""
@@ -85,21 +143,7 @@ def create_new_bot_form():
 
                     if uploaded_files:
                         st.info("Dokümanlar işleniyor ve chatbot'a ekleniyor...")
-                        success_count = 0
-                        fail_count = 0
-                        for uploaded_file in uploaded_files:
-                            try:
-                                files = {"file": (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
-                                upload_response = requests.post(
-                                    f"{BASE_URL}/chatbots/{chatbot_id}/upload_document/", # <-- Düzeltme: BASE_URL kullanıldı
-                                    files=files
-                                )
-                                upload_response.raise_for_status()
-                                st.success(f"'{uploaded_file.name}' belgesi başarıyla yüklendi.")
-                                success_count += 1
-                            except requests.exceptions.RequestException as e:
-                                st.error(f"'{uploaded_file.name}' belgesi yüklenirken hata oluştu: {e}")
-                                fail_count += 1
+                        success_count, fail_count = upload_documents_and_wait(chatbot_id, uploaded_files)
                         st.success(f"Chatbot oluşturuldu ve {success_count} belge başarıyla yüklendi.")
                     else:
                         st.success("Chatbot başarıyla oluşturuldu, henüz doküman yüklenmedi.")
@@ -258,6 +302,91 @@ def display_chatbot_list():
 
 
 # --- Sohbet Ekranı ---
+HISTORY_PAGE_SIZE = 50 # Sohbet geçmişinden tek seferde çekilen mesaj sayısı
+
+
+def resolve_chat_session(chatbot_id, new_session=False):
+    """
+    Sohbetin yürütüleceği oturumu döndürür: bu tarayıcı oturumunda chatbot için daha önce açılmış oturum, yoksa
+    (veya `new_session` istenmişse) yeni açılan bir oturum. Başka kullanıcıların oturumlarına asla geçilmez.
+    """
+    if not new_session and chatbot_id in st.session_state.chat_session_ids:
+        return st.session_state.chat_session_ids[chatbot_id]
+    response = requests.post(f"{BASE_URL}/chatbots/{chatbot_id}/sessions/")
+    response.raise_for_status()
+    session_id = response.json()["session_id"]
+    st.session_state.chat_session_ids[chatbot_id] = session_id
+    return session_id
+
+
+def open_chat_session(chatbot_id, new_session=False):
+    """Oturumu seçer ve geçmişinin yalnızca son sayfasını yükler; geçmişle ilgili tüm durum sıfırlanır."""
+    st.session_state.chat_history_from_backend = []
+    st.session_state.history_has_older = False
+    st.session_state.history_oldest_id = None
+    st.session_state.history_newest_id = None
+    st.session_state.history_etag = None
+    st.session_state.pending_chat_messages = []
+    st.session_state.chat_session_id = None
+    st.session_state.last_history_chatbot_id = chatbot_id # Hangi chatbot'un geçmişini yüklediğimizi takip et
+    try:
+        session_id = resolve_chat_session(chatbot_id, new_session)
+        history_response = requests.get(
+            f"{BASE_URL}/chatbots/{chatbot_id}/history/",
+            params={"session_id": session_id, "limit": HISTORY_PAGE_SIZE}
+        )
+        if history_response.status_code == 404:
+            # Oturum artık yok (ör. saklama süresi doldu); yeni bir oturumla devam edilir
+            session_id = resolve_chat_session(chatbot_id, new_session=True)
+            history_response = requests.get(
+                f"{BASE_URL}/chatbots/{chatbot_id}/history/",
+                params={"session_id": session_id, "limit": HISTORY_PAGE_SIZE}
+            )
+        history_response.raise_for_status()
+        st.session_state.chat_session_id = session_id
+        page = history_response.json()
+        st.session_state.chat_history_from_backend = page.get("history", [])
+        st.session_state.history_has_older = page.get("has_more", False)
+        st.session_state.history_oldest_id = page.get("oldest_id")
+        st.session_state.history_newest_id = page.get("newest_id")
+    except requests.exceptions.RequestException as e:
+        st.error(f"Sohbet geçmişi yüklenirken hata oluştu: {e}")
+
+
+def fetch_new_history_messages(chatbot_id):
+    """
+    Son bilinen mesajdan sonra gelen mesajları çeker ve geçmişe ekler. Değişiklik yoksa backend ETag
+    eşleşmesiyle 304 döndürür ve gövde indirilmez. Yeni mesajlar geldiğinde yerel (bekleyen) mesajlar silinir.
+    """
+    headers = {"If-None-Match": st.session_state.history_etag} if st.session_state.history_etag else {}
+    params = {"session_id": st.session_state.chat_session_id, "limit": HISTORY_PAGE_SIZE}
+    if st.session_state.history_newest_id is not None:
+        params["since"] = st.session_state.history_newest_id
+    try:
+        while True:
+            response = requests.get(f"{BASE_URL}/chatbots/{chatbot_id}/history/", params=params, headers=headers)
+            if response.status_code == 304:
+                return
+            response.raise_for_status()
+            page = response.json()
+            st.session_state.history_etag = response.headers.get("ETag")
+            new_messages = page.get("history", [])
+            if new_messages:
+                st.session_state.chat_history_from_backend.extend(new_messages)
+                st.session_state.history_newest_id = page.get("newest_id")
+                if st.session_state.history_oldest_id is None:
+                    # Geçmiş boşken yapılan ilk istek en yeni sayfayı döndürür; `has_more` daha eski mesajları gösterir
+                    st.session_state.history_oldest_id = page.get("oldest_id")
+                    st.session_state.history_has_older = page.get("has_more", False)
+                st.session_state.pending_chat_messages = []
+            if "since" not in params or not page.get("has_more"):
+                return
+            params["since"] = st.session_state.history_newest_id
+            headers = {}
+    except requests.exceptions.RequestException as e:
+        st.error(f"Yeni mesajlar yüklenirken hata oluştu: {e}")
+
+
 def display_chatbot_chat_interface():
     """Seçilen chatbot ile sohbet arayüzünü gösterir."""
     chatbot_id = st.session_state.current_chatbot_id
@@ -269,7 +398,6 @@ def display_chatbot_chat_interface():
     if st.button("← Chatbot Listesine Geri Dön"):
         st.session_state.current_chatbot_id = None
         st.session_state.current_chatbot_name = None
-        # Sohbet geçmişini silmek için st.session_state.chat_history_from_backend = [] yapın
         # Bu, farklı bir chatbota geçildiğinde eski geçmişin görünmemesini sağlar.
         if "chat_history_from_backend" in st.session_state:
             del st.session_state.chat_history_from_backend
@@ -277,21 +405,39 @@ def display_chatbot_chat_interface():
 
     st.markdown("---")
 
-    # Sohbet geçmişini backend'den çekelim
-    # Bu kısmı st.session_state içinde tutarak her rerun'da tekrar çekmemeyi optimize edebiliriz.
+    # Sohbet geçmişini backend'den oturum bazında, sayfa sayfa çekelim: ilk açılışta chatbot'un son oturumunun
+    # yalnızca son sayfası yüklenir, sonraki her rerun'da yalnızca son bilinen mesajdan sonra gelenler (`since`) istenir.
     if "chat_history_from_backend" not in st.session_state or st.session_state.get("last_history_chatbot_id") != chatbot_id:
+        open_chat_session(chatbot_id)
+    elif st.session_state.chat_session_id and (st.session_state.history_newest_id is not None or st.session_state.pending_chat_messages):
+        fetch_new_history_messages(chatbot_id)
+
+    if st.button("Yeni sohbet başlat"):
+        open_chat_session(chatbot_id, new_session=True)
+        st.rerun()
+
+    if st.session_state.history_has_older and st.button("Daha eski mesajları yükle"):
         try:
-            history_response = requests.get(f"{BASE_URL}/chatbots/{chatbot_id}/history/") # <-- Düzeltme: BASE_URL kullanıldı
-            history_response.raise_for_status()
-            st.session_state.chat_history_from_backend = history_response.json().get("history", [])
-            st.session_state.last_history_chatbot_id = chatbot_id # Hangi chatbot'un geçmişini yüklediğimizi takip et
+            older_response = requests.get(
+                f"{BASE_URL}/chatbots/{chatbot_id}/history/",
+                params={
+                    "session_id": st.session_state.chat_session_id,
+                    "limit": HISTORY_PAGE_SIZE,
+                    "before": st.session_state.history_oldest_id
+                }
+            )
+            older_response.raise_for_status()
+            page = older_response.json()
+            st.session_state.chat_history_from_backend = page.get("history", []) + st.session_state.chat_history_from_backend
+            st.session_state.history_has_older = page.get("has_more", False)
+            st.session_state.history_oldest_id = page.get("oldest_id") or st.session_state.history_oldest_id
+            st.rerun()
         except requests.exceptions.RequestException as e:
-            st.error(f"Sohbet geçmişi yüklenirken hata oluştu: {e}")
-            st.session_state.chat_history_from_backend = []
+            st.error(f"Eski mesajlar yüklenirken hata oluştu: {e}")
 
     # Streamlit'in sohbet arayüzü
-    # Mesajları göster
-    for message in st.session_state.chat_history_from_backend:
+    # Mesajları göster (henüz geçmişte görünmeyen yerel mesajlar en sonda)
+    for message in st.session_state.chat_history_from_backend + st.session_state.pending_chat_messages:
         if message["sender"] == "user":
             with st.chat_message("user"):
                 st.markdown(message["message"])
@@ -309,11 +455,17 @@ def display_chatbot_chat_interface():
         try:
             with st.spinner("Yanıt oluşturuluyor..."):
                 try:
-                    chat_response = requests.post(f"{BASE_URL}/chatbots/{chatbot_id}/chat/", json={"query": prompt})
+                    chat_response = requests.post(
+                        f"{BASE_URL}/chatbots/{chatbot_id}/chat/",
+                        json={"query": prompt, "session_id": st.session_state.chat_session_id}
+                    )
                     chat_response.raise_for_status()
                     
                     # Backend'den gelen tüm yanıtı al
                     response_data = chat_response.json()
+                    # Oturum açılamamışsa backend yeni bir oturum açar; sonraki mesajlar o oturumda devam eder
+                    st.session_state.chat_session_id = response_data.get("session_id", st.session_state.chat_session_id)
+                    st.session_state.chat_session_ids[chatbot_id] = st.session_state.chat_session_id
                     assistant_response = response_data.get("answer", "Yanıt alınamadı.")
                     sentiment_score = response_data.get("sentiment_score")
                     safety_flag = response_data.get("safety_flag")
@@ -326,8 +478,8 @@ def display_chatbot_chat_interface():
                         if safety_flag:
                             st.caption(f"Güvenlik Kontrolü: {safety_flag}")
 
-                    st.session_state.chat_history_from_backend.append({"sender": "user", "message": prompt})
-                    st.session_state.chat_history_from_backend.append({"sender": "bot", "message": assistant_response})
+                    st.session_state.pending_chat_messages.append({"sender": "user", "message": prompt})
+                    st.session_state.pending_chat_messages.append({"sender": "bot", "message": assistant_response})
                     
                     st.rerun() 
                 except requests.exceptions.RequestException as e:
@@ -341,7 +493,7 @@ def display_chatbot_chat_interface():
                     
                     st.error(f"Sohbet sırasında bir hata oluştu: {error_detail}")
                     # Hata durumunda da UI'ı yenileyebiliriz, belki bir uyarı mesajı göstermek için
-                    st.session_state.chat_history_from_backend.append({"sender": "bot", "message": f"Hata: {error_detail}"})
+                    st.session_state.pending_chat_messages.append({"sender": "bot", "message": f"Hata: {error_detail}"})
                     st.rerun()
         except requests.exceptions.RequestException as e:
             st.error(f"Sohbet sırasında bir hata oluştu: {e}")
@@ -387,21 +539,7 @@ def display_chatbot_documents_and_upload():
 
         if submit_upload and uploaded_files:
             st.info("Dokümanlar işleniyor ve chatbot'a ekleniyor...")
-            success_count = 0
-            fail_count = 0
-            for uploaded_file in uploaded_files:
-                try:
-                    files = {"file": (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
-                    upload_response = requests.post(
-                        f"{BASE_URL}/chatbots/{chatbot_id}/upload_document/", # <-- Düzeltme: BASE_URL kullanıldı
-                        files=files
-                    )
-                    upload_response.raise_for_status()
-                    st.success(f"'{uploaded_file.name}' belgesi başarıyla yüklendi.")
-                    success_count += 1
-                except requests.exceptions.RequestException as e:
-                    st.error(f"'{uploaded_file.name}' belgesi yüklenirken hata oluştu: {e}")
-                    fail_count += 1
+            success_count, fail_count = upload_documents_and_wait(chatbot_id, uploaded_files)
             st.success(f"Yükleme tamamlandı. {success_count} belge başarılı, {fail_count} belge başarısız.")
             st.cache_data.clear() # Önbelleği temizle
             st.rerun()
@@ -0,0 +1,93 @@
+# bench_async_db.py
+# Bir uvicorn worker'ındaki eşzamanlı sohbet isteklerinin veritabanı kısmını ölçer: sorguların olay döngüsünde
+# doğrudan (bloklayarak) çalıştırıldığı eski yol ile db_executor üzerinden çalıştırıldığı yol karşılaştırılır.
+# Her "istek" sohbet uç noktasının okumalarını yapar (chatbot yapılandırması + oturum + geçmiş) ve uzak bir veritabanını
+# taklit etmek için isteğe bağlı olarak pg_sleep ile gecikme ekler. Chatbot'un oturumu yoksa bir tane açılır;
+# bunun dışında veritabanına yazı yapılmaz.
+#
+# Örnek:
+#   python bench_async_db.py 12 --requests 200 --concurrency 20 --latency-ms 20
+import argparse
+import asyncio
+import json
+import time
+
+from main import (
+    close_db_pool, create_chat_session, db_connection, get_chat_session_start, get_chatbot_config, get_db_pool,
+    load_chat_history_from_db, run_db
+)
+
+
+def latest_session(chatbot_id: int) -> str:
+    """Chatbot'un en son kullanılan oturumunu döndürür; hiç oturumu yoksa yeni bir tane açar."""
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT id FROM chat_sessions WHERE chatbot_id = %s ORDER BY last_active_at DESC LIMIT 1;", (chatbot_id,)
+            )
+            row = cursor.fetchone()
+            if row:
+                return row[0]
+            session_id, _ = create_chat_session(cursor, chatbot_id)
+        conn.commit()
+    return session_id
+
+
+def chat_reads(chatbot_id: int, session_id: str, latency_ms: float):
+    """Sohbet isteğinin veritabanı okumaları; `latency_ms` ağ/sorgu gecikmesini taklit eder."""
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            if latency_ms:
+                cursor.execute("SELECT pg_sleep(%s);", (latency_ms / 1000.0,))
+        get_chatbot_config(chatbot_id, conn)
+        with conn.cursor() as cursor:
+            started_at = get_chat_session_start(cursor, chatbot_id, session_id)
+        load_chat_history_from_db(session_id, started_at, conn)
+
+
+async def measure(mode: str, chatbot_id: int, session_id: str, requests: int, concurrency: int, latency_ms: float) -> float:
+    """Verilen modda saniyede tamamlanan istek sayısını döndürür."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_request():
+        async with semaphore:
+            if mode == "blocking":
+                chat_reads(chatbot_id, session_id, latency_ms)
+            else:
+                await run_db(chat_reads, chatbot_id, session_id, latency_ms)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_request() for _ in range(requests)))
+    return requests / (time.perf_counter() - started)
+
+
+async def run(args) -> dict:
+    results = {}
+    session_id = latest_session(args.chatbot_id)
+    for mode in ("blocking", "executor"):
+        rates = [await measure(mode, args.chatbot_id, session_id, args.requests, args.concurrency, args.latency_ms) for _ in range(args.repeat)]
+        results[mode] = {"requests_per_second": round(max(rates), 1), "runs": [round(rate, 1) for rate in rates]}
+    results["speedup"] = round(results["executor"]["requests_per_second"] / results["blocking"]["requests_per_second"], 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sohbet okumaları için bloklayan ve db_executor yollarının eşzamanlı karşılaştırması")
+    parser.add_argument("chatbot_id", type=int)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    get_db_pool().open()
+    try:
+        results = asyncio.run(run(args))
+        pool_stats = get_db_pool().stats()
+    finally:
+        close_db_pool()
+    print(json.dumps({"requests": args.requests, "concurrency": args.concurrency, "latency_ms": args.latency_ms, **results, "pool": pool_stats}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
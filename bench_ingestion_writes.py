@@ -0,0 +1,74 @@
+# bench_ingestion_writes.py
+# Parça yazımını ölçer: eski satır satır INSERT yolu ile toplu (execute_values) yolu karşılaştırır.
+# Her ölçüm geçici bir chatbot ile tek bir işlem (transaction) içinde yapılır ve sonunda geri alınır;
+# veritabanında kalıcı bir değişiklik bırakmaz.
+#
+# Örnek:
+#   python bench_ingestion_writes.py --chunks 2000 --repeat 3
+import argparse
+import json
+import time
+
+from langchain.docstore.document import Document
+
+from main import get_db_connection, insert_document_chunks
+
+
+def insert_document_chunks_per_row(cursor, chatbot_id: int, filename: str, chunks):
+    """Eski yol: her parça için iki ayrı sorgu (documents + chatbot_documents)."""
+    document_ids = []
+    for i, chunk in enumerate(chunks):
+        cursor.execute(
+            "INSERT INTO documents (page_number, content) VALUES (%s, %s) RETURNING id;",
+            (chunk.metadata.get("page", i), chunk.page_content)
+        )
+        doc_id = cursor.fetchone()[0]
+        document_ids.append(doc_id)
+        cursor.execute(
+            "INSERT INTO chatbot_documents (chatbot_id, document_id, original_filename) VALUES (%s, %s, %s);",
+            (chatbot_id, doc_id, filename)
+        )
+    return document_ids
+
+
+def measure(write_fn, chunks) -> float:
+    """Verilen yazma fonksiyonunun saniyedeki satır sayısını döndürür."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "INSERT INTO chatbots (name, description) VALUES (%s, %s) RETURNING id;",
+            (f"__bench_{time.time_ns()}", "bench_ingestion_writes geçici chatbot'u")
+        )
+        chatbot_id = cursor.fetchone()[0]
+        started = time.perf_counter()
+        write_fn(cursor, chatbot_id, "bench.txt", chunks)
+        elapsed = time.perf_counter() - started
+        return len(chunks) / elapsed
+    finally:
+        conn.rollback()
+        cursor.close()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parça yazımı için satır satır ve toplu INSERT karşılaştırması")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--chunk-chars", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    chunks = [
+        Document(page_content=(f"parça {i} " * args.chunk_chars)[:args.chunk_chars], metadata={"page": i // 4})
+        for i in range(args.chunks)
+    ]
+    results = {}
+    for name, write_fn in (("per_row", insert_document_chunks_per_row), ("bulk", insert_document_chunks)):
+        rates = [measure(write_fn, chunks) for _ in range(args.repeat)]
+        results[name] = {"rows_per_second": round(max(rates), 1), "runs": [round(rate, 1) for rate in rates]}
+    results["speedup"] = round(results["bulk"]["rows_per_second"] / results["per_row"]["rows_per_second"], 2)
+    print(json.dumps({"chunks": args.chunks, **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# document_parsing.py
+# Belge ayrıştırma ve parçalama işleri. Bu fonksiyonlar main.py'deki süreç havuzunda (ProcessPoolExecutor)
+# çalışır; bu yüzden modül bilerek hafif tutulur (FastAPI, FAISS, veritabanı veya Gemini import etmez)
+# ve yalnızca pickle edilebilir değerler alıp döndürür.
+from typing import List
+
+from pypdf import PdfReader
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+
+def split_pages(pages: List[Document]) -> List[Document]:
+    """
+    Sayfaları önce loader'ların `load_and_split()` varsayılanıyla, ardından ingestion'ın
+    1000/200 ayarıyla parçalar; böylece süreç havuzundaki çıktı eski satır içi yolla aynı kalır.
+    """
+    pages = RecursiveCharacterTextSplitter().split_documents(pages)
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len,
+    )
+    return text_splitter.split_documents(pages)
+
+
+def parse_and_split_file(file_location: str, loader_class) -> List[Document]:
+    """Dosyanın tamamını verilen loader ile okur ve parçalar."""
+    return split_pages(loader_class(file_location).load())
+
+
+def pdf_page_count(file_location: str) -> int:
+    return len(PdfReader(file_location).pages)
+
+
+def parse_and_split_pdf_pages(file_location: str, start: int, end: int) -> List[Document]:
+    """
+    PDF'in [start, end) sayfa aralığını okur ve parçalar. Sayfa metadata'sı PyPDFLoader ile aynıdır
+    (`source`, 0 tabanlı `page`), böylece aralıklar sırayla birleştirildiğinde tek parça okuma ile eşdeğerdir.
+    """
+    reader = PdfReader(file_location)
+    pages = [
+        Document(page_content=reader.pages[page_number].extract_text(), metadata={"source": file_location, "page": page_number})
+        for page_number in range(start, end)
+    ]
+    return split_pages(pages)
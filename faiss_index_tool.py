@@ -0,0 +1,77 @@
+# faiss_index_tool.py
+# Chatbot FAISS indeksleri için komut satırı aracı.
+#
+# Örnekler:
+#   python faiss_index_tool.py report 12 --codec sq8 --k 10   # bellek kazancı ve recall@k kaybı raporu
+#   python faiss_index_tool.py convert 12 --codec sq8         # mevcut indeksi yerinde SQ8'e dönüştür
+import argparse
+import json
+
+from main import (
+    INDEX_CODECS,
+    INDEX_TYPES,
+    chatbot_config_cache,
+    evaluate_index_compression,
+    get_db_connection,
+    load_index_policy,
+    read_faiss_manifest,
+    retrain_faiss_index,
+    update_index_policy_columns,
+)
+
+
+def convert(chatbot_id: int, codec: str, index_type: str | None):
+    """Politikayı veritabanına yazar ve indeksi (tam tip/sıkıştırma ile) senkron olarak yeniden kurar."""
+    fields = {"index_codec": codec}
+    if index_type is not None:
+        fields["index_type"] = index_type
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        # API ile aynı yol: config_version artırılır ve diğer süreçlerin önbellekleri NOTIFY ile tazelenir
+        updated = update_index_policy_columns(cursor, chatbot_id, fields)
+        if updated is None:
+            raise SystemExit(f"Chatbot ID {chatbot_id} bulunamadı.")
+        conn.commit()
+        chatbot_config_cache.invalidate(chatbot_id, updated[2])
+    finally:
+        cursor.close()
+        conn.close()
+
+    manifest = read_faiss_manifest(chatbot_id)
+    target_type = index_type or manifest.get("index_type", "flat")
+    retrain_faiss_index(chatbot_id, target_type, codec)
+    manifest = read_faiss_manifest(chatbot_id)
+    print(json.dumps({
+        "chatbot_id": chatbot_id,
+        "index_type": manifest.get("index_type"),
+        "index_codec": manifest.get("index_codec"),
+        "ntotal": manifest.get("ntotal"),
+        "policy": load_index_policy(chatbot_id),
+    }, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chatbot FAISS indeks aracı")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    report_parser = subparsers.add_parser("report", help="Sıkıştırmanın bellek kazancını ve recall@k kaybını raporla")
+    report_parser.add_argument("chatbot_id", type=int)
+    report_parser.add_argument("--codec", choices=INDEX_CODECS, default="sq8")
+    report_parser.add_argument("--k", type=int, default=10)
+    report_parser.add_argument("--sample-size", type=int, default=1000)
+
+    convert_parser = subparsers.add_parser("convert", help="Mevcut indeksi yerinde yeni sıkıştırmaya dönüştür")
+    convert_parser.add_argument("chatbot_id", type=int)
+    convert_parser.add_argument("--codec", choices=INDEX_CODECS, required=True)
+    convert_parser.add_argument("--index-type", choices=INDEX_TYPES, default=None)
+
+    args = parser.parse_args()
+    if args.command == "report":
+        print(json.dumps(evaluate_index_compression(args.chatbot_id, args.codec, k=args.k, sample_size=args.sample_size), indent=2))
+    elif args.command == "convert":
+        convert(args.chatbot_id, args.codec, args.index_type)
+
+
+if __name__ == "__main__":
+    main()
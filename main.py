@@ -1,10 +1,12 @@
 # main.py
 import os
+import asyncio
 from dotenv import load_dotenv
 
 import json
+import functools
 
-from fastapi import FastAPI, Response, UploadFile, File, HTTPException
+from fastapi import FastAPI, Response, UploadFile, File, HTTPException, Query, Header
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import List
@@ -17,10 +19,10 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 # --- Diğer Langchain ve yardımcı kütüphane importları ---
 from langchain_community.vectorstores import FAISS
 from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.docstore.document import Document
 
 from langchain.docstore.in_memory import InMemoryDocstore # Bu import'u dosyanızın en üstüne ekleyin
+from langchain.docstore.base import Docstore
 from langchain_community.vectorstores.faiss import FAISS
 
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader
@@ -30,8 +32,12 @@ from langchain.prompts import PromptTemplate # Eğer PromptTemplate kullanıyors
 from langchain.memory import ConversationBufferWindowMemory # Önceki N mesajı tutmak için
 from langchain.chains import ConversationalRetrievalChain
 from langchain.schema import HumanMessage, AIMessage, BaseMessage # Sohbet geçmişini temsil etmek için
+from langchain_core.embeddings import Embeddings
 from typing import List, Dict, Any # Tip belirtmeleri için
 
+# Süreç havuzunda çalışan belge ayrıştırma ve parçalama fonksiyonları
+from document_parsing import parse_and_split_file, parse_and_split_pdf_pages, pdf_page_count
+
 
 # Guardrails
 from guardrails import Guard
@@ -41,8 +47,28 @@ from validators import IsNotMedicalAdvice, IsNotHarmful, IsEmpatheticAndSupporti
 
 
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
 import pickle
 import faiss # FAISS kütüphanesini doğrudan kullanmak için
+import numpy as np
+import threading
+import queue
+import fcntl
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import time
+import select
+import socket
+import random
+import hashlib
+import uuid
+import re
+import unicodedata
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
 # --- ---
 
 # --- Ortam Değişkenlerini Yükleme ---
@@ -101,61 +127,772 @@ embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_a
 # Gemini embedding modelinin boyutu (models/embedding-001 için 768)
 GEMINI_EMBEDDING_DIM = 768
 
+# Parça embedding'leri `documents.embedding` sütununda bu tipte saklanır ("float32" veya yarı boyut için "float16")
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+# İndeks yeniden oluşturulurken veritabanından tek seferde çekilecek satır sayısı
+FAISS_REBUILD_BATCH_SIZE = int(os.getenv("FAISS_REBUILD_BATCH_SIZE", "2000"))
+
+# Embedding zamanlayıcısı: API isteği başına metin sayısı, eşzamanlı istek sayısı, dakikalık istek kotası
+# ve kota/geçici hatalarda üstel geri çekilmeyle (backoff) yeniden deneme ayarları
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_REQUESTS_PER_MINUTE = float(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", "300"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+EMBEDDING_BACKOFF_SECONDS = float(os.getenv("EMBEDDING_BACKOFF_SECONDS", "1.0"))
+EMBEDDING_MAX_BACKOFF_SECONDS = float(os.getenv("EMBEDDING_MAX_BACKOFF_SECONDS", "60"))
+
+# Belge yükleme işleri: arka plan işçi sayısı ve kuyrukta bekleyebilecek en fazla iş
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+INGESTION_MAX_PENDING_JOBS = int(os.getenv("INGESTION_MAX_PENDING_JOBS", "32"))
+
+# İş kirası (lease): her iş kaydı onu üstlenen süreci (host:pid) ve kiranın bitiş zamanını tutar. Süreç kirayı
+# JOB_LEASE_SECONDS / 3 aralıkla yeniler; kirası dolan iş, sahibi çökmüş sayılıp başarısız olarak işaretlenir.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+
+# Yüklenen dosyalar: en büyük boyut, diske akıtılırken kullanılan parça boyutu ve geçici dizin
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+UPLOAD_TEMP_DIR = os.getenv("UPLOAD_TEMP_DIR") or tempfile.gettempdir()
+
+# Belge ayrıştırma/parçalama süreç havuzu: süreç sayısı ve büyük PDF'lerde bir göreve düşen sayfa sayısı
+PARSER_PROCESSES = int(os.getenv("PARSER_PROCESSES", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "25"))
+
+# Parça satırları veritabanına tek tek değil, bu boyuttaki çok satırlı INSERT'lerle yazılır
+INGESTION_DB_PAGE_SIZE = int(os.getenv("INGESTION_DB_PAGE_SIZE", "1000"))
+
+# Akış halinde ingestion: havuzda aynı anda bekleyebilecek ayrıştırma görevi sayısı (backpressure penceresi),
+# karşılaştırma/embedding/INSERT için batch boyutu ve bellekteki delta segmentinin diske yazılacağı vektör sayısı
+INGESTION_PARSE_WINDOW = int(os.getenv("INGESTION_PARSE_WINDOW", str(2 * PARSER_PROCESSES)))
+INGESTION_STREAM_BATCH_SIZE = int(os.getenv("INGESTION_STREAM_BATCH_SIZE", str(EMBEDDING_BATCH_SIZE * EMBEDDING_CONCURRENCY)))
+INGESTION_SEGMENT_MAX_CHUNKS = int(os.getenv("INGESTION_SEGMENT_MAX_CHUNKS", "5000"))
+
+# Chatbot yapılandırması (ad, sınır metni, indeks politikası) önbelleği. Değişiklikler `chatbot_config` kanalında
+# NOTIFY ile tüm süreçlere yayılır; TTL, kaçırılmış bir bildirime karşı üst sınırdır.
+CHATBOT_CONFIG_CACHE_MAX_ENTRIES = int(os.getenv("CHATBOT_CONFIG_CACHE_MAX_ENTRIES", "10000"))
+CHATBOT_CONFIG_CACHE_TTL_SECONDS = float(os.getenv("CHATBOT_CONFIG_CACHE_TTL_SECONDS", "300"))
+CHATBOT_CONFIG_CHANNEL = "chatbot_config"
+
+# Sohbet sorgularının embedding önbelleği (tüm chatbot'lar arasında paylaşılır)
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", "10000"))
+QUERY_EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL_SECONDS", "3600"))
+# Sohbette bağlam olarak getirilecek parça sayısı
+RETRIEVER_TOP_K = int(os.getenv("RETRIEVER_TOP_K", "4"))
+
+# Sohbette modele verilen geçmiş: son N soru-cevap turu. Geçmiş veritabanından yalnızca bu pencere kadar okunur.
+CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", "5"))
+# Geçmiş uç noktasının sayfa boyutu (varsayılan ve izin verilen en büyük değer)
+HISTORY_PAGE_DEFAULT_LIMIT = int(os.getenv("HISTORY_PAGE_DEFAULT_LIMIT", "50"))
+HISTORY_PAGE_MAX_LIMIT = int(os.getenv("HISTORY_PAGE_MAX_LIMIT", "200"))
+
+# `chat_messages` tablosu aylık bölümlere (partition) ayrılır: bu aydan sonra önceden oluşturulacak bölüm sayısı ve
+# saklama süresi (ay). Saklama süresinden eski bölümler tek DROP ile, o süredir kullanılmayan oturumlar ise silinir.
+# 0: mesajlar süresiz saklanır.
+CHAT_MESSAGE_PARTITION_MONTHS_AHEAD = int(os.getenv("CHAT_MESSAGE_PARTITION_MONTHS_AHEAD", "3"))
+CHAT_MESSAGE_RETENTION_MONTHS = int(os.getenv("CHAT_MESSAGE_RETENTION_MONTHS", "0"))
+# Eski bölümlenmemiş tablodan taşıma (migrate_chat_messages.py) her işlemde bu kadar mesaj taşır
+CHAT_MESSAGE_MIGRATION_BATCH_SIZE = int(os.getenv("CHAT_MESSAGE_MIGRATION_BATCH_SIZE", "5000"))
+# Oturum listesinin sayfa boyutu (varsayılan ve izin verilen en büyük değer)
+SESSION_LIST_DEFAULT_LIMIT = int(os.getenv("SESSION_LIST_DEFAULT_LIMIT", "20"))
+SESSION_LIST_MAX_LIMIT = int(os.getenv("SESSION_LIST_MAX_LIMIT", "100"))
+
+# Sohbet mesajlarının write-behind yazımı: batch başına en fazla satır, batch'in toplanma süresi, kuyrukta
+# bekleyebilecek en fazla tur, kuyruk doluyken isteğin bekleyeceği süre ve başarısız batch'in yeniden deneme sayısı
+CHAT_WRITER_BATCH_SIZE = int(os.getenv("CHAT_WRITER_BATCH_SIZE", "200"))
+CHAT_WRITER_FLUSH_INTERVAL_SECONDS = float(os.getenv("CHAT_WRITER_FLUSH_INTERVAL_SECONDS", "0.1"))
+CHAT_WRITER_MAX_PENDING_TURNS = int(os.getenv("CHAT_WRITER_MAX_PENDING_TURNS", "1000"))
+CHAT_WRITER_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("CHAT_WRITER_ENQUEUE_TIMEOUT_SECONDS", "2"))
+CHAT_WRITER_MAX_RETRIES = int(os.getenv("CHAT_WRITER_MAX_RETRIES", "3"))
+
+# PostgreSQL bağlantı havuzu: açık tutulacak en az/en fazla bağlantı, boş bağlantı beklerken zaman aşımı ve
+# bu süreden uzun boşta kalmış bağlantının kullanılmadan önce `SELECT 1` ile sağlık kontrolü
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
+DB_POOL_HEALTHCHECK_SECONDS = float(os.getenv("DB_POOL_HEALTHCHECK_SECONDS", "30"))
+
 faiss_index = None # FAISS indeksini global olarak tanımlıyoruz
 # --- ---
 
 FAISS_INDEX_DIR = "faiss_indexes"
 
+# Bellekte tutulacak FAISS indeksleri için önbellek sınırları
+FAISS_CACHE_MAX_BYTES = int(os.getenv("FAISS_CACHE_MAX_BYTES", str(1024 * 1024 * 1024))) # Varsayılan 1 GB
+FAISS_CACHE_MAX_ENTRIES = int(os.getenv("FAISS_CACHE_MAX_ENTRIES", "256"))
+# Bu sayıda delta segmenti biriktiğinde arka planda tabana birleştirilir
+FAISS_COMPACTION_SEGMENT_THRESHOLD = int(os.getenv("FAISS_COMPACTION_SEGMENT_THRESHOLD", "8"))
+# Manifest'teki silinmiş (tombstone) vektörler depodaki vektörlerin bu oranına ulaştığında da compaction başlatılır
+FAISS_COMPACTION_TOMBSTONE_FRACTION = float(os.getenv("FAISS_COMPACTION_TOMBSTONE_FRACTION", "0.1"))
+
+# İndeks tipi politikası için varsayılanlar (chatbot bazında `chatbots` tablosundaki sütunlarla ezilebilir).
+# Küçük chatbot'lar IndexFlatL2'de (tam arama) kalır; vektör sayısı eşiği geçince arka planda
+# FAISS_DEFAULT_INDEX_TYPE tipindeki yaklaşık indekse ("ivf" veya "hnsw") geçilir. "flat" hiç geçiş yapmaz.
+FAISS_DEFAULT_INDEX_TYPE = os.getenv("FAISS_DEFAULT_INDEX_TYPE", "ivf")
+FAISS_PROMOTION_THRESHOLD = int(os.getenv("FAISS_PROMOTION_THRESHOLD", "50000"))
+FAISS_IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", "16"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+# Vektör sıkıştırma: "none" (float32), "fp16", "sq8" (8-bit skaler kuantalama) veya "pq" (ürün kuantalama)
+FAISS_DEFAULT_INDEX_CODEC = os.getenv("FAISS_DEFAULT_INDEX_CODEC", "none")
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "96")) # PQ alt-vektör sayısı; 768'i bölmeli (96 -> vektör başına 96 byte)
+
+# İndeks depolama modu: "per_bot" her chatbot için ayrı dosya, "shared" küçük chatbot'ların vektörlerini
+# chatbot_id % FAISS_SHARED_SHARDS ile seçilen ortak bir parçada (faiss_index_shared_{n}) tutar.
+FAISS_DEFAULT_STORAGE_MODE = os.getenv("FAISS_DEFAULT_STORAGE_MODE", "per_bot")
+FAISS_SHARED_SHARDS = int(os.getenv("FAISS_SHARED_SHARDS", "16"))
+
+# --- PostgreSQL Bağlantı Havuzu ---
+class DatabasePoolTimeout(Exception):
+    """Havuzda DB_POOL_TIMEOUT_SECONDS içinde boş bağlantı bulunamadı."""
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """
+    Havuzdan verilen psycopg2 bağlantısı. `close()` bağlantıyı kapatmak yerine havuza iade eder; böylece
+    mevcut `conn.close()` çağrıları değişmeden kalır. Aynı bağlantıyı ikinci kez iade etmek etkisizdir.
+    """
+
+    def close(self):
+        pool = getattr(self, "_pool", None)
+        if pool is None:
+            super().close()
+        else:
+            pool.release(self)
+
+    def close_physical(self):
+        psycopg2.extensions.connection.close(self)
+
+
+class DatabasePool:
+    """
+    Sınırlı, thread-safe PostgreSQL bağlantı havuzu. Boş bağlantı yoksa ve havuz doluysa en fazla `timeout`
+    saniye beklenir. Uzun süre boşta kalmış bağlantılar verilmeden önce `SELECT 1` ile kontrol edilir; kopmuş
+    bağlantılar atılıp yerine yenisi açılır. İade edilen bağlantıda kalmış açık işlem geri alınır.
+    """
+
+    def __init__(self, dsn: str, min_size: int, max_size: int, timeout: float, healthcheck_seconds: float):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.healthcheck_seconds = healthcheck_seconds
+        self._idle: List[tuple] = [] # (bağlantı, son kullanım zamanı)
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+        self.created = 0
+        self.discarded = 0
+        self.failed_healthchecks = 0
+
+    def _connect(self) -> PooledConnection:
+        conn = psycopg2.connect(self.dsn, connection_factory=PooledConnection)
+        conn._pool = self
+        conn._checked_out = False
+        with self._cond:
+            self.created += 1
+        return conn
+
+    def open(self):
+        """Havuzu DB_POOL_MIN_SIZE bağlantıyla önceden doldurur; veritabanına ulaşılamıyorsa hata yükseltir."""
+        for _ in range(self.min_size):
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def _is_healthy(self, conn: PooledConnection, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.healthcheck_seconds:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except Exception:
+            with self._cond:
+                self.failed_healthchecks += 1
+            return False
+
+    def _discard(self, conn: PooledConnection):
+        with self._cond:
+            self._size -= 1
+            self.discarded += 1
+            self._cond.notify()
+        if not conn.closed:
+            try:
+                conn.close_physical()
+            except Exception:
+                pass
+
+    def acquire(self) -> PooledConnection:
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn = None
+            with self._cond:
+                started_waiting = None
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Veritabanı bağlantı havuzu kapatıldı.")
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise DatabasePoolTimeout(f"{self.timeout} sn içinde boş veritabanı bağlantısı bulunamadı.")
+                    if started_waiting is None:
+                        started_waiting = time.monotonic()
+                        self.waits += 1
+                    self._cond.wait(remaining)
+                if started_waiting is not None:
+                    self.wait_seconds += time.monotonic() - started_waiting
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, last_used):
+                self._discard(conn)
+                continue
+            conn._checked_out = True
+            with self._cond:
+                self.checkouts += 1
+            return conn
+
+    def release(self, conn: PooledConnection):
+        if not getattr(conn, "_checked_out", False):
+            return
+        conn._checked_out = False
+        healthy = not conn.closed
+        if healthy and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback() # commit edilmemiş işler havuza taşınmaz
+            except Exception:
+                healthy = False
+        with self._cond:
+            if healthy and not self._closed:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+                return
+        self._discard(conn)
+
+    def close(self):
+        """Boştaki bağlantıları kapatır; kullanımdaki bağlantılar iade edildiklerinde kapatılır."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "avg_wait_seconds": (self.wait_seconds / self.waits) if self.waits else 0.0,
+                "timeouts": self.timeouts,
+                "created": self.created,
+                "discarded": self.discarded,
+                "failed_healthchecks": self.failed_healthchecks,
+            }
+
+
+_db_pool: DatabasePool | None = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db_pool() -> DatabasePool:
+    """
+    Paylaşılan bağlantı havuzunu döndürür. Havuz normalde uygulama başlangıcında açılır; main.py'yi import eden
+    komut satırı araçları için ilk kullanımda da oluşturulur.
+    """
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            _db_pool = DatabasePool(DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT_SECONDS, DB_POOL_HEALTHCHECK_SECONDS)
+        return _db_pool
+
+
+def close_db_pool():
+    global _db_pool
+    with _db_pool_lock:
+        pool, _db_pool = _db_pool, None
+    if pool is not None:
+        pool.close()
+# --- ---
+
 # --- PostgreSQL Yardımcı Fonksiyonları ---
 def get_db_connection():
-    """PostgreSQL veritabanı bağlantısı sağlar."""
+    """Paylaşılan havuzdan bir PostgreSQL bağlantısı alır. `conn.close()` bağlantıyı havuza iade eder."""
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
+        return get_db_pool().acquire()
+    except DatabasePoolTimeout as e:
+        print(f"Veritabanı bağlantı havuzu dolu: {e}")
+        raise HTTPException(status_code=503, detail="Veritabanı bağlantı havuzu dolu. Lütfen biraz sonra tekrar deneyin.")
     except Exception as e:
         print(f"Veritabanı bağlantı hatası: {e}")
         raise HTTPException(status_code=500, detail="Veritabanı bağlantı hatası.")
 
 
-def load_chat_history_from_db(chatbot_id: int) -> List[Dict[str, str]]:
+@contextmanager
+def db_connection(conn=None):
+    """Verilen bağlantıyı kullanır; bağlantı verilmediyse havuzdan alıp blok sonunda iade eder."""
+    if conn is not None:
+        yield conn
+        return
     conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute(
-            "SELECT sender, message FROM chat_messages WHERE chatbot_id = %s ORDER BY timestamp ASC;",
-            (chatbot_id,)
-        )
-        history_rows = cursor.fetchall()
-
-        chat_history = []
-        for sender, message in history_rows:
-            if sender == 'user':
-                chat_history.append(HumanMessage(content=message))
-            elif sender == 'bot':
-                chat_history.append(AIMessage(content=message))
-        return chat_history
-    except Exception as e:
-        print(f"Error loading chat history from DB: {e}")
-        return [] # Hata durumunda boş liste döndür
+        yield conn
     finally:
-        cursor.close()
         conn.close()
 
-def save_chat_message_to_db(chatbot_id: int, sender: str, message: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "INSERT INTO chat_messages (chatbot_id, sender, message) VALUES (%s, %s, %s);",
-            (chatbot_id, sender, message)
-        )
-        conn.commit()
-    except Exception as e:
-        print(f"Error saving chat message to DB: {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
+
+# Async endpoint'lerdeki bloklayan psycopg2 çağrıları bu ayrı thread havuzunda çalışır; olay döngüsü yavaş bir
+# sorgu yüzünden diğer istekleri bekletmez. Havuzdan fazla bağlantı zaten alınamayacağı için thread sayısı
+# bağlantı havuzunun üst sınırına eşittir.
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX_SIZE, thread_name_prefix="db")
+
+
+async def run_db(fn, *args, **kwargs):
+    """Bloklayan bir veritabanı fonksiyonunu db_executor'da çalıştırır ve sonucunu bekler."""
+    return await asyncio.get_running_loop().run_in_executor(db_executor, functools.partial(fn, *args, **kwargs))
+
+
+def create_chat_session(cursor, chatbot_id: int) -> tuple:
+    """Chatbot için yeni bir sohbet oturumu ekler; (oturum ID'si, başlangıç zamanı) döndürür. Commit çağırana aittir."""
+    session_id = str(uuid.uuid4())
+    cursor.execute("INSERT INTO chat_sessions (id, chatbot_id) VALUES (%s, %s) RETURNING created_at;", (session_id, chatbot_id))
+    return session_id, cursor.fetchone()[0]
+
+
+def get_chat_session_start(cursor, chatbot_id: int, session_id: str):
+    """Oturumun başlangıç zamanını döndürür; oturum yoksa veya başka bir chatbot'a aitse 404 verir."""
+    cursor.execute("SELECT created_at FROM chat_sessions WHERE id = %s AND chatbot_id = %s;", (session_id, chatbot_id))
+    row = cursor.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail=f"Sohbet oturumu {session_id} bulunamadı.")
+    return row[0]
+
+
+def load_chat_history_from_db(session_id: str, started_at, conn=None, turns: int = CHAT_HISTORY_TURNS,
+                              pending: List[tuple] = ()) -> List[Dict[str, str]]:
+    """
+    Oturumun son `turns` soru-cevap turunu (en fazla 2 * turns mesaj) eskiden yeniye döndürür. Pencere SQL'de
+    uygulanır ve (session_id, timestamp, id) indeksinden geriye doğru okunur. `started_at` (oturumun başlangıcı)
+    alt sınırı sayesinde oturumdan eski aylık bölümler sorguya hiç dahil edilmez.
+    `pending`, yazıcının sorgudan önce alınmış (sender, message, timestamp) kuyruk görüntüsüdür; bu arada
+    yazılıp sorguda da görünen mesajlar (sender, timestamp) kimliğiyle ayıklanır, kalanlar sona eklenir.
+    """
+    with db_connection(conn) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                """
+                SELECT sender, message, timestamp FROM (
+                    SELECT id, sender, message, timestamp FROM chat_messages
+                    WHERE session_id = %s AND timestamp >= %s
+                    ORDER BY timestamp DESC, id DESC
+                    LIMIT %s
+                ) AS recent
+                ORDER BY timestamp ASC, id ASC;
+                """,
+                (session_id, started_at, 2 * turns)
+            )
+            history_rows = cursor.fetchall()
+            loaded = {(sender, timestamp) for sender, _, timestamp in history_rows}
+            history_rows += [row for row in pending if (row[0], row[2]) not in loaded]
+
+            chat_history = []
+            for sender, message, _ in history_rows[-2 * turns:]:
+                if sender == 'user':
+                    chat_history.append(HumanMessage(content=message))
+                elif sender == 'bot':
+                    chat_history.append(AIMessage(content=message))
+            return chat_history
+        except Exception as e:
+            print(f"Error loading chat history from DB: {e}")
+            conn.rollback()
+            return [] # Hata durumunda boş liste döndür
+        finally:
+            cursor.close()
+
+def save_chat_messages_to_db(rows: List[tuple], conn=None):
+    """
+    (chatbot_id, session_id, sender, message, timestamp) satırlarını tek çok satırlı INSERT ile, verilen sırayla
+    yazar ve aynı işlemde ilgili oturumların son kullanım zamanını günceller.
+    """
+    with db_connection(conn) as conn:
+        try:
+            with conn.cursor() as cursor:
+                psycopg2.extras.execute_values(
+                    cursor,
+                    "INSERT INTO chat_messages (chatbot_id, session_id, sender, message, timestamp) VALUES %s;",
+                    rows,
+                    page_size=CHAT_WRITER_BATCH_SIZE
+                )
+                cursor.execute(
+                    "UPDATE chat_sessions SET last_active_at = CURRENT_TIMESTAMP WHERE id = ANY(%s::uuid[]);",
+                    (sorted({row[1] for row in rows}),)
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+class ChatMessageWriter:
+    """
+    Sohbet mesajlarını yanıt yolundan çıkaran write-behind yazıcı. Her tur (kullanıcı + bot mesajı) sınırlı
+    bir kuyruğa tek öğe olarak eklenir; arka plandaki tek thread kuyruktan CHAT_WRITER_BATCH_SIZE satıra veya
+    CHAT_WRITER_FLUSH_INTERVAL_SECONDS süresine kadar toplayıp tek INSERT ve tek commit ile yazar. Kuyruk doluysa
+    ekleme bekler (backpressure). Yazılamayan batch'ler geri çekilmeyle yeniden denenir; `close()` kuyruğu
+    boşaltıp thread'in bitmesini bekler. Henüz yazılmamış mesajlar `pending_messages` ile oturum bazında
+    okunabilir; böylece aynı süreçteki bir sonraki tur kendi geçmişini eksiksiz görür. Mesajların zaman damgası
+    kuyruğa eklenirken verilir ve aynen yazılır; bir batch commit edilip kuyruktan düşülene kadar geçen sürede
+    aynı mesaj hem veritabanında hem kuyrukta görünebilir, okuyucu (sender, timestamp) kimliğiyle ayıklar.
+    """
+
+    _STOP = object()
+
+    def __init__(self, batch_size: int, flush_interval: float, max_pending: int, max_retries: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._pending: Dict[str, List[tuple]] = {} # session_id -> yazılmayı bekleyen satırlar
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.rejected = 0
+        self.dropped = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._closed = False
+                self._thread = threading.Thread(target=self._run, name="chat-message-writer", daemon=True)
+                self._thread.start()
+
+    def enqueue(self, chatbot_id: int, session_id: str, messages: List[tuple], timeout: float = 0) -> bool:
+        """
+        Bir oturumdaki turun (sender, message) çiftlerini kuyruğa ekler. `timeout` saniye boyunca yer açılmasını bekler
+        (0: beklemez). Yazıcı çalışmıyorsa veya kuyruk dolu kaldıysa False döner; çağıran mesajları kendisi yazmalıdır.
+        """
+        timestamp = datetime.now(timezone.utc)
+        rows = [(chatbot_id, session_id, sender, message, timestamp) for sender, message in messages]
+        with self._lock:
+            if self._thread is None or self._closed:
+                return False
+            self._pending.setdefault(session_id, []).extend(rows)
+        try:
+            self._queue.put(rows, block=timeout > 0, timeout=timeout or None)
+        except queue.Full:
+            with self._lock:
+                self._forget(rows)
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.enqueued += len(rows)
+        return True
+
+    def pending_messages(self, session_id: str) -> List[tuple]:
+        """Oturumun kuyrukta bekleyen (henüz yazılmamış) (sender, message, timestamp) üçlülerini sırasıyla döndürür."""
+        with self._lock:
+            return [(sender, message, timestamp) for _, _, sender, message, timestamp in self._pending.get(session_id, [])]
+
+    def _forget(self, rows: List[tuple]):
+        for row in rows:
+            session_rows = self._pending.get(row[1])
+            if session_rows:
+                session_rows.remove(row)
+                if not session_rows:
+                    del self._pending[row[1]]
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch: List[tuple] = []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.extend(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch: List[tuple]):
+        try:
+            # Ay değiştiyse yazmadan önce ileri tarihli bölümler tamamlanır (ayda bir kez çalışır)
+            maintain_chat_message_partitions()
+        except Exception as e:
+            print(f"Sohbet mesajı bölüm bakımı başarısız oldu: {e}")
+        written = False
+        for attempt in range(self.max_retries + 1):
+            try:
+                save_chat_messages_to_db(batch)
+                written = True
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"Sohbet mesajları yazılamadı, {len(batch)} mesaj atlandı: {e}")
+                    break
+                print(f"Sohbet mesajları yazılırken hata oluştu ({attempt + 1}/{self.max_retries}), tekrar denenecek: {e}")
+                time.sleep(min(5.0, 0.1 * 2 ** attempt))
+        with self._lock:
+            self._forget(batch)
+            if written:
+                self.batches += 1
+                self.written += len(batch)
+            else:
+                self.dropped += len(batch)
+
+    def close(self):
+        """Yeni mesaj kabulünü durdurur, kuyruktaki tüm mesajları yazar ve thread'in bitmesini bekler."""
+        with self._lock:
+            thread, self._closed = self._thread, True
+        if thread is None:
+            return
+        self._queue.put(self._STOP)
+        thread.join()
+        with self._lock:
+            self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queued_turns": self._queue.qsize(),
+                "max_pending_turns": self._queue.maxsize,
+                "pending_messages": sum(len(rows) for rows in self._pending.values()),
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "batches": self.batches,
+                "avg_batch_size": (self.written / self.batches) if self.batches else 0.0,
+                "rejected": self.rejected,
+                "dropped": self.dropped,
+            }
+
+
+chat_message_writer = ChatMessageWriter(
+    batch_size=CHAT_WRITER_BATCH_SIZE,
+    flush_interval=CHAT_WRITER_FLUSH_INTERVAL_SECONDS,
+    max_pending=CHAT_WRITER_MAX_PENDING_TURNS,
+    max_retries=CHAT_WRITER_MAX_RETRIES,
+)
+
+
+# `chatbots` tablosundan önbelleğe alınan sütunlar (get_chatbot_config sözlüğünün anahtarları)
+CHATBOT_CONFIG_COLUMNS = (
+    "name", "description", "boundary_text", "index_type", "index_codec", "index_promotion_threshold",
+    "index_nprobe", "index_ef_search", "index_storage", "config_version",
+)
+
+
+class ChatbotConfigCache:
+    """
+    Chatbot yapılandırmalarının süreç içi, sürüm (config_version) bazlı LRU + TTL önbelleği. Her yazma işlemi
+    sürümü artırır ve aynı işlemde `pg_notify` ile "<chatbot_id>:<sürüm>" (silmede "<chatbot_id>:deleted")
+    yayınlar. Her süreçteki dinleyici thread'i bildirimi aldığında o sürümden eski kaydı atar; bildirimden
+    önce okunmuş eski bir satır da sonradan önbelleğe yazılamaz. Dinleyici bağlı değilken önbellek kullanılmaz
+    (her okuma veritabanına gider); yeniden bağlanınca kaçırılmış olabilecek bildirimler yüzünden önbellek boşaltılır.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, on_change=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.on_change = on_change # Başka bir süreçten gelen her değişiklik bildiriminde chatbot ID'siyle çağrılır
+        self._entries: "OrderedDict[int, tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._min_versions: Dict[int, float] = {} # Bildirilen en son sürüm (silinenler için sonsuz)
+        self._lock = threading.Lock()
+        self._listening = False
+        self._listener_thread = None
+        self._stop_event = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.notifications = 0
+        self.listener_reconnects = 0
+
+    def get(self, chatbot_id: int) -> Dict[str, Any] | None:
+        with self._lock:
+            entry = self._entries.get(chatbot_id)
+            if not self._listening or entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                if entry is not None and self._listening:
+                    del self._entries[chatbot_id] # Süresi dolmuş kayıt
+                self.misses += 1
+                return None
+            self._entries.move_to_end(chatbot_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, chatbot_id: int, config: Dict[str, Any]):
+        with self._lock:
+            if not self._listening or config["config_version"] < self._min_versions.get(chatbot_id, 0):
+                return
+            self._entries[chatbot_id] = (time.monotonic(), config)
+            self._entries.move_to_end(chatbot_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, chatbot_id: int, version: int | None = None):
+        """`version`'dan eski kaydı atar ve o sürümden eskilerin yeniden yazılmasını engeller (None: chatbot silindi)."""
+        min_version = float("inf") if version is None else version
+        with self._lock:
+            self._min_versions[chatbot_id] = max(self._min_versions.get(chatbot_id, 0), min_version)
+            entry = self._entries.get(chatbot_id)
+            if entry is not None and entry[1]["config_version"] < min_version:
+                del self._entries[chatbot_id]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def start_listener(self, dsn: str):
+        if self._listener_thread is None:
+            self._stop_event.clear()
+            self._listener_thread = threading.Thread(target=self._listen, args=(dsn,), name="chatbot-config-listener", daemon=True)
+            self._listener_thread.start()
+
+    def stop_listener(self):
+        thread = self._listener_thread
+        if thread is not None:
+            self._stop_event.set()
+            thread.join()
+            self._listener_thread = None
+
+    def _listen(self, dsn: str):
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                # LISTEN, havuzdan bağımsız, autocommit modundaki ayrı bir bağlantıda tutulur
+                conn = psycopg2.connect(dsn)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHATBOT_CONFIG_CHANNEL};")
+                with self._lock:
+                    self._entries.clear()
+                    self._listening = True
+                while not self._stop_event.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._apply_notification(conn.notifies.pop(0).payload)
+            except Exception as e:
+                print(f"Chatbot yapılandırma dinleyicisi hatası, yeniden bağlanılacak: {e}")
+                with self._lock:
+                    self._listening = False
+                    self.listener_reconnects += 1
+                self._stop_event.wait(5)
+            finally:
+                with self._lock:
+                    self._listening = False
+                if conn is not None:
+                    conn.close()
+
+    def _apply_notification(self, payload: str):
+        chatbot_id, _, version = payload.partition(":")
+        try:
+            self.invalidate(int(chatbot_id), None if version == "deleted" else int(version))
+        except ValueError:
+            print(f"Geçersiz chatbot yapılandırma bildirimi: {payload}")
+            return
+        with self._lock:
+            self.notifications += 1
+        if self.on_change is not None:
+            self.on_change(int(chatbot_id))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "listening": self._listening,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "notifications": self.notifications,
+                "listener_reconnects": self.listener_reconnects,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+# nprobe/efSearch gibi arama parametreleri manifest'i değiştirmez; bu yüzden yapılandırma değişikliği bildirimi
+# chatbot'un önbellekteki FAISS indeksini de geçersiz kılar (bir sonraki yüklemede yeni parametreler uygulanır).
+chatbot_config_cache = ChatbotConfigCache(
+    CHATBOT_CONFIG_CACHE_MAX_ENTRIES,
+    CHATBOT_CONFIG_CACHE_TTL_SECONDS,
+    on_change=lambda chatbot_id: faiss_index_cache.invalidate(chatbot_id),
+)
+
+
+def get_chatbot_config(chatbot_id: int, conn=None) -> Dict[str, Any] | None:
+    """Chatbot'un yapılandırmasını önce önbellekten, yoksa veritabanından döndürür; chatbot yoksa None (önbelleğe alınmaz)."""
+    config = chatbot_config_cache.get(chatbot_id)
+    if config is not None:
+        return config
+    with db_connection(conn) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT {', '.join(CHATBOT_CONFIG_COLUMNS)} FROM chatbots WHERE id = %s;", (chatbot_id,))
+            row = cursor.fetchone()
+    if row is None:
+        return None
+    config = dict(zip(CHATBOT_CONFIG_COLUMNS, row))
+    chatbot_config_cache.put(chatbot_id, config)
+    return config
+
+
+def publish_chatbot_config_change(cursor, chatbot_id: int, version: int | None):
+    """
+    Yapılandırma değişikliğini yazma işleminin içinde NOTIFY ile yayınlar; bildirim yalnızca commit olursa
+    diğer süreçlere ulaşır. `version` None ise chatbot silinmiştir. Commit'ten sonra yerel önbellek de
+    `chatbot_config_cache.invalidate` ile hemen güncellenmelidir.
+    """
+    payload = f"{chatbot_id}:{'deleted' if version is None else version}"
+    cursor.execute("SELECT pg_notify(%s, %s);", (CHATBOT_CONFIG_CHANNEL, payload))
 
 
 def create_tables():
@@ -174,6 +911,19 @@ def create_tables():
             );
         """)
 
+        # Parça embedding'leri: FAISS dosyası bozulursa indeks yeniden embed etmeden buradan kurulur
+        cur.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS embedding BYTEA;")
+
+        # İçerik hash'ine göre embedding önbelleği: aynı parça farklı chatbot'lara veya tekrar yüklendiğinde yeniden embed edilmez
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                content_hash BYTEA PRIMARY KEY, -- sha256(model adı + normalize edilmiş metin)
+                model VARCHAR(255) NOT NULL,
+                embedding BYTEA NOT NULL,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
         # `chatbots` tablosu
         cur.execute("""
             CREATE TABLE IF NOT EXISTS chatbots (
@@ -184,6 +934,19 @@ def create_tables():
             );
         """)
 
+        # Chatbot bazında indeks tipi politikası (NULL değerler ortam değişkenlerindeki varsayılanları kullanır)
+        cur.execute("""
+            ALTER TABLE chatbots
+                ADD COLUMN IF NOT EXISTS index_type VARCHAR(16),
+                ADD COLUMN IF NOT EXISTS index_codec VARCHAR(16),
+                ADD COLUMN IF NOT EXISTS index_promotion_threshold INTEGER,
+                ADD COLUMN IF NOT EXISTS index_nprobe INTEGER,
+                ADD COLUMN IF NOT EXISTS index_ef_search INTEGER,
+                ADD COLUMN IF NOT EXISTS index_storage VARCHAR(16);
+        """)
+        # Her yapılandırma değişikliğinde artırılır; süreç içi önbellekler eski kayıtları bu sürümle ayırt eder
+        cur.execute("ALTER TABLE chatbots ADD COLUMN IF NOT EXISTS config_version BIGINT NOT NULL DEFAULT 1;")
+
         # `chatbot_documents` ara tablosu
         cur.execute("""
             CREATE TABLE IF NOT EXISTS chatbot_documents (
@@ -194,19 +957,122 @@ def create_tables():
             );
         """)
 
-        # Yeni `chat_messages` tablosu
+        # Yeniden yüklemelerde değişmeyen içeriği atlamak için parça ve dosya içerik hash'leri
+        cur.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash BYTEA;")
         cur.execute("""
-            CREATE TABLE IF NOT EXISTS chat_messages (
+            CREATE TABLE IF NOT EXISTS chatbot_files (
+                chatbot_id INTEGER NOT NULL REFERENCES chatbots(id) ON DELETE CASCADE,
+                original_filename VARCHAR(255) NOT NULL,
+                content_hash BYTEA NOT NULL, -- sha256(dosya baytları)
+                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (chatbot_id, original_filename)
+            );
+        """)
+
+        # Arka planda işlenen belge yükleme işleri ve ilerleme durumları
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                id SERIAL PRIMARY KEY,
+                chatbot_id INTEGER NOT NULL REFERENCES chatbots(id) ON DELETE CASCADE,
+                filename VARCHAR(255) NOT NULL,
+                status VARCHAR(16) NOT NULL DEFAULT 'queued', -- queued, running, succeeded, failed
+                stage VARCHAR(16) NOT NULL DEFAULT 'queued', -- queued, processing, committed, indexed
+                progress REAL NOT NULL DEFAULT 0,
+                total_chunks INTEGER,
+                error TEXT,
+                result JSONB,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        # Başarısız işlerin yeniden denenebilmesi için geçici dosya yolları ve loader adları
+        cur.execute("ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS files JSONB;")
+        # İşi üstlenen süreç ve kirasının bitişi; kirası süren işlere başka bir worker dokunmaz (bkz. JobLeaseKeeper)
+        cur.execute("""
+            ALTER TABLE ingestion_jobs
+                ADD COLUMN IF NOT EXISTS owner VARCHAR(128),
+                ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE;
+        """)
+        # Eski sürümlerin aşama adları yeni aşamalara çevrilir (eski "embedded" commit'ten sonra raporlanıyordu)
+        cur.execute("""
+            UPDATE ingestion_jobs SET stage = CASE WHEN stage = 'embedded' THEN 'committed' ELSE 'processing' END
+            WHERE stage IN ('parsed', 'chunked', 'stored', 'embedded');
+        """)
+
+        # Depolama modu değişikliklerinde vektörlerin yeni depoya taşınması işleri (bkz. run_storage_move_job)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS storage_move_jobs (
                 id SERIAL PRIMARY KEY,
                 chatbot_id INTEGER NOT NULL REFERENCES chatbots(id) ON DELETE CASCADE,
+                from_storage VARCHAR(16), -- NULL: varsayılan depolama modu
+                to_storage VARCHAR(16),
+                status VARCHAR(16) NOT NULL DEFAULT 'queued', -- queued, running, succeeded, failed
+                error TEXT,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        # Taşımayı üstlenen süreç ve kirasının bitişi (bkz. JobLeaseKeeper)
+        cur.execute("""
+            ALTER TABLE storage_move_jobs
+                ADD COLUMN IF NOT EXISTS owner VARCHAR(128),
+                ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE;
+        """)
+        # Bir chatbot için aynı anda en fazla bir taşıma işi bekler veya çalışır; kirası süren taşıma
+        # başarısız sayılmadığı için yer, sahibi taşımayı bitirene ya da kirası dolana kadar boşalmaz
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS storage_move_jobs_active_idx ON storage_move_jobs (chatbot_id)
+            WHERE status IN ('queued', 'running');
+        """)
+
+        # Sohbet oturumları: bir son kullanıcının bir chatbot ile yaptığı ayrı konuşma
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS chat_sessions (
+                id UUID PRIMARY KEY,
+                chatbot_id INTEGER NOT NULL REFERENCES chatbots(id) ON DELETE CASCADE,
+                created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                last_active_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+        # Eski sürümlerin bölümlenmemiş `chat_messages` tablosu yalnızca yeniden adlandırılır (anlık bir katalog
+        # değişikliği); mesajları başlangıcı bloklamadan migrate_chat_messages.py ile batch'ler halinde taşınır.
+        # Dizin ve sequence adları yeni tablonunkilerle çakışmasın diye yeniden adlandırılır.
+        cur.execute("SELECT relkind FROM pg_class WHERE relname = 'chat_messages' AND pg_table_is_visible(oid);")
+        row = cur.fetchone()
+        migrate_legacy_messages = row is not None and row[0] == 'r'
+        if migrate_legacy_messages:
+            cur.execute("ALTER TABLE chat_messages RENAME TO chat_messages_unpartitioned;")
+            cur.execute("ALTER INDEX IF EXISTS chat_messages_pkey RENAME TO chat_messages_unpartitioned_pkey;")
+            cur.execute("ALTER SEQUENCE IF EXISTS chat_messages_id_seq RENAME TO chat_messages_unpartitioned_id_seq;")
+
+        # `chat_messages` tablosu, zaman damgasına göre aylık bölümlere ayrılmıştır (bkz. create_chat_message_partitions).
+        # Bölüm anahtarı birincil anahtarda yer almak zorundadır. Oturum silindiğinde mesajları da silinir.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                id BIGSERIAL,
+                chatbot_id INTEGER NOT NULL,
+                session_id UUID NOT NULL REFERENCES chat_sessions(id) ON DELETE CASCADE,
                 sender VARCHAR(50) NOT NULL, -- 'user' veya 'bot'
                 message TEXT NOT NULL,
-                timestamp TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-            );
+                timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp);
         """)
+        # Bölümlenmiş tabloda CONCURRENTLY kullanılamaz; indeks burada, tablo boşken oluşturulur ve
+        # sonradan eklenen her bölüme otomatik uygulanır. Oturum geçmişi penceresi ve sayfalama bu indeksi kullanır.
+        cur.execute("CREATE INDEX IF NOT EXISTS chat_messages_session_id_timestamp_idx ON chat_messages (session_id, timestamp, id);")
+        if migrate_legacy_messages:
+            # Taşıma sürerken yazılan yeni mesajların id'leri eski mesajlarınkiyle çakışmaz (MAX birincil anahtardan okunur)
+            cur.execute("SELECT setval(pg_get_serial_sequence('chat_messages', 'id'), COALESCE((SELECT MAX(id) FROM chat_messages_unpartitioned), 0) + 1, false);")
+        create_chat_message_partitions(cur)
+
+        cur.execute("SELECT to_regclass('chat_messages_unpartitioned') IS NOT NULL;")
+        if cur.fetchone()[0]:
+            print("Eski sohbet mesajları henüz taşınmadı; taşımak için `python migrate_chat_messages.py` çalıştırın.")
 
         conn.commit()
-        print("`documents`, `chatbots`, `chatbot_documents` ve `chat_messages` tabloları başarıyla kontrol edildi/oluşturuldu.")
+        print("`documents`, `chatbots`, `chatbot_documents`, `chat_sessions` ve `chat_messages` tabloları başarıyla kontrol edildi/oluşturuldu.")
     except Exception as e:
         print(f"Tablo oluşturma hatası: {e}")
         raise HTTPException(status_code=500, detail="Veritabanı tablo oluşturma hatası.")
@@ -214,68 +1080,2543 @@ def create_tables():
         if conn:
             cur.close()
             conn.close()
+
+
+# Sık kullanılan sorgular için indeksler: (ad, tablo ve sütunlar)
+DATABASE_INDEXES = (
+    # Chatbot'un oturum listesi ve chatbot silinirken cascade
+    ("chat_sessions_chatbot_id_last_active_idx", "chat_sessions (chatbot_id, last_active_at)"),
+    # Parça silinirken chatbot_documents'a cascade (birincil anahtar chatbot_id ile başlar)
+    ("chatbot_documents_document_id_idx", "chatbot_documents (document_id)"),
+    # Yeniden yüklemede dosyanın mevcut parçalarının bulunması
+    ("chatbot_documents_chatbot_id_filename_idx", "chatbot_documents (chatbot_id, original_filename)"),
+)
+
+
+def create_indexes():
+    """
+    Eksik indeksleri oluşturur (migration). Dolu tablolarda yazmaları kilitlememek için CONCURRENTLY kullanılır;
+    bu yüzden işlem (transaction) dışında, autocommit modunda çalışır. Yarıda kalmış bir önceki denemenin
+    bıraktığı geçersiz (INVALID) indeks silinip yeniden oluşturulur.
+    """
+    conn = get_db_connection()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for index_name, definition in DATABASE_INDEXES:
+                cur.execute(
+                    """
+                    SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                    WHERE c.relname = %s AND pg_table_is_visible(c.oid);
+                    """,
+                    (index_name,)
+                )
+                row = cur.fetchone()
+                if row and row[0]:
+                    continue
+                if row:
+                    cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name};")
+                started = time.perf_counter()
+                cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {definition};")
+                print(f"'{index_name}' indeksi {time.perf_counter() - started:.1f} sn'de oluşturuldu.")
+    except Exception as e:
+        print(f"İndeks oluşturma hatası: {e}")
+        raise HTTPException(status_code=500, detail="Veritabanı indeks oluşturma hatası.")
+    finally:
+        if not conn.closed:
+            conn.autocommit = False # Bağlantı havuza varsayılan modda dönmeli
+        conn.close()
+
+
+def add_months(month: date, count: int) -> date:
+    """Ayın ilk gününe `count` ay ekler (negatif olabilir)."""
+    month_index = month.year * 12 + month.month - 1 + count
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def chat_message_partition_name(month: date) -> str:
+    return f"chat_messages_y{month.year}m{month.month:02d}"
+
+
+def create_chat_message_partitions(cur, first_month: date | None = None) -> date:
+    """
+    `chat_messages` için `first_month`'tan (verilmezse bu aydan) CHAT_MESSAGE_PARTITION_MONTHS_AHEAD ay sonrasına
+    kadar eksik aylık bölümleri oluşturur ve veritabanına göre bu ayın ilk gününü döndürür. Varsayılan (DEFAULT)
+    bölüm yoktur: içi dolu bir varsayılan bölüm, o aralık için sonradan bölüm oluşturulmasını engellerdi.
+    """
+    cur.execute("SELECT date_trunc('month', CURRENT_TIMESTAMP)::date;")
+    current_month = cur.fetchone()[0]
+    month = min(first_month or current_month, current_month)
+    last_month = add_months(current_month, CHAT_MESSAGE_PARTITION_MONTHS_AHEAD)
+    while month <= last_month:
+        next_month = add_months(month, 1)
+        cur.execute(
+            f"CREATE TABLE IF NOT EXISTS {chat_message_partition_name(month)} PARTITION OF chat_messages FOR VALUES FROM (%s) TO (%s);",
+            (month.isoformat(), next_month.isoformat())
+        )
+        month = next_month
+    return current_month
+
+
+def list_chat_message_partitions(cur) -> List[tuple]:
+    """`chat_messages` bölümlerini (ad, ay, tahmini satır sayısı) olarak, aya göre sıralı döndürür."""
+    cur.execute(
+        """
+        SELECT c.relname, c.reltuples FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'chat_messages' AND pg_table_is_visible(p.oid);
+        """
+    )
+    partitions = []
+    for name, row_estimate in cur.fetchall():
+        match = re.fullmatch(r"chat_messages_y(\d{4})m(\d{2})", name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1), max(int(row_estimate), 0)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+# Bölüm bakımının en son yapıldığı ay; bakım ayda bir kez, ilk yazımdan önce çalışır
+_chat_partitions_maintained_month: date | None = None
+_chat_partitions_lock = threading.Lock()
+
+
+def maintain_chat_message_partitions(force: bool = False) -> Dict[str, Any]:
+    """
+    İleri tarihli aylık bölümleri oluşturur ve CHAT_MESSAGE_RETENTION_MONTHS ayarlıysa saklama süresini aşan
+    bölümleri DROP ile (satır satır DELETE yapmadan) siler; o tarihten beri kullanılmayan oturumlar da silinir.
+    Bu süreçte bu ay zaten yapıldıysa (`force` verilmedikçe) hiçbir şey yapmaz.
+    """
+    global _chat_partitions_maintained_month
+    this_month = date.today().replace(day=1)
+    with _chat_partitions_lock:
+        if not force and _chat_partitions_maintained_month == this_month:
+            return {"skipped": True}
+        dropped_partitions = []
+        deleted_sessions = 0
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    current_month = create_chat_message_partitions(cur)
+                    if CHAT_MESSAGE_RETENTION_MONTHS > 0:
+                        cutoff = add_months(current_month, -CHAT_MESSAGE_RETENTION_MONTHS)
+                        for name, month, _ in list_chat_message_partitions(cur):
+                            if add_months(month, 1) <= cutoff:
+                                cur.execute(f"DROP TABLE IF EXISTS {name};")
+                                dropped_partitions.append(name)
+                        cur.execute("DELETE FROM chat_sessions WHERE last_active_at < %s;", (cutoff.isoformat(),))
+                        deleted_sessions = cur.rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        _chat_partitions_maintained_month = this_month
+    if dropped_partitions or deleted_sessions:
+        print(f"Sohbet saklama süresi uygulandı: {len(dropped_partitions)} bölüm ve {deleted_sessions} oturum silindi.")
+    return {"skipped": False, "dropped_partitions": dropped_partitions, "deleted_sessions": deleted_sessions}
+
+
+def migrate_legacy_chat_messages(batch_size: int = CHAT_MESSAGE_MIGRATION_BATCH_SIZE) -> int:
+    """
+    Eski sürümlerden kalan `chat_messages_unpartitioned` tablosundaki mesajları bölümlenmiş `chat_messages`
+    tablosuna taşır ve taşınan mesaj sayısını döndürür. Eski mesajlar chatbot başına tek bir oturumda toplanır
+    (oturum ID'si chatbot ID'sinden türetilir). Her batch eski tablodan ayrı bir işlemde (transaction) silinip
+    yenisine yazılır; böylece uzun süreli kilit tutulmaz, sunucu çalışırken yapılabilir ve yarıda kesilirse
+    kaldığı yerden devam eder. Saklama süresini (CHAT_MESSAGE_RETENTION_MONTHS) aşmış mesajlar taşınmaz.
+    Tablo boşalınca silinir.
+    """
+    migrated_count = 0
+    with db_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT to_regclass('chat_messages_unpartitioned') IS NOT NULL;")
+                if not cur.fetchone()[0]:
+                    return 0
+                cutoff = None
+                if CHAT_MESSAGE_RETENTION_MONTHS > 0:
+                    cur.execute("SELECT date_trunc('month', CURRENT_TIMESTAMP)::date;")
+                    cutoff = add_months(cur.fetchone()[0], -CHAT_MESSAGE_RETENTION_MONTHS)
+                cur.execute("SELECT date_trunc('month', MIN(COALESCE(timestamp, CURRENT_TIMESTAMP)))::date FROM chat_messages_unpartitioned;")
+                first_month = cur.fetchone()[0]
+                if first_month is not None and cutoff is not None:
+                    first_month = max(first_month, cutoff)
+                create_chat_message_partitions(cur, first_month)
+                cur.execute("""
+                    INSERT INTO chat_sessions (id, chatbot_id, created_at, last_active_at)
+                    SELECT md5('legacy-' || chatbot_id)::uuid, chatbot_id,
+                           MIN(COALESCE(timestamp, CURRENT_TIMESTAMP)), MAX(COALESCE(timestamp, CURRENT_TIMESTAMP))
+                    FROM chat_messages_unpartitioned
+                    GROUP BY chatbot_id
+                    ON CONFLICT (id) DO NOTHING;
+                """)
+            conn.commit()
+
+            while True:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        WITH batch AS (
+                            DELETE FROM chat_messages_unpartitioned
+                            WHERE id IN (SELECT id FROM chat_messages_unpartitioned ORDER BY id LIMIT %(batch_size)s)
+                            RETURNING id, chatbot_id, sender, message, COALESCE(timestamp, CURRENT_TIMESTAMP) AS timestamp
+                        )
+                        INSERT INTO chat_messages (id, chatbot_id, session_id, sender, message, timestamp)
+                        SELECT id, chatbot_id, md5('legacy-' || chatbot_id)::uuid, sender, message, timestamp
+                        FROM batch
+                        WHERE %(cutoff)s::date IS NULL OR timestamp >= %(cutoff)s::date;
+                        """,
+                        {"batch_size": batch_size, "cutoff": cutoff.isoformat() if cutoff else None}
+                    )
+                    migrated_count += cur.rowcount
+                    cur.execute("SELECT EXISTS (SELECT 1 FROM chat_messages_unpartitioned);")
+                    remaining = cur.fetchone()[0]
+                    if not remaining:
+                        cur.execute("DROP TABLE chat_messages_unpartitioned;")
+                conn.commit()
+                if not remaining:
+                    break
+        except Exception:
+            conn.rollback()
+            raise
+    print(f"{migrated_count} sohbet mesajı bölümlenmiş `chat_messages` tablosuna taşındı.")
+    return migrated_count
 # --- ---
 
 # --- FAISS İndeksi Kaydetme ve Yükleme Fonksiyonları ---
-def load_or_create_faiss_index(chatbot_id: int):
-    """Belirli bir chatbot'un FAISS indeksini diskten yükler veya yeni bir boş indeks oluşturur."""
-    chatbot_faiss_path = os.path.join(FAISS_INDEX_DIR, f"faiss_index_{chatbot_id}.bin")
+# Disk düzeni (her chatbot için):
+#   faiss_index_{id}.manifest.json    -> geçerli taban indeksin ve delta segmentlerinin listesi
+#   <parça>.faiss                     -> FAISS'in kendi formatında ham indeks (mmap ile açılabilir)
+#   <parça>.ids.json                  -> index_to_docstore_id eşlemesi
+#   <parça>.docstore.jsonl            -> docstore içeriği (satır başına bir belge parçası, ilk ihtiyaçta okunur)
+# Taban indeks "faiss_index_{id}" veya "faiss_index_{id}.g{n}", delta segmentleri "faiss_index_{id}.seg{n}" önekini kullanır.
+# Belge yüklemeleri yalnızca yeni bir delta segmenti yazar; segmentler arka planda tabana birleştirilir (compaction).
+# İndeksler IndexIDMap2 ile `documents.id` değerlerine göre anahtarlanır; docstore anahtarı da str(documents.id)'dir.
+# Kaldırılan belgeler manifest'teki "removed_ids" listesine yazılır, yüklemede remove_ids ile uygulanır ve compaction'da kalıcılaşır.
+# Aşağıdaki fonksiyonlar bir "depo anahtarı" ile çalışır: ayrı dosyalı chatbot'lar için chatbot ID'si (int),
+# ortak parçadaki chatbot'lar için "shared_{n}" (bkz. index_store_key).
+# Eski sürümlerin pickle tabanlı faiss_index_{id}.bin dosyaları ilk yüklemede bu formata dönüştürülür.
+
+class LazyJsonlDocstore(InMemoryDocstore):
+    """
+    Belge parçalarını, ilk erişimde JSONL yan dosyasından okuyan InMemoryDocstore. Dosya nesne oluşturulurken
+    açılır ve içerik okunana kadar açık tutulur: compaction veya yeniden eğitim eski nesli sildiğinde de
+    (POSIX'te açık bir dosyanın içeriği silinmez) önbellekteki indeks kendi docstore'unu okuyabilir.
+    Dosya yoksa nesne oluşturulamaz (FileNotFoundError); eksik docstore asla boş docstore gibi davranmaz.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._file = open(path, "r", encoding="utf-8")
+        self._file_size = os.fstat(self._file.fileno()).st_size
+        self._loaded_dict: Dict[str, Document] | None = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded_dict is not None
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def file_size(self) -> int:
+        return self._file_size
+
+    @property
+    def _dict(self) -> Dict[str, Document]:
+        if self._loaded_dict is None:
+            with self._load_lock:
+                if self._loaded_dict is None:
+                    try:
+                        self._loaded_dict = parse_docstore_jsonl(self._file)
+                    finally:
+                        self._file.close()
+        return self._loaded_dict
+
+    @_dict.setter
+    def _dict(self, value: Dict[str, Document]):
+        self._loaded_dict = value
+
+    def __del__(self):
+        file = getattr(self, "_file", None)
+        if file is not None:
+            file.close()
+
+
+class LayeredDocstore(Docstore):
+    """
+    Katmanlı yüklenen bir indeksin docstore'u (bkz. _layer_faiss_changes): delta segmentlerinin belgeleri bellekte,
+    diğerleri tabanın tembel docstore'unda aranır. Segment eklemek için taban docstore'u belleğe okunmaz.
+    """
+
+    def __init__(self, base, delta: InMemoryDocstore):
+        self.base = base
+        self.delta = delta
+
+    def search(self, search: str):
+        doc = self.delta.search(search)
+        return doc if isinstance(doc, Document) else self.base.search(search)
+
+
+def _faiss_index_prefix(chatbot_id: int) -> str:
+    return os.path.join(FAISS_INDEX_DIR, f"faiss_index_{chatbot_id}")
+
+
+def _faiss_manifest_path(chatbot_id: int) -> str:
+    return f"{_faiss_index_prefix(chatbot_id)}.manifest.json"
+
+
+def faiss_index_file_paths(chatbot_id: int) -> List[str]:
+    """Bir chatbot'a ait (eski format, segmentler ve manifest dahil) tüm FAISS dosyalarının yollarını döndürür."""
+    prefix_name = os.path.basename(_faiss_index_prefix(chatbot_id))
+    if not os.path.isdir(FAISS_INDEX_DIR):
+        return []
+    return [
+        os.path.join(FAISS_INDEX_DIR, name) for name in os.listdir(FAISS_INDEX_DIR)
+        if name.startswith(f"{prefix_name}.")
+    ]
+
+
+def parse_docstore_jsonl(lines) -> Dict[str, Document]:
+    docs: Dict[str, Document] = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        docs[record["id"]] = Document(page_content=record["page_content"], metadata=record.get("metadata", {}))
+    return docs
+
+
+def _atomic_write(path: str, write_fn):
+    """Dosyayı geçici bir isimle yazıp tek adımda yerine koyar; okuyucular yarım dosya görmez."""
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        write_fn(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _write_json(path: str, payload: Any):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+
+
+def _write_docstore_jsonl(path: str, docs: Dict[str, Document]):
+    with open(path, "w", encoding="utf-8") as f:
+        for doc_id, doc in docs.items():
+            f.write(json.dumps({"id": doc_id, "page_content": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False))
+            f.write("\n")
+
+
+def _read_faiss_index_file(path: str, writable: bool):
+    """Ham FAISS indeksini okur. Salt okunur kullanımda dosya mmap ile açılır ve işlemler arasında page cache paylaşılır."""
+    if not writable:
+        mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            return faiss.read_index(path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            # Bazı indeks tipleri/FAISS sürümleri mmap desteklemez; normal okumaya düşüyoruz.
+            print(f"'{path}' mmap ile açılamadı ({e}), normal okuma yapılıyor.")
+    return faiss.read_index(path)
+
+
+def _write_faiss_part(prefix: str, faiss_store: FAISS):
+    """Bir FAISS nesnesini verilen önekle (taban veya segment) üç dosya olarak yazar."""
+    docs = faiss_store.docstore._dict
+    ids_payload = {"index_to_docstore_id": [[pos, doc_id] for pos, doc_id in faiss_store.index_to_docstore_id.items()]}
+    _atomic_write(f"{prefix}.docstore.jsonl", lambda p: _write_docstore_jsonl(p, docs))
+    _atomic_write(f"{prefix}.ids.json", lambda p: _write_json(p, ids_payload))
+    _atomic_write(f"{prefix}.faiss", lambda p: faiss.write_index(faiss_store.index, p))
+
+
+def _read_faiss_part(prefix: str, writable: bool) -> FAISS:
+    index = _read_faiss_index_file(f"{prefix}.faiss", writable)
+    with open(f"{prefix}.ids.json", "r", encoding="utf-8") as f:
+        index_to_docstore_id = {int(pos): doc_id for pos, doc_id in json.load(f)["index_to_docstore_id"]}
+    return FAISS(
+        embedding_function=embeddings.embed_query,
+        index=index,
+        docstore=LazyJsonlDocstore(f"{prefix}.docstore.jsonl"),
+        index_to_docstore_id=index_to_docstore_id
+    )
+
+
+def _remove_faiss_part(prefix: str):
+    for suffix in (".faiss", ".ids.json", ".docstore.jsonl"):
+        if os.path.exists(f"{prefix}{suffix}"):
+            os.remove(f"{prefix}{suffix}")
+
+
+def read_faiss_manifest(chatbot_id: int) -> Dict[str, Any]:
+    """Manifest'i okur. Manifest yoksa (önceki format) taban indeks doğrudan faiss_index_{id} önekidir."""
+    manifest_path = _faiss_manifest_path(chatbot_id)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    base_name = os.path.basename(_faiss_index_prefix(chatbot_id))
+    has_base = os.path.exists(os.path.join(FAISS_INDEX_DIR, f"{base_name}.faiss"))
+    return {"base": base_name if has_base else None, "segments": [], "next_seq": 1}
+
+
+def _write_faiss_manifest(chatbot_id: int, manifest: Dict[str, Any]):
+    _atomic_write(_faiss_manifest_path(chatbot_id), lambda p: _write_json(p, manifest))
+
+
+def faiss_manifest_stamp(chatbot_id: int) -> tuple | None:
+    """
+    Manifest dosyasının kimliği (inode, mtime, boyut). Manifest her değişiklikte atomik olarak yeniden yazıldığı
+    için, başka bir worker'ın yaptığı her segment/silme/compaction/yeniden eğitim bu değeri değiştirir.
+    """
+    try:
+        stat = os.stat(_faiss_manifest_path(chatbot_id))
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+_faiss_write_locks: Dict[int, threading.Lock] = {}
+_faiss_write_locks_guard = threading.Lock()
+
+
+class faiss_write_lock:
+    """
+    Bir chatbot'un indeks dosyalarını değiştiren işlemleri (segment ekleme, compaction, tam kayıt) sıralar.
+    Aynı süreçteki thread'ler için threading.Lock, farklı uvicorn worker'ları için dosya kilidi (flock) kullanılır.
+    """
+
+    def __init__(self, chatbot_id: int):
+        self.chatbot_id = chatbot_id
+        with _faiss_write_locks_guard:
+            self._thread_lock = _faiss_write_locks.setdefault(chatbot_id, threading.Lock())
+        self._lock_file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            os.makedirs(FAISS_INDEX_DIR, exist_ok=True)
+            self._lock_file = open(os.path.join(FAISS_INDEX_DIR, f".faiss_index_{self.chatbot_id}.lock"), "a")
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        except Exception:
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+        finally:
+            self._thread_lock.release()
+
+
+def _create_empty_faiss_index() -> FAISS:
+    # IndexIDMap2 sayesinde vektörler documents.id ile eklenir ve remove_ids ile tek tek silinebilir.
+    faiss_base_index = faiss.IndexIDMap2(faiss.IndexFlatL2(GEMINI_EMBEDDING_DIM))
+    return FAISS(
+        embedding_function=embeddings.embed_query,
+        index=faiss_base_index,
+        docstore=InMemoryDocstore(), # Boş bir In-Memory Docstore oluştur
+        index_to_docstore_id={} # Boş bir mapping sözlüğü
+    )
+
+
+def _migrate_legacy_faiss_index(chatbot_id: int):
+    """Eski pickle tabanlı .bin dosyasını yeni disk formatına dönüştürür ve siler."""
+    legacy_path = f"{_faiss_index_prefix(chatbot_id)}.bin"
+    with open(legacy_path, "rb") as f:
+        faiss_bytes = f.read()
+    # Bu dosyalar yalnızca bu uygulamanın eski sürümü tarafından yazıldığı için tek seferlik
+    # dönüşümde pickle açılmasına izin veriyoruz; normal yükleme yolu artık pickle kullanmaz.
+    legacy_index = FAISS.deserialize_from_bytes(faiss_bytes, embeddings, allow_dangerous_deserialization=True)
+    save_faiss_index(legacy_index, chatbot_id)
+    os.remove(legacy_path)
+    print(f"Chatbot ID {chatbot_id} için eski formattaki FAISS indeksi yeni formata dönüştürüldü.")
+
+
+def _is_id_mapped(faiss_store: FAISS) -> bool:
+    return hasattr(faiss_store.index, "id_map")
+
+
+def _inner_index(index):
+    """IndexIDMap2 sarmalayıcısının içindeki asıl indeksi (Flat/IVF/HNSW) somut tipiyle döndürür."""
+    return faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+
+
+def describe_index_type(index) -> str:
+    inner = _inner_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf"
+    if hasattr(inner, "hnsw"):
+        return "hnsw"
+    if isinstance(inner, (faiss.IndexFlat, faiss.IndexScalarQuantizer, faiss.IndexPQ)):
+        return "flat" # Tam (kaba kuvvet) arama; vektörler sıkıştırılmış olabilir
+    return type(inner).__name__
+
+
+def describe_index_codec(index) -> str:
+    """İndeksin vektörleri hangi sıkıştırmayla sakladığını döndürür ("none", "fp16", "sq8", "pq")."""
+    codes = _inner_index(index)
+    if hasattr(codes, "hnsw"):
+        codes = faiss.downcast_index(codes.storage)
+    if isinstance(codes, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "fp16" if codes.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    if isinstance(codes, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    return "none"
+
+
+def _id_mapped_vectors(faiss_store: FAISS) -> tuple:
+    """IndexIDMap2 bir indeksteki vektörleri ve documents.id değerlerini döndürür."""
+    ntotal = faiss_store.index.ntotal
+    ids = faiss.vector_to_array(faiss_store.index.id_map).astype(np.int64)
+    if not ntotal:
+        return np.empty((0, faiss_store.index.d), dtype=np.float32), ids
+    inner = _inner_index(faiss_store.index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.make_direct_map() # IVF'de konuma göre reconstruct için gerekli
+    return inner.reconstruct_n(0, ntotal), ids
+
+
+def _convert_to_id_mapped(faiss_store: FAISS) -> FAISS:
+    """Konum tabanlı eski bir indeksi, vektörleri yeniden embed etmeden documents.id anahtarlı indekse çevirir."""
+    converted = _create_empty_faiss_index()
+    vectors, ids, docs = [], [], {}
+    for pos, docstore_id in faiss_store.index_to_docstore_id.items():
+        doc = faiss_store.docstore.search(docstore_id)
+        if not isinstance(doc, Document) or doc.metadata.get("doc_id") is None:
+            continue
+        doc_id = int(doc.metadata["doc_id"])
+        vectors.append(faiss_store.index.reconstruct(pos))
+        ids.append(doc_id)
+        docs[str(doc_id)] = doc
+    if ids:
+        converted.index.add_with_ids(np.array(vectors, dtype=np.float32), np.array(ids, dtype=np.int64))
+        converted.docstore.add(docs)
+        converted.index_to_docstore_id.update({doc_id: str(doc_id) for doc_id in ids})
+    return converted
+
+
+def _merge_faiss_segment(target: FAISS, segment: FAISS):
+    """Bir delta segmentindeki vektörleri ve belgeleri hedef indekse ekler. Tabanda zaten bulunan id'ler atlanır."""
+    vectors, ids = _id_mapped_vectors(segment)
+    is_new = np.array([int(doc_id) not in target.index_to_docstore_id for doc_id in ids], dtype=bool)
+    vectors, ids = vectors[is_new], ids[is_new]
+    if len(ids) == 0:
+        return
+    target.index.add_with_ids(vectors, ids)
+    target.docstore.add({segment.index_to_docstore_id[int(doc_id)]: segment.docstore.search(segment.index_to_docstore_id[int(doc_id)]) for doc_id in ids})
+    target.index_to_docstore_id.update({int(doc_id): segment.index_to_docstore_id[int(doc_id)] for doc_id in ids})
+
+
+def remove_ids_from_faiss_index(faiss_store: FAISS, doc_ids: List[int]) -> int:
+    """Verilen documents.id değerlerine ait vektörleri ve docstore girdilerini siler. Silinen vektör sayısını döndürür."""
+    present_ids = [doc_id for doc_id in doc_ids if doc_id in faiss_store.index_to_docstore_id]
+    if not present_ids:
+        return 0
+    try:
+        removed = faiss_store.index.remove_ids(np.array(present_ids, dtype=np.int64))
+    except RuntimeError:
+        # HNSW gibi remove_ids desteklemeyen indekslerde kalan vektörlerle aynı tipte yeni bir indeks kurulur.
+        vectors, ids = _id_mapped_vectors(faiss_store)
+        keep = ~np.isin(ids, np.array(present_ids, dtype=np.int64))
+        faiss_store.index = build_faiss_index(describe_index_type(faiss_store.index), vectors[keep], ids[keep], describe_index_codec(faiss_store.index))
+        removed = int((~keep).sum())
+    docstore_ids = [faiss_store.index_to_docstore_id.pop(doc_id) for doc_id in present_ids]
+    faiss_store.docstore.delete(docstore_ids)
+    return int(removed)
+
+
+def _layer_faiss_changes(base_store: FAISS, segments: List[str], removed_ids: List[int]) -> FAISS:
+    """
+    mmap ile salt okunur açılmış tabanı değiştirmeden delta segmentlerini ve silmeleri uygular. Segmentler bellekte
+    ayrı, küçük bir düz indekste birleştirilir; tabandaki silinmiş id'ler eşlemeden çıkarılır ve arama anında
+    seçiciyle (IDSelector) dışlanır (bkz. search_faiss_store). Böylece taban, bekleyen değişiklikler compaction'la
+    birleştirilene kadar da süreçler arasında page cache'te paylaşılır.
+    """
+    delta = _create_empty_faiss_index()
+    for segment_name in segments:
+        _merge_faiss_segment(delta, _read_faiss_part(os.path.join(FAISS_INDEX_DIR, segment_name), writable=True))
+    # Birleştirmedeki gibi tabanda zaten bulunan id'ler segmentten alınmaz
+    remove_ids_from_faiss_index(delta, [doc_id for doc_id in delta.index_to_docstore_id if doc_id in base_store.index_to_docstore_id])
+    remove_ids_from_faiss_index(delta, removed_ids)
+    base_removed = [doc_id for doc_id in removed_ids if base_store.index_to_docstore_id.pop(doc_id, None) is not None]
+    base_store.index_to_docstore_id.update(delta.index_to_docstore_id)
+    base_store.docstore = LayeredDocstore(base_store.docstore, delta.docstore)
+    base_store._delta_index = delta.index
+    base_store._removed_ids = np.array(base_removed, dtype=np.int64)
+    return base_store
+
+
+def _load_faiss_from_manifest(manifest: Dict[str, Any], writable: bool) -> tuple:
+    """
+    Taban indeksi yükler, delta segmentlerini sırasıyla üzerine uygular ve silinmiş belgeleri çıkarır.
+    `writable=False` iken taban mmap ile salt okunur açılır ve bekleyen değişiklikler tabana kopyalanmadan
+    katman olarak eklenir (bkz. _layer_faiss_changes); böyle bir nesnede arama search_faiss_store ile yapılmalıdır.
+    (indeks, eski formattan dönüştürüldü_mü) döndürür.
+    """
+    segments = manifest.get("segments", [])
+    removed_ids = manifest.get("removed_ids", [])
+    if manifest.get("base") is None and not segments:
+        return None, False
+    converted = False
+    if manifest.get("base") is not None:
+        current_faiss_index = _read_faiss_part(os.path.join(FAISS_INDEX_DIR, manifest["base"]), writable)
+        if not _is_id_mapped(current_faiss_index):
+            current_faiss_index = _convert_to_id_mapped(current_faiss_index)
+            converted = True
+        elif not writable and (segments or removed_ids):
+            return _layer_faiss_changes(current_faiss_index, segments, removed_ids), converted
+    else:
+        current_faiss_index = _create_empty_faiss_index()
+    for segment_name in segments:
+        segment_index = _read_faiss_part(os.path.join(FAISS_INDEX_DIR, segment_name), writable=True)
+        _merge_faiss_segment(current_faiss_index, segment_index)
+    if removed_ids:
+        remove_ids_from_faiss_index(current_faiss_index, removed_ids)
+    return current_faiss_index, converted
+
+
+def load_or_create_faiss_index(chatbot_id: int, writable: bool = False):
+    """
+    Belirli bir chatbot'un FAISS indeksini (taban + delta segmentleri) diskten yükler veya yeni bir boş indeks oluşturur.
+    `writable=False` iken taban mmap ile salt okunur açılır, bekleyen segmentler ve silmeler ayrı bir katman olarak
+    eklenir; indekse ekleme yapacak veya indeksi kaydedecek çağıranlar `writable=True` vermelidir.
+    """
+    prefix = _faiss_index_prefix(chatbot_id)
     os.makedirs(FAISS_INDEX_DIR, exist_ok=True)
 
-    current_faiss_index = None
-    if os.path.exists(chatbot_faiss_path):
+    if not os.path.exists(_faiss_manifest_path(chatbot_id)) and not os.path.exists(f"{prefix}.faiss") and os.path.exists(f"{prefix}.bin"):
         try:
-            with open(chatbot_faiss_path, "rb") as f:
-                faiss_bytes = f.read()
-            
-            # allow_dangerous_deserialization=True ekliyoruz
-            # **UYARI: Güvenilir olmayan kaynaklardan gelen dosyaları yüklerken bunu kullanmaktan kaçının!**
-            # Kendi uygulamanızda oluşturduğunuz ve kontrol ettiğiniz dosyalar için güvenli kabul edilir.
-            current_faiss_index = FAISS.deserialize_from_bytes(faiss_bytes, embeddings, allow_dangerous_deserialization=True)
-            print(f"Chatbot ID {chatbot_id} için FAISS indeksi diskten yüklendi (tehlikeli deserializasyona izin verildi).")
+            _migrate_legacy_faiss_index(chatbot_id)
         except Exception as e:
+            print(f"Chatbot ID {chatbot_id} için eski FAISS indeksi dönüştürülürken hata oluştu: {e}")
+
+    # Okuma sırasında eşzamanlı bir compaction eski segment dosyalarını silmiş olabilir;
+    # bu durumda manifest'i yeniden okuyup bir kez daha deniyoruz.
+    for attempt in range(2):
+        try:
+            current_faiss_index, converted = _load_faiss_from_manifest(read_faiss_manifest(chatbot_id), writable)
+            if current_faiss_index is not None:
+                if converted:
+                    # Konum tabanlı eski indeks bir kez documents.id anahtarlı formata çevrilip kalıcılaştırılır.
+                    save_faiss_index(current_faiss_index, chatbot_id)
+                print(f"Chatbot ID {chatbot_id} için FAISS indeksi diskten yüklendi.")
+                return current_faiss_index
+            break
+        except FileNotFoundError as e:
+            if attempt == 0:
+                continue
             print(f"Chatbot ID {chatbot_id} için FAISS indeksi yüklenirken hata oluştu: {e}. Yeni bir indeks oluşturuluyor.")
-            
-            # Yeni indeks oluştururken InMemoryDocstore kullanıyoruz
-            faiss_base_index = faiss.IndexFlatL2(GEMINI_EMBEDDING_DIM)
-            current_faiss_index = FAISS(
-                embedding_function=embeddings.embed_query,
-                index=faiss_base_index,
-                docstore=InMemoryDocstore(), # Boş bir In-Memory Docstore oluştur
-                index_to_docstore_id={} # Boş bir mapping sözlüğü
-            )
-            print(f"Yeni (boş) bir FAISS indeksi Chatbot ID {chatbot_id} için oluşturuldu.")
-    else:
-        # Hiç indeks dosyası yoksa yeni bir boş indeks oluştur
-        faiss_base_index = faiss.IndexFlatL2(GEMINI_EMBEDDING_DIM)
-        current_faiss_index = FAISS(
-            embedding_function=embeddings.embed_query,
-            index=faiss_base_index,
-            docstore=InMemoryDocstore(), # Boş bir In-Memory Docstore oluştur
-            index_to_docstore_id={} # Boş bir mapping sözlüğü
-        )
-        print(f"Yeni bir FAISS indeksi Chatbot ID {chatbot_id} için oluşturuldu.")
+        except Exception as e:
+            print(f"Chatbot ID {chatbot_id} için FAISS indeksi yüklenirken hata oluştu: {e}. Yeni bir indeks oluşturuluyor.")
+            break
+
+    # Dosya var ama okunamadıysa, indeksi veritabanındaki embedding'lerden yeniden kurmayı dene
+    if read_faiss_manifest(chatbot_id).get("base") is not None or os.path.exists(_faiss_manifest_path(chatbot_id)):
+        try:
+            rebuild_faiss_index_from_db(chatbot_id)
+            current_faiss_index, _ = _load_faiss_from_manifest(read_faiss_manifest(chatbot_id), writable)
+            if current_faiss_index is not None:
+                return current_faiss_index
+        except Exception as e:
+            print(f"Chatbot ID {chatbot_id} için FAISS indeksi veritabanından yeniden kurulamadı: {e}")
+
+    # Hiç indeks dosyası yoksa (veya kurtarılamadıysa) yeni bir boş indeks oluştur
+    current_faiss_index = _create_empty_faiss_index()
+    print(f"Yeni bir FAISS indeksi Chatbot ID {chatbot_id} için oluşturuldu.")
     return current_faiss_index
 
 
-def save_faiss_index(faiss_index_to_save: FAISS, chatbot_id: int):
-    """Belirli bir chatbot'un FAISS indeksini diske kaydeder."""
-    if faiss_index_to_save:
-        chatbot_faiss_path = os.path.join(FAISS_INDEX_DIR, f"faiss_index_{chatbot_id}.bin")
-        try:
-            faiss_bytes = faiss_index_to_save.serialize_to_bytes()
-            with open(chatbot_faiss_path, "wb") as f:
-                f.write(faiss_bytes)
-            print(f"Chatbot ID {chatbot_id} için FAISS indeksi diske kaydedildi.")
-        except Exception as e:
-            print(f"Chatbot ID {chatbot_id} için FAISS indeksi kaydedilirken hata oluştu: {e}")
+def _replace_faiss_base(chatbot_id: int, faiss_store: FAISS, manifest: Dict[str, Any]):
+    """
+    Verilen FAISS nesnesini yeni bir taban nesli olarak yazar ve manifest'i tek adımda ona çevirir.
+    Çağıranın faiss_write_lock'u tutması gerekir. Eski taban ve segment dosyaları manifest değiştikten sonra silinir.
+    """
+    seq = manifest.get("next_seq", 1)
+    base_name = f"{os.path.basename(_faiss_index_prefix(chatbot_id))}.g{seq}"
+    _write_faiss_part(os.path.join(FAISS_INDEX_DIR, base_name), faiss_store)
+    _write_faiss_manifest(chatbot_id, {
+        "base": base_name, "segments": [], "removed_ids": [], "next_seq": seq + 1,
+        "ntotal": int(faiss_store.index.ntotal), "index_type": describe_index_type(faiss_store.index),
+        "index_codec": describe_index_codec(faiss_store.index),
+    })
+    for old_part in ([manifest["base"]] if manifest.get("base") else []) + manifest.get("segments", []):
+        _remove_faiss_part(os.path.join(FAISS_INDEX_DIR, old_part))
+
+
+def save_faiss_index(faiss_index_to_save: FAISS, chatbot_id: int):
+    """Belirli bir chatbot'un FAISS indeksini (tamamını) yeni bir taban olarak diske kaydeder."""
+    if faiss_index_to_save:
+        os.makedirs(FAISS_INDEX_DIR, exist_ok=True)
+        try:
+            with faiss_write_lock(chatbot_id):
+                _replace_faiss_base(chatbot_id, faiss_index_to_save, read_faiss_manifest(chatbot_id))
+            print(f"Chatbot ID {chatbot_id} için FAISS indeksi diske kaydedildi.")
+        except Exception as e:
+            print(f"Chatbot ID {chatbot_id} için FAISS indeksi kaydedilirken hata oluştu: {e}")
+
+
+def faiss_pending_changes(manifest: Dict[str, Any]) -> int:
+    """
+    Manifest'te compaction'ı bekleyen değişikliklerin FAISS_COMPACTION_SEGMENT_THRESHOLD ile karşılaştırılacak
+    ağırlığı. Her delta segmenti bir sayılır. Silinmiş id'ler her yüklemede yeniden uygulandığı için, depodaki
+    vektörlerin FAISS_COMPACTION_TOMBSTONE_FRACTION oranına ulaştıklarında ya da indeks remove_ids desteklemiyorsa
+    (HNSW; her yüklemede graf baştan kurulurdu) eşiğin kendisi döner ve compaction hemen başlar.
+    """
+    pending = len(manifest.get("segments", []))
+    removed_count = len(manifest.get("removed_ids", []))
+    if removed_count:
+        total = manifest.get("ntotal", 0) + removed_count
+        if manifest.get("index_type", "flat") == "hnsw" or removed_count >= FAISS_COMPACTION_TOMBSTONE_FRACTION * total:
+            return max(pending, FAISS_COMPACTION_SEGMENT_THRESHOLD)
+    return pending
+
+
+def append_faiss_segment(segment_store: FAISS, chatbot_id: int) -> int:
+    """
+    Yalnızca yeni eklenen vektörleri içeren FAISS nesnesini bir delta segmenti olarak yazar.
+    Maliyet yalnızca yeni parçaların boyutuyla orantılıdır. Bekleyen değişiklik ağırlığını döndürür (bkz. faiss_pending_changes).
+    """
+    os.makedirs(FAISS_INDEX_DIR, exist_ok=True)
+    with faiss_write_lock(chatbot_id):
+        manifest = read_faiss_manifest(chatbot_id)
+        seq = manifest.get("next_seq", 1)
+        segment_name = f"{os.path.basename(_faiss_index_prefix(chatbot_id))}.seg{seq}"
+        _write_faiss_part(os.path.join(FAISS_INDEX_DIR, segment_name), segment_store)
+        manifest["segments"] = manifest.get("segments", []) + [segment_name]
+        manifest["next_seq"] = seq + 1
+        manifest["ntotal"] = manifest.get("ntotal", 0) + int(segment_store.index.ntotal)
+        _write_faiss_manifest(chatbot_id, manifest)
+    print(f"Chatbot ID {chatbot_id} için {segment_store.index.ntotal} vektörlük delta segmenti yazıldı.")
+    return faiss_pending_changes(manifest)
+
+
+def write_staged_faiss_segment(segment_store: FAISS, chatbot_id: int, stage_name: str) -> str:
+    """
+    Bir delta segmentini manifest'e eklemeden diske yazar ve segment adını döndürür. Okuyucular segmenti
+    `register_faiss_segments` çağrılana kadar görmez; böylece uzun bir yükleme işi bittiğinde tek adımda görünür olur.
+    """
+    os.makedirs(FAISS_INDEX_DIR, exist_ok=True)
+    segment_name = f"{os.path.basename(_faiss_index_prefix(chatbot_id))}.{stage_name}"
+    _write_faiss_part(os.path.join(FAISS_INDEX_DIR, segment_name), segment_store)
+    return segment_name
+
+
+def register_faiss_segments(segments: List[tuple], chatbot_id: int) -> int:
+    """Diske önceden yazılmış (segment adı, vektör sayısı) segmentlerini manifest'e ekler. Bekleyen değişiklik ağırlığını döndürür."""
+    with faiss_write_lock(chatbot_id):
+        manifest = read_faiss_manifest(chatbot_id)
+        manifest["segments"] = manifest.get("segments", []) + [segment_name for segment_name, _ in segments]
+        manifest["ntotal"] = manifest.get("ntotal", 0) + sum(ntotal for _, ntotal in segments)
+        _write_faiss_manifest(chatbot_id, manifest)
+    print(f"Chatbot ID {chatbot_id} için {sum(ntotal for _, ntotal in segments)} vektörlük {len(segments)} delta segmenti eklendi.")
+    return faiss_pending_changes(manifest)
+
+
+def append_faiss_tombstones(doc_ids: List[int], chatbot_id: int) -> int:
+    """
+    Kaldırılan documents.id değerlerini manifest'e işler; indeks dosyaları yeniden yazılmaz.
+    Bekleyen (compaction'a kadar uygulanacak) değişiklik ağırlığını döndürür (bkz. faiss_pending_changes).
+    """
+    os.makedirs(FAISS_INDEX_DIR, exist_ok=True)
+    with faiss_write_lock(chatbot_id):
+        manifest = read_faiss_manifest(chatbot_id)
+        removed_ids = set(manifest.get("removed_ids", []))
+        new_ids = {int(doc_id) for doc_id in doc_ids} - removed_ids
+        removed_ids.update(new_ids)
+        manifest["removed_ids"] = sorted(removed_ids)
+        manifest["ntotal"] = max(0, manifest.get("ntotal", 0) - len(new_ids))
+        _write_faiss_manifest(chatbot_id, manifest)
+    return faiss_pending_changes(manifest)
+
+
+def add_chunks_to_faiss_index(faiss_store: FAISS, chunks: List[Document], vectors):
+    """Önceden hesaplanmış embedding'leri, parçaların metadata'sındaki doc_id (documents.id) değerleriyle indekse ekler."""
+    if not chunks:
+        return
+    doc_ids = [int(chunk.metadata["doc_id"]) for chunk in chunks]
+    faiss_store.index.add_with_ids(np.asarray(vectors, dtype=np.float32), np.array(doc_ids, dtype=np.int64))
+    faiss_store.docstore.add({str(doc_id): chunk for doc_id, chunk in zip(doc_ids, chunks)})
+    faiss_store.index_to_docstore_id.update({doc_id: str(doc_id) for doc_id in doc_ids})
+
+
+def compact_faiss_index(chatbot_id: int):
+    """Taban indeksi ve tüm delta segmentlerini tek bir yeni tabanda birleştirir."""
+    try:
+        with faiss_write_lock(chatbot_id):
+            manifest = read_faiss_manifest(chatbot_id)
+            if not manifest.get("segments") and not manifest.get("removed_ids"):
+                return
+            merged_index, _ = _load_faiss_from_manifest(manifest, writable=True)
+            _replace_faiss_base(chatbot_id, merged_index, manifest)
+        faiss_index_cache.invalidate(chatbot_id)
+        print(f"Chatbot ID {chatbot_id} için {len(manifest.get('segments', []))} delta segmenti ve {len(manifest.get('removed_ids', []))} silme tabana birleştirildi.")
+    except Exception as e:
+        print(f"Chatbot ID {chatbot_id} için FAISS compaction hatası: {e}")
+    finally:
+        with _faiss_compactions_guard:
+            _faiss_compactions_running.discard(chatbot_id)
+
+
+_faiss_compactions_running: set = set()
+_faiss_compactions_guard = threading.Lock()
+
+
+def delete_faiss_index_files(chatbot_id: int):
+    """Ayrı dosyalı bir chatbot'un tüm FAISS dosyalarını diskten siler."""
+    with faiss_write_lock(chatbot_id):
+        for chatbot_faiss_path in faiss_index_file_paths(chatbot_id):
+            if os.path.exists(chatbot_faiss_path):
+                os.remove(chatbot_faiss_path)
+    print(f"Chatbot ID {chatbot_id} için FAISS indeksi dosyaları silindi.")
+
+
+def schedule_faiss_compaction(chatbot_id: int, pending_changes: int):
+    """Bekleyen değişiklikler eşiğe ulaştıysa compaction'ı arka planda başlatır (chatbot başına en fazla bir tane)."""
+    if pending_changes < FAISS_COMPACTION_SEGMENT_THRESHOLD:
+        return
+    with _faiss_compactions_guard:
+        if chatbot_id in _faiss_compactions_running:
+            return
+        _faiss_compactions_running.add(chatbot_id)
+    threading.Thread(target=compact_faiss_index, args=(chatbot_id,), daemon=True).start()
+
+# --- ---
+
+
+# --- FAISS İndeks Önbelleği ---
+def estimate_faiss_index_bytes(faiss_store: FAISS) -> int:
+    """Bellekteki bir FAISS nesnesinin yaklaşık boyutunu (byte) hesaplar: vektörler + docstore metinleri."""
+    index = faiss_store.index
+    try:
+        code_size = _inner_index(index).sa_code_size() # Sıkıştırılmış indekslerde vektör başına byte
+    except RuntimeError:
+        code_size = index.d * 4
+    vector_bytes = index.ntotal * (code_size + 8) # vektör kodları + int64 documents.id eşlemesi
+    delta_index = getattr(faiss_store, "_delta_index", None)
+    if delta_index is not None:
+        vector_bytes += delta_index.ntotal * (delta_index.d * 4 + 8)
+    return vector_bytes + _estimate_docstore_bytes(faiss_store.docstore)
+
+
+def _estimate_docstore_bytes(docstore) -> int:
+    if isinstance(docstore, LayeredDocstore):
+        return _estimate_docstore_bytes(docstore.base) + _estimate_docstore_bytes(docstore.delta)
+    if isinstance(docstore, LazyJsonlDocstore) and not docstore.is_loaded:
+        # Henüz okunmamış docstore'u yalnızca boyut hesabı için yüklemiyoruz; dosya boyutu yeterli bir tahmindir.
+        return docstore.file_size
+    return sum(len(doc.page_content.encode("utf-8")) for doc in docstore._dict.values())
+
+
+class FaissIndexCache:
+    """
+    Chatbot ID'sine göre yüklenmiş FAISS nesnelerini tutan, boyut ve son kullanım
+    zamanına göre (LRU) temizlenen, thread-safe bir önbellek.
+    `stamp_fn` verilirse her kayıt, yüklendiği andaki manifest damgasıyla saklanır ve `get` her seferinde
+    güncel damgayla (tek os.stat) karşılaştırır; başka bir worker'ın diske yazdığı değişiklik eski kaydı geçersiz kılar.
+    """
+
+    def __init__(self, max_bytes: int, max_entries: int, stamp_fn=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.stamp_fn = stamp_fn
+        self._entries: "OrderedDict[int, tuple[FAISS, int, Any]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def get(self, chatbot_id: int) -> FAISS | None:
+        current_stamp = self.stamp_fn(chatbot_id) if self.stamp_fn else None
+        with self._lock:
+            entry = self._entries.get(chatbot_id)
+            if entry is not None and current_stamp != entry[2]:
+                self._pop(chatbot_id) # Dosyalar bu kayıt yüklendikten sonra değişmiş
+                self.stale += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(chatbot_id) # En son kullanılan olarak işaretle
+            self.hits += 1
+            return entry[0]
+
+    def put(self, chatbot_id: int, faiss_store: FAISS, stamp: Any = None):
+        """`stamp`, indeks diskten okunmadan ÖNCE alınmış manifest damgası olmalıdır; okuma sırasında gelen bir değişiklik böylece kaçırılmaz."""
+        size = estimate_faiss_index_bytes(faiss_store)
+        with self._lock:
+            self._pop(chatbot_id)
+            if size > self.max_bytes:
+                # Tek başına sınırı aşan indeksleri önbelleğe almıyoruz.
+                return
+            self._entries[chatbot_id] = (faiss_store, size, stamp)
+            self._total_bytes += size
+            while self._entries and (self._total_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                evicted_id = next(iter(self._entries))
+                self._pop(evicted_id)
+                self.evictions += 1
+
+    def invalidate(self, chatbot_id: int):
+        with self._lock:
+            self._pop(chatbot_id)
+
+    def _pop(self, chatbot_id: int):
+        entry = self._entries.pop(chatbot_id, None)
+        if entry is not None:
+            self._total_bytes -= entry[1]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "stale": self.stale,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+            }
+
+
+faiss_index_cache = FaissIndexCache(FAISS_CACHE_MAX_BYTES, FAISS_CACHE_MAX_ENTRIES, stamp_fn=faiss_manifest_stamp)
+
+
+def get_faiss_index(store_key) -> FAISS:
+    """Sohbet için deponun (chatbot'un kendi indeksi veya ortak parça) FAISS indeksini önce önbellekten, yoksa diskten getirir."""
+    current_faiss_index = faiss_index_cache.get(store_key)
+    if current_faiss_index is None:
+        stamp = faiss_manifest_stamp(store_key)
+        current_faiss_index = load_or_create_faiss_index(store_key)
+        apply_index_search_params(current_faiss_index.index, load_index_policy(store_key))
+        faiss_index_cache.put(store_key, current_faiss_index, stamp)
+    return current_faiss_index
+
+
+def shared_store_members(faiss_store: FAISS) -> Dict[int, np.ndarray]:
+    """Ortak bir parçada hangi documents.id'lerin hangi chatbot'a ait olduğunu döndürür (nesne başına bir kez hesaplanır)."""
+    members = getattr(faiss_store, "_chatbot_members", None)
+    if members is None:
+        grouped: Dict[int, List[int]] = {}
+        for doc_id, docstore_id in faiss_store.index_to_docstore_id.items():
+            doc = faiss_store.docstore.search(docstore_id)
+            if isinstance(doc, Document) and doc.metadata.get("chatbot_id") is not None:
+                grouped.setdefault(int(doc.metadata["chatbot_id"]), []).append(int(doc_id))
+        members = {cb_id: np.array(ids, dtype=np.int64) for cb_id, ids in grouped.items()}
+        faiss_store._chatbot_members = members
+    return members
+
+
+def chatbot_vector_count(faiss_store: FAISS, chatbot_id: int, store_key) -> int:
+    if is_shared_store_key(store_key):
+        return len(shared_store_members(faiss_store).get(chatbot_id, ()))
+    return len(faiss_store.index_to_docstore_id) # Katmanlı depoda taban + delta, silinmişler hariç
+
+
+def _search_params_with_selector(index, policy: Dict[str, Any], selector):
+    """Seçicili arama parametreleri; yaklaşık indekslerde nprobe/efSearch değerleri de burada verilmelidir."""
+    inner = _inner_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=int(policy["nprobe"]))
+    if hasattr(inner, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=int(policy["ef_search"]))
+    return faiss.SearchParameters(sel=selector)
+
+
+def search_faiss_store(faiss_store: FAISS, store_key, query_vector: List[float], k: int, member_ids: np.ndarray | None = None) -> List[Document]:
+    """
+    Deponun en yakın `k` parçasını döndürür. Katmanlı yüklenmiş bir depoda (bkz. _layer_faiss_changes) mmap'li taban
+    ile bellekteki delta indeksi ayrı ayrı aranır ve sonuçlar mesafeye (L2) göre birleştirilir; tabandaki silinmiş
+    id'ler seçiciyle dışlanır. `member_ids` verilirse yalnızca bu id'ler aranır (ortak parçalar).
+    """
+    query = np.array([query_vector], dtype=np.float32)
+    removed_ids = getattr(faiss_store, "_removed_ids", None)
+    excluded = None
+    if member_ids is not None:
+        selector = faiss.IDSelectorBatch(member_ids) # Üyeler eşlemeden hesaplandığı için silinmişleri içermez
+    elif removed_ids is not None and len(removed_ids):
+        excluded = faiss.IDSelectorBatch(removed_ids) # IDSelectorNot bu nesneye başvurur; arama bitene kadar tutulur
+        selector = faiss.IDSelectorNot(excluded)
+    else:
+        selector = None
+    params = _search_params_with_selector(faiss_store.index, load_index_policy(store_key), selector) if selector is not None else None
+    distances, labels = faiss_store.index.search(query, k, params=params)
+    distances, labels = distances[0], labels[0]
+
+    delta_index = getattr(faiss_store, "_delta_index", None)
+    if delta_index is not None and delta_index.ntotal:
+        delta_params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(member_ids)) if member_ids is not None else None
+        delta_distances, delta_labels = delta_index.search(query, k, params=delta_params)
+        distances = np.concatenate([distances, delta_distances[0]])
+        labels = np.concatenate([labels, delta_labels[0]])
+        labels = labels[np.argsort(distances, kind="stable")[:k]] # Boş sonuçların (-1) mesafesi en büyük değerdir
+    return [faiss_store.docstore.search(faiss_store.index_to_docstore_id[int(label)]) for label in labels if label != -1]
+
+
+async def search_chatbot_documents(faiss_store: FAISS, chatbot_id: int, store_key, query_vector: List[float], k: int) -> List[Document]:
+    """Chatbot'un parçaları arasında vektör araması yapar; ortak parçalarda yalnızca chatbot'a ait id'ler aranır."""
+    member_ids = None
+    if is_shared_store_key(store_key):
+        member_ids = shared_store_members(faiss_store).get(chatbot_id)
+        if member_ids is None or len(member_ids) == 0:
+            return []
+    return await asyncio.get_running_loop().run_in_executor(None, search_faiss_store, faiss_store, store_key, query_vector, k, member_ids)
+# --- ---
+
+# --- Embedding Saklama ve İndeksin Veritabanından Yeniden Kurulması ---
+def normalize_chunk_text(text: str) -> str:
+    """Önbellek anahtarı için metni normalize eder (Unicode NFC, boşlukları tekilleştirme)."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class TokenBucket:
+    """Thread güvenli token bucket: saniyede `rate` token dolar, en fazla `capacity` token birikir."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        """Yeterli token birikene kadar bekler ve token'ları harcar."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class EmbeddingScheduler:
+    """
+    Embedding isteklerini EMBEDDING_BATCH_SIZE'lık batch'lere bölüp sınırlı eşzamanlılıkla gönderir.
+    Her istek önce token bucket'tan izin alır (dakikalık kota); başarısız istekler üstel geri çekilme ve
+    rastgele sapma (jitter) ile yeniden denenir. Tamamlanan her batch `on_batch` ile hemen bildirilir,
+    böylece çağıran taraf ilerlemeyi kaydedebilir (checkpoint) ve sonraki bir denemede bu batch'ler yeniden embed edilmez.
+    """
+
+    def __init__(self, underlying: Embeddings, batch_size: int, concurrency: int, requests_per_minute: float,
+                 max_retries: int, backoff_seconds: float, max_backoff_seconds: float):
+        self.underlying = underlying
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.rate_limiter = TokenBucket(rate=requests_per_minute / 60.0, capacity=max(1.0, float(concurrency)))
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embedding")
+        self.retries = 0
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                return self.underlying.embed_documents(texts)
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                self.retries += 1
+                delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempt - 1))
+                delay *= random.uniform(0.5, 1.0)
+                print(f"Embedding isteği başarısız oldu ({attempt}/{self.max_retries}), {delay:.1f} sn sonra tekrar denenecek: {e}")
+                time.sleep(delay)
+
+    def embed(self, texts: List[str], on_batch=None) -> List[List[float]]:
+        """
+        Metinleri sırasıyla embed eder. `on_batch(offset, vectors)` her batch tamamlandığında çağrılır.
+        Bir batch tüm denemelerde başarısız olursa diğer batch'lerin bitmesi (ve kaydedilmesi) beklenip hata yükseltilir.
+        """
+        futures = [
+            (offset, self.executor.submit(self._embed_batch, texts[offset:offset + self.batch_size]))
+            for offset in range(0, len(texts), self.batch_size)
+        ]
+        vectors: List[List[float]] = [None] * len(texts)
+        first_error = None
+        for offset, future in futures:
+            try:
+                batch_vectors = future.result()
+            except Exception as e:
+                first_error = first_error or e
+                continue
+            vectors[offset:offset + len(batch_vectors)] = batch_vectors
+            if on_batch is not None:
+                on_batch(offset, batch_vectors)
+        if first_error is not None:
+            raise first_error
+        return vectors
+
+
+embedding_scheduler = EmbeddingScheduler(
+    embeddings,
+    batch_size=EMBEDDING_BATCH_SIZE,
+    concurrency=EMBEDDING_CONCURRENCY,
+    requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE,
+    max_retries=EMBEDDING_MAX_RETRIES,
+    backoff_seconds=EMBEDDING_BACKOFF_SECONDS,
+    max_backoff_seconds=EMBEDDING_MAX_BACKOFF_SECONDS,
+)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embedding modelinin önüne konan, (model adı, normalize metin) hash'ine göre PostgreSQL'de kalıcı önbellek.
+    Yalnızca önbellekte olmayan metinler embedding API'sine gider; aynı çağrıdaki tekrarlı metinler bir kez embed edilir.
+    Eksik metinler zamanlayıcı üzerinden gönderilir ve her batch biter bitmez önbelleğe yazılır; bu yüzden yarıda
+    kalan bir yükleme yeniden denendiğinde yalnızca tamamlanmamış batch'ler embed edilir.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, scheduler: EmbeddingScheduler):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.scheduler = scheduler
+
+    def content_hash(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.model_name}\0{normalize_chunk_text(text)}".encode("utf-8")).digest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, _ = self.embed_documents_with_stats(texts)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
+
+    def embed_documents_with_stats(self, texts: List[str]) -> tuple:
+        """Embedding'leri ve önbellek istatistiklerini (isabet, ıskalama, tasarruf edilen API çağrısı) döndürür."""
+        hashes = [self.content_hash(text) for text in texts]
+        found = self._lookup(set(hashes))
+
+        # Önbellekte olmayan benzersiz metinleri topla
+        missing: Dict[bytes, str] = {}
+        for content_hash, text in zip(hashes, texts):
+            if content_hash not in found and content_hash not in missing:
+                missing[content_hash] = text
+        if missing:
+            missing_hashes = list(missing.keys())
+
+            def checkpoint(offset: int, batch_vectors: List[List[float]]):
+                computed = {
+                    content_hash: np.asarray(vector, dtype=np.float32)
+                    for content_hash, vector in zip(missing_hashes[offset:offset + len(batch_vectors)], batch_vectors)
+                }
+                self._store(computed)
+                found.update(computed)
+
+            self.scheduler.embed(list(missing.values()), on_batch=checkpoint)
+
+        vectors = [found[content_hash].tolist() for content_hash in hashes]
+        hits = len(texts) - len(missing)
+        stats = {
+            "chunks": len(texts),
+            "cache_hits": hits,
+            "cache_misses": len(missing),
+            "hit_rate": (hits / len(texts)) if texts else 0.0,
+            "api_calls_saved": hits, # Her isabet, embedding API'sine gönderilmeyen bir metindir
+        }
+        return vectors, stats
+
+    def _lookup(self, hashes: set) -> Dict[bytes, np.ndarray]:
+        if not hashes:
+            return {}
+        conn = None
+        try:
+            conn = get_db_connection()
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT content_hash, embedding FROM embedding_cache WHERE content_hash = ANY(%s);",
+                    ([psycopg2.Binary(h) for h in hashes],)
+                )
+                return {bytes(content_hash): decode_embedding(blob) for content_hash, blob in cursor.fetchall()}
+        except Exception as e:
+            # Önbellek okunamazsa tüm metinler embed edilir; yükleme başarısız olmaz.
+            print(f"Embedding önbelleği okunurken hata oluştu: {e}")
+            return {}
+        finally:
+            if conn:
+                conn.close()
+
+    def _store(self, computed: Dict[bytes, np.ndarray]):
+        conn = None
+        try:
+            conn = get_db_connection()
+            with conn.cursor() as cursor:
+                psycopg2.extras.execute_values(
+                    cursor,
+                    "INSERT INTO embedding_cache (content_hash, model, embedding) VALUES %s ON CONFLICT (content_hash) DO NOTHING;",
+                    [(psycopg2.Binary(h), self.model_name, encode_embedding(vector)) for h, vector in computed.items()]
+                )
+            conn.commit()
+        except Exception as e:
+            print(f"Embedding önbelleğine yazılırken hata oluştu: {e}")
+            if conn:
+                conn.rollback()
+        finally:
+            if conn:
+                conn.close()
+
+
+cached_embeddings = CachedEmbeddings(embeddings, embeddings.model, embedding_scheduler)
+
+
+class QueryEmbeddingCache:
+    """
+    Sohbet sorgularının embedding'leri için LRU + TTL önbellek. Sorgu embedding'i chatbot'tan bağımsız
+    olduğundan anahtar yalnızca (model adı, normalize edilmiş sorgu) ikilisidir.
+    """
+
+    def __init__(self, model_name: str, max_entries: int, ttl_seconds: float):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple, tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, query: str) -> tuple:
+        return (self.model_name, normalize_chunk_text(query).casefold())
+
+    def get(self, query: str) -> List[float] | None:
+        key = self._key(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key] # Süresi dolmuş kayıt
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, query: str, vector: List[float]):
+        key = self._key(query)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+query_embedding_cache = QueryEmbeddingCache(embeddings.model, QUERY_EMBEDDING_CACHE_MAX_ENTRIES, QUERY_EMBEDDING_CACHE_TTL_SECONDS)
+
+
+async def get_query_embedding(query: str) -> List[float]:
+    """Sorgu embedding'ini önbellekten döndürür; yoksa embedding modeline sorup önbelleğe ekler."""
+    vector = query_embedding_cache.get(query)
+    if vector is None:
+        vector = await embeddings.aembed_query(query)
+        query_embedding_cache.put(query, vector)
+    return vector
+
+
+def encode_embedding(vector) -> bytes:
+    """Bir embedding vektörünü `documents.embedding` sütunu için kompakt byte dizisine çevirir."""
+    return psycopg2.Binary(np.asarray(vector, dtype=EMBEDDING_STORAGE_DTYPE).tobytes())
+
+
+def decode_embedding(blob) -> np.ndarray:
+    """`documents.embedding` değerini float32 vektöre çevirir. Saklama tipi byte uzunluğundan anlaşılır."""
+    raw = bytes(blob)
+    dtype = np.float16 if len(raw) == GEMINI_EMBEDDING_DIM * 2 else np.float32
+    return np.frombuffer(raw, dtype=dtype).astype(np.float32)
+
+
+def _store_chatbot_ids(cursor, store_key) -> List[int]:
+    """Bir depo anahtarına vektörleri yazılan chatbot ID'lerini döndürür."""
+    if not is_shared_store_key(store_key):
+        return [store_key]
+    shard = int(store_key.split("_", 1)[1])
+    cursor.execute(
+        "SELECT id FROM chatbots WHERE COALESCE(index_storage, %s) = 'shared' AND id %% %s = %s;",
+        (FAISS_DEFAULT_STORAGE_MODE, FAISS_SHARED_SHARDS, shard)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _faiss_index_from_db(conn, chatbot_ids: List[int], cursor_name: str, embed_missing: bool) -> tuple:
+    """
+    Verilen chatbot'ların parçalarını veritabanındaki embedding'lerle yeni bir FAISS nesnesine yükler.
+    Satırlar sunucu taraflı imleçle parça parça okunur. (indeks, eksik embedding sayısı, sonradan embed edilen sayı) döndürür.
+    """
+    rebuilt_index = _create_empty_faiss_index()
+    missing_count = 0
+    embedded_count = 0
+    with conn.cursor(name=cursor_name) as cursor:
+        cursor.itersize = FAISS_REBUILD_BATCH_SIZE
+        cursor.execute("""
+            SELECT d.id, d.page_number, d.content, d.embedding, cd.original_filename, cd.chatbot_id
+            FROM chatbot_documents cd
+            JOIN documents d ON cd.document_id = d.id
+            WHERE cd.chatbot_id = ANY(%s)
+            ORDER BY d.id;
+        """, (chatbot_ids,))
+        while True:
+            rows = cursor.fetchmany(FAISS_REBUILD_BATCH_SIZE)
+            if not rows:
+                break
+            chunks, vectors, missing_chunks = [], [], []
+            for doc_id, page_number, content, embedding_blob, filename, row_chatbot_id in rows:
+                chunk = Document(page_content=content, metadata={
+                    "page": page_number, "doc_id": doc_id, "chatbot_id": row_chatbot_id, "original_filename": filename
+                })
+                if embedding_blob is None:
+                    missing_chunks.append(chunk)
+                else:
+                    chunks.append(chunk)
+                    vectors.append(decode_embedding(embedding_blob))
+            if missing_chunks:
+                missing_count += len(missing_chunks)
+                if embed_missing:
+                    missing_vectors = cached_embeddings.embed_documents([chunk.page_content for chunk in missing_chunks])
+                    _store_embeddings(missing_chunks, missing_vectors)
+                    chunks.extend(missing_chunks)
+                    vectors.extend(missing_vectors)
+                    embedded_count += len(missing_chunks)
+            if chunks:
+                add_chunks_to_faiss_index(rebuilt_index, chunks, np.vstack(vectors))
+    return rebuilt_index, missing_count, embedded_count
+
+
+def rebuild_faiss_index_from_db(store_key, embed_missing: bool = False) -> Dict[str, Any]:
+    """
+    Bir deponun (ayrı dosyalı chatbot veya ortak parça) indeksini veritabanında saklanan embedding'lerden
+    sıfırdan kurar ve yeni taban olarak kaydeder. Embedding'i olmayan (bu özellikten önce yüklenmiş)
+    satırlar `embed_missing=True` verilirse embed edilip veritabanına da yazılır, aksi halde atlanır.
+    """
+    started = time.perf_counter()
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            chatbot_ids = _store_chatbot_ids(cursor, store_key)
+        # Rebuild süresince segment ekleme/compaction beklesin; aradaki yüklemeler tabana zaten dahil olan
+        # id'leri içerirse birleştirmede atlanır.
+        with faiss_write_lock(store_key):
+            rebuilt_index, missing_count, embedded_count = _faiss_index_from_db(conn, chatbot_ids, f"faiss_rebuild_{store_key}", embed_missing)
+            _replace_faiss_base(store_key, rebuilt_index, read_faiss_manifest(store_key))
+        conn.commit()
+    finally:
+        conn.close()
+    faiss_index_cache.invalidate(store_key)
+    schedule_index_promotion(store_key)
+    result = {
+        "store": str(store_key),
+        "chatbot_ids": chatbot_ids,
+        "vectors": int(rebuilt_index.index.ntotal),
+        "missing_embeddings": missing_count,
+        "embedded_missing": embedded_count,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    print(f"'{store_key}' deposu için FAISS indeksi veritabanından yeniden oluşturuldu: {result}")
+    return result
+
+
+def _store_embeddings(chunks: List[Document], vectors):
+    """Sonradan hesaplanan embedding'leri ilgili `documents` satırlarına çok satırlı UPDATE'lerle yazar."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        psycopg2.extras.execute_values(
+            cursor,
+            "UPDATE documents SET embedding = v.embedding FROM (VALUES %s) AS v(id, embedding) WHERE documents.id = v.id;",
+            [(chunk.metadata["doc_id"], encode_embedding(vector)) for chunk, vector in zip(chunks, vectors)],
+            page_size=INGESTION_DB_PAGE_SIZE
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+# --- ---
+
+# --- İndeks Tipi ve Sıkıştırma Politikası (Flat -> IVF/HNSW, float32 -> fp16/SQ8/PQ) ---
+INDEX_TYPES = ("flat", "ivf", "hnsw")
+INDEX_CODECS = ("none", "fp16", "sq8", "pq")
+
+
+STORAGE_MODES = ("per_bot", "shared")
+
+
+def default_index_policy() -> Dict[str, Any]:
+    return {
+        "index_type": FAISS_DEFAULT_INDEX_TYPE,
+        "index_codec": FAISS_DEFAULT_INDEX_CODEC,
+        "promotion_threshold": FAISS_PROMOTION_THRESHOLD,
+        "nprobe": FAISS_IVF_NPROBE,
+        "ef_search": FAISS_HNSW_EF_SEARCH,
+        "storage_mode": FAISS_DEFAULT_STORAGE_MODE,
+    }
+
+
+# IndexPolicyRequest alanlarının chatbots tablosundaki sütunları
+INDEX_POLICY_COLUMNS = {
+    "index_type": "index_type", "index_codec": "index_codec", "promotion_threshold": "index_promotion_threshold",
+    "nprobe": "index_nprobe", "ef_search": "index_ef_search", "storage_mode": "index_storage",
+}
+
+
+def update_index_policy_columns(cursor, chatbot_id: int, fields: Dict[str, Any]) -> tuple | None:
+    """
+    IndexPolicyRequest alan adlarıyla verilen politika alanlarını chatbots satırına yazar, config_version'ı artırır
+    ve değişikliği yayınlar. Chatbot yoksa None, varsa (eski index_storage, yeni index_storage, yeni sürüm) döner.
+    Commit'ten sonra `chatbot_config_cache.invalidate(chatbot_id, sürüm)` çağrılmalıdır.
+    """
+    # Eski depo modu önbellekten değil, aynı işlem içinde kilitlenen satırdan okunur
+    cursor.execute("SELECT index_storage FROM chatbots WHERE id = %s FOR UPDATE;", (chatbot_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    old_storage = row[0]
+    assignments = [f"{INDEX_POLICY_COLUMNS[field]} = %s" for field in fields] + ["config_version = config_version + 1"]
+    cursor.execute(
+        f"UPDATE chatbots SET {', '.join(assignments)} WHERE id = %s RETURNING index_storage, config_version;",
+        (*fields.values(), chatbot_id)
+    )
+    new_storage, version = cursor.fetchone()
+    publish_chatbot_config_change(cursor, chatbot_id, version)
+    return old_storage, new_storage, version
+
+
+def load_index_policy(store_key) -> Dict[str, Any]:
+    """
+    Chatbot'un indeks politikasını, boş alanları varsayılanlarla doldurarak döndürür.
+    Ortak parçalar ("shared_{n}") birçok chatbot'a ait olduğu için her zaman varsayılan politikayı kullanır.
+    """
+    policy = default_index_policy()
+    if is_shared_store_key(store_key):
+        return policy
+    config = get_chatbot_config(store_key)
+    if config:
+        for key, column in INDEX_POLICY_COLUMNS.items():
+            if config[column] is not None:
+                policy[key] = config[column]
+    return policy
+
+
+def index_store_key(chatbot_id: int, storage_mode: str | None):
+    """Chatbot'un vektörlerinin tutulduğu deponun anahtarını döndürür: kendi dosyası (int) veya ortak parça ("shared_{n}")."""
+    if (storage_mode or FAISS_DEFAULT_STORAGE_MODE) == "shared":
+        return f"shared_{chatbot_id % FAISS_SHARED_SHARDS}"
+    return chatbot_id
+
+
+def is_shared_store_key(store_key) -> bool:
+    return isinstance(store_key, str) and store_key.startswith("shared_")
+
+
+def _chatbot_vectors_from_db(chatbot_id: int) -> tuple:
+    """Chatbot'un parçalarını veritabanındaki embedding'lerle bir FAISS nesnesine yükler: (indeks, eksik embedding sayısı)."""
+    conn = get_db_connection()
+    try:
+        segment_index, missing_count, _ = _faiss_index_from_db(conn, [chatbot_id], f"faiss_move_{chatbot_id}", False)
+        conn.commit()
+    finally:
+        conn.close()
+    return segment_index, missing_count
+
+
+def _remove_chatbot_from_store(chatbot_id: int, store_key):
+    """Chatbot'un vektörlerini bir depodan kaldırır: ortak parçada tombstone olarak, ayrı dosyada dosyaları silerek."""
+    if is_shared_store_key(store_key):
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT document_id FROM chatbot_documents WHERE chatbot_id = %s;", (chatbot_id,))
+                doc_ids = [row[0] for row in cursor.fetchall()]
+        finally:
+            conn.close()
+        if doc_ids:
+            schedule_faiss_compaction(store_key, append_faiss_tombstones(doc_ids, store_key))
+        faiss_index_cache.invalidate(store_key)
+    else:
+        faiss_index_cache.invalidate(store_key)
+        delete_faiss_index_files(store_key)
+
+
+def move_chatbot_storage(chatbot_id: int, from_storage: str | None, to_storage: str | None):
+    """
+    Depolama modu değişen bir chatbot'un vektörlerini yeni depoya taşır. Sohbet istekleri taşıma boyunca eski
+    depodan yanıtlanır: `index_storage` yalnızca yeni depo kurulduktan sonra (config_version artırılıp NOTIFY ile
+    yayınlanarak) değiştirilir, ardından chatbot eski depodan kaldırılır. Yeni depo kurulamazsa yazılanlar geri
+    alınmaya çalışılır ve chatbot eski depoda kalır.
+
+    Taşıma süresince chatbot'un advisory lock'u özel olarak tutulur; belge yüklemeleri aynı kilidi paylaşımlı
+    alır (bkz. ingest_documents), böylece taşıma sırasında eski depoya yazılıp yeni depoda eksik kalan parça olmaz.
+    """
+    old_key = index_store_key(chatbot_id, from_storage)
+    new_key = index_store_key(chatbot_id, to_storage)
+    lock_conn = get_db_connection()
+    try:
+        with lock_conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s);", (chatbot_id,))
+            # Kirası dolduğu için başarısız sayılan eski bir taşıma aslında sürmüş ve bitmişse, bu işin kuyruğa
+            # alındığı andaki kaynak depo artık geçerli değildir; yanlış depodan taşımak yerine iş reddedilir.
+            cursor.execute("SELECT index_storage FROM chatbots WHERE id = %s;", (chatbot_id,))
+            row = cursor.fetchone()
+        lock_conn.commit()
+        if not row:
+            raise ValueError(f"Chatbot ID {chatbot_id} bulunamadı.")
+        if index_store_key(chatbot_id, row[0]) != old_key:
+            raise RuntimeError(f"Chatbot ID {chatbot_id} artık '{old_key}' deposunda değil; taşıma yeniden istenmelidir.")
+        target_written = False
+        try:
+            if is_shared_store_key(new_key):
+                segment_index, missing_count = _chatbot_vectors_from_db(chatbot_id)
+                # Tombstone'lar tüm segmentlere uygulandığından, chatbot daha önce bu parçadan taşındıysa kalan
+                # silmeleri yeni eklenecek aynı id'leri de silmesin diye önce tabana birleştirilir.
+                if read_faiss_manifest(new_key).get("removed_ids"):
+                    compact_faiss_index(new_key)
+                    if set(read_faiss_manifest(new_key).get("removed_ids", [])) & set(segment_index.index_to_docstore_id):
+                        raise RuntimeError(f"'{new_key}' deposundaki silmeler tabana birleştirilemedi.")
+                target_written = True
+                pending_changes = append_faiss_segment(segment_index, new_key)
+                faiss_index_cache.invalidate(new_key)
+                schedule_faiss_compaction(new_key, pending_changes)
+            else:
+                target_written = True
+                missing_count = rebuild_faiss_index_from_db(new_key)["missing_embeddings"]
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cursor:
+                    updated = update_index_policy_columns(cursor, chatbot_id, {"storage_mode": to_storage})
+                if updated is None:
+                    raise ValueError(f"Chatbot ID {chatbot_id} bulunamadı.")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+        except Exception:
+            if target_written:
+                try:
+                    _remove_chatbot_from_store(chatbot_id, new_key)
+                except Exception as cleanup_error:
+                    print(f"Chatbot ID {chatbot_id} için yarım kalan '{new_key}' deposu temizlenemedi: {cleanup_error}")
+            raise
+        chatbot_config_cache.invalidate(chatbot_id, updated[2])
+
+        try:
+            _remove_chatbot_from_store(chatbot_id, old_key)
+        except Exception as e:
+            raise RuntimeError(f"Vektörler '{new_key}' deposuna taşındı ancak '{old_key}' deposundan kaldırılamadı: {e}") from e
+        print(f"Chatbot ID {chatbot_id} vektörleri '{old_key}' deposundan '{new_key}' deposuna taşındı ({missing_count} parçanın embedding'i yok).")
+    finally:
+        try:
+            with lock_conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s);", (chatbot_id,))
+            lock_conn.commit()
+        finally:
+            lock_conn.close()
+
+
+def apply_index_search_params(index, policy: Dict[str, Any]):
+    """Yaklaşık indekslerde arama parametrelerini (IVF nprobe, HNSW efSearch) ayarlar."""
+    inner = _inner_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = int(policy["nprobe"])
+    elif hasattr(inner, "hnsw"):
+        inner.hnsw.efSearch = int(policy["ef_search"])
+
+
+def _index_factory_string(index_type: str, codec: str, ntotal: int) -> str:
+    """Tip ve sıkıştırma seçimine göre FAISS index_factory tanımını üretir."""
+    # PQ kod kitabı eğitimi (256 merkez) için yeterli vektör yoksa SQ8'e düşülür.
+    if codec == "pq" and ntotal < 256 * 39:
+        codec = "sq8"
+    flat_codec = {"none": "Flat", "fp16": "SQfp16", "sq8": "SQ8", "pq": f"PQ{FAISS_PQ_M}"}[codec]
+    if index_type == "ivf":
+        # Eğitim kümesi başına en az ~39 nokta önerilir; liste sayısı vektör sayısının kareköküyle büyür.
+        nlist = max(1, min(int(4 * np.sqrt(ntotal)), ntotal // 39))
+        return f"IDMap2,IVF{nlist},{flat_codec}"
+    if index_type == "hnsw":
+        hnsw_codec = {"none": "", "fp16": "_SQfp16", "sq8": "_SQ8", "pq": f"_PQ{FAISS_PQ_M}"}[codec]
+        return f"IDMap2,HNSW{FAISS_HNSW_M}{hnsw_codec}"
+    return f"IDMap2,{flat_codec}"
+
+
+def build_faiss_index(index_type: str, vectors: np.ndarray, ids: np.ndarray, codec: str = "none"):
+    """Verilen tip ve sıkıştırmada, documents.id anahtarlı (IDMap2) yeni bir FAISS indeksi kurar, gerekirse eğitir ve doldurur."""
+    factory_string = _index_factory_string(index_type, codec, len(ids))
+    try:
+        index = faiss.index_factory(GEMINI_EMBEDDING_DIM, factory_string)
+    except RuntimeError as e:
+        # Bu FAISS sürümünde desteklenmeyen kombinasyonlarda (ör. HNSW + fp16) sıkıştırmasız indekse düşülür.
+        print(f"'{factory_string}' indeksi oluşturulamadı ({e}); sıkıştırmasız '{index_type}' kullanılıyor.")
+        index = faiss.index_factory(GEMINI_EMBEDDING_DIM, _index_factory_string(index_type, "none", len(ids)))
+    if not index.is_trained:
+        index.train(vectors)
+    if len(ids):
+        index.add_with_ids(vectors, ids)
+    return index
+
+
+def exact_vectors_from_db(vectors: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """
+    Sıkıştırılmış indeksten geri çözülen (kayıplı) vektörleri, veritabanında saklanan orijinal embedding'lerle değiştirir.
+    Böylece tip/sıkıştırma değişimlerinde kayıp birikmez. Veritabanında embedding'i olmayan satırlar olduğu gibi kalır.
+    """
+    if len(ids) == 0:
+        return vectors
+    exact = np.array(vectors, dtype=np.float32, copy=True)
+    position = {int(doc_id): i for i, doc_id in enumerate(ids)}
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            for start in range(0, len(ids), FAISS_REBUILD_BATCH_SIZE):
+                batch = [int(doc_id) for doc_id in ids[start:start + FAISS_REBUILD_BATCH_SIZE]]
+                cursor.execute("SELECT id, embedding FROM documents WHERE id = ANY(%s) AND embedding IS NOT NULL;", (batch,))
+                for doc_id, blob in cursor.fetchall():
+                    exact[position[doc_id]] = decode_embedding(blob)
+    finally:
+        conn.close()
+    return exact
+
+
+def _desired_index_layout(policy: Dict[str, Any], ntotal: int, current_type: str) -> tuple:
+    """Politikaya göre olması gereken (indeks tipi, sıkıştırma) ikilisini döndürür."""
+    if policy["index_type"] == "flat":
+        index_type = "flat"
+    elif current_type != "flat":
+        # İndeks küçülse de düz indekse geri düşülmez (demotion); ivf↔hnsw değişikliği ise yeniden eğitimle uygulanır
+        index_type = policy["index_type"]
+    else:
+        index_type = policy["index_type"] if ntotal >= policy["promotion_threshold"] else "flat"
+    return index_type, policy["index_codec"]
+
+
+def retrain_faiss_index(chatbot_id: int, index_type: str, codec: str = "none"):
+    """
+    Chatbot'un tüm vektörlerini verilen tip ve sıkıştırmada yeni bir indekse taşır. Yeni indeks tamamen kurulduktan
+    sonra manifest tek adımda değiştirilir; sohbet istekleri yarım kurulmuş bir indeks görmez.
+    """
+    try:
+        with faiss_write_lock(chatbot_id):
+            manifest = read_faiss_manifest(chatbot_id)
+            current_faiss_index, _ = _load_faiss_from_manifest(manifest, writable=True)
+            if current_faiss_index is None:
+                return
+            vectors, ids = _id_mapped_vectors(current_faiss_index)
+            vectors = exact_vectors_from_db(vectors, ids)
+            started = time.perf_counter()
+            current_faiss_index.index = build_faiss_index(index_type, vectors, ids, codec)
+            _replace_faiss_base(chatbot_id, current_faiss_index, manifest)
+        faiss_index_cache.invalidate(chatbot_id)
+        print(f"Chatbot ID {chatbot_id} için FAISS indeksi {len(ids)} vektörle '{index_type}/{codec}' düzenine {time.perf_counter() - started:.1f} sn'de taşındı.")
+    except Exception as e:
+        print(f"Chatbot ID {chatbot_id} için FAISS indeks tipi değiştirilirken hata oluştu: {e}")
+    finally:
+        with _faiss_promotions_guard:
+            _faiss_promotions_running.discard(chatbot_id)
+
+
+_faiss_promotions_running: set = set()
+_faiss_promotions_guard = threading.Lock()
+
+
+def schedule_index_promotion(chatbot_id: int):
+    """Politika ve manifest'teki vektör sayısına göre gerekiyorsa indeks tipini/sıkıştırmasını arka planda değiştirir."""
+    try:
+        manifest = read_faiss_manifest(chatbot_id)
+        if manifest.get("base") is None and not manifest.get("segments"):
+            return
+        current_layout = (manifest.get("index_type", "flat"), manifest.get("index_codec", "none"))
+        target_layout = _desired_index_layout(load_index_policy(chatbot_id), manifest.get("ntotal", 0), current_layout[0])
+    except Exception as e:
+        print(f"Chatbot ID {chatbot_id} için indeks politikası kontrol edilemedi: {e}")
+        return
+    if target_layout == current_layout:
+        return
+    with _faiss_promotions_guard:
+        if chatbot_id in _faiss_promotions_running:
+            return
+        _faiss_promotions_running.add(chatbot_id)
+    threading.Thread(target=retrain_faiss_index, args=(chatbot_id, *target_layout), daemon=True).start()
+
+
+def evaluate_index_compression(chatbot_id: int, codec: str, k: int = 10, sample_size: int = 1000) -> Dict[str, Any]:
+    """
+    Chatbot'un kendi parçaları üzerinde bir sıkıştırma seçeneğini değerlendirir: sıkıştırmasız ve sıkıştırılmış
+    indekslerin bellek boyutlarını ve parçaların kendisiyle sorgulandığında recall@k kaybını raporlar.
+    """
+    current_faiss_index = load_or_create_faiss_index(chatbot_id, writable=True)
+    vectors, ids = _id_mapped_vectors(current_faiss_index)
+    if len(ids) == 0:
+        return {"chatbot_id": chatbot_id, "codec": codec, "vectors": 0}
+    vectors = exact_vectors_from_db(vectors, ids)
+    index_type = describe_index_type(current_faiss_index.index)
+    policy = load_index_policy(chatbot_id)
+
+    baseline = build_faiss_index(index_type, vectors, ids, "none")
+    candidate = build_faiss_index(index_type, vectors, ids, codec)
+    exact = build_faiss_index("flat", vectors, ids, "none")
+    apply_index_search_params(baseline, policy)
+    apply_index_search_params(candidate, policy)
+
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(ids), size=min(sample_size, len(ids)), replace=False)
+    queries = vectors[sample]
+    k = min(k, len(ids))
+    _, truth = exact.search(queries, k)
+    _, baseline_hits = baseline.search(queries, k)
+    _, candidate_hits = candidate.search(queries, k)
+
+    def recall(found) -> float:
+        return float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+
+    baseline_bytes = faiss.serialize_index(baseline).nbytes
+    candidate_bytes = faiss.serialize_index(candidate).nbytes
+    return {
+        "chatbot_id": chatbot_id,
+        "index_type": index_type,
+        "codec": codec,
+        "vectors": int(len(ids)),
+        "baseline_bytes": int(baseline_bytes),
+        "compressed_bytes": int(candidate_bytes),
+        "memory_saved_bytes": int(baseline_bytes - candidate_bytes),
+        "compression_ratio": round(baseline_bytes / candidate_bytes, 2) if candidate_bytes else None,
+        f"baseline_recall_at_{k}": round(recall(baseline_hits), 4),
+        f"compressed_recall_at_{k}": round(recall(candidate_hits), 4),
+        "recall_loss": round(recall(baseline_hits) - recall(candidate_hits), 4),
+    }
+# --- ---
+
+# --- Belge İşleme (Ingestion) İşleri ---
+# Yüklemeler hemen bir iş kaydı olarak kabul edilir ve sınırlı bir thread havuzunda işlenir;
+# PDF ayrıştırma, veritabanı yazımı ve embedding çağrıları uvicorn olay döngüsünü bloklamaz.
+# Aşamalar:
+#   queued     - iş kuyrukta bekliyor
+#   processing - akış hattı çalışıyor: ayrıştırma, parçalama, embedding ve veritabanına yazım batch'ler halinde
+#                iç içe ilerlediği için ayrı aşamalar olarak raporlanmaz; ilerleme tamamlanan dosya oranıyla artar
+#   committed  - parçalar ve embedding'leri veritabanına işlendi; bundan sonra iş yeniden denenmez
+#   indexed    - delta segmentleri chatbot'un deposuna eklendi
+INGESTION_STAGES = ("queued", "processing", "committed", "indexed")
+
+ingestion_executor = ThreadPoolExecutor(max_workers=INGESTION_WORKERS, thread_name_prefix="ingestion")
+_ingestion_futures: Dict[int, Any] = {}
+_ingestion_futures_lock = threading.Lock()
+
+
+def job_owner() -> str:
+    """
+    İş kayıtlarının sahibi olarak yazılan süreç kimliği (host:pid). Aynı anda yalnızca bir canlı süreç bu kimliği
+    taşıyabildiği için, başlangıçta bu kimlikle kayıtlı işler önceki (çökmüş) süreç örneğine aittir.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def save_upload_to_temp_file(file: UploadFile, suffix: str) -> str:
+    """
+    Yüklenen dosyayı UPLOAD_CHUNK_BYTES'lık parçalar halinde benzersiz bir geçici dosyaya akıtır ve yolunu döndürür.
+    Dosyanın tamamı hiçbir zaman belleğe alınmaz; UPLOAD_MAX_BYTES aşılırsa yazım kesilir ve 413 döndürülür.
+    """
+    # İstemci boyutu bildirdiyse hiç yazmadan reddet
+    if file.size is not None and file.size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Dosya çok büyük. En fazla {UPLOAD_MAX_BYTES} bayt yüklenebilir.")
+
+    fd, file_location = tempfile.mkstemp(prefix="upload_", suffix=suffix, dir=UPLOAD_TEMP_DIR)
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as file_object:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Dosya çok büyük. En fazla {UPLOAD_MAX_BYTES} bayt yüklenebilir.")
+                await asyncio.to_thread(file_object.write, chunk)
+    except BaseException:
+        os.remove(file_location)
+        raise
+    return file_location
+
+
+# İş kaydında loader sınıfları adlarıyla saklanır
+INGESTION_LOADERS = {loader_class.__name__: loader_class for loader_class in (PyPDFLoader, TextLoader, Docx2txtLoader)}
+
+
+def create_ingestion_job(chatbot_id: int, filename: str, files: List[tuple]) -> int:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            INSERT INTO ingestion_jobs (chatbot_id, filename, files, owner, lease_expires_at)
+            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second') RETURNING id;
+            """,
+            (chatbot_id, filename, psycopg2.extras.Json([
+                {"path": file_location, "filename": original_filename, "loader": loader_class.__name__}
+                for file_location, original_filename, loader_class in files
+            ]), job_owner(), JOB_LEASE_SECONDS)
+        )
+        job_id = cursor.fetchone()[0]
+        conn.commit()
+        return job_id
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def update_ingestion_job(job_id: int, **fields):
+    """
+    İş kaydının verilen alanlarını günceller. İlerleme kaydı yazılamazsa işin kendisi durdurulmaz. Yalnızca işin
+    sahibi olan süreç yazabilir; kirası dolduktan sonra başka bir worker'a geçmiş işin kaydı eski sahibince ezilmez.
+    """
+    if fields.get("result") is not None:
+        fields["result"] = psycopg2.extras.Json(fields["result"])
+    assignments = ", ".join(f"{column} = %s" for column in fields)
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE ingestion_jobs SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = %s AND owner = %s;",
+                (*fields.values(), job_id, job_owner())
+            )
+        conn.commit()
+    except Exception as e:
+        print(f"İş {job_id} durumu güncellenirken hata oluştu: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def _report_stage(job_id: int, stage: str, fraction: float = 0.0, **fields):
+    """Aşamayı ve genel ilerlemeyi yazar; `fraction` aşamanın kendi içindeki tamamlanma oranıdır."""
+    progress = (INGESTION_STAGES.index(stage) + fraction) / (len(INGESTION_STAGES) - 1)
+    update_ingestion_job(job_id, stage=stage, progress=progress, **fields)
+
+
+_parser_pool = None
+_parser_pool_lock = threading.Lock()
+
+
+def get_parser_pool() -> ProcessPoolExecutor:
+    """
+    CPU'ya bağlı ayrıştırma ve parçalama için süreç havuzunu ilk kullanımda oluşturur. Çok thread'li
+    sunucu sürecinden fork güvenli olmadığı için `spawn` kullanılır; işçiler yalnızca hafif
+    document_parsing modülünü import eder.
+    """
+    global _parser_pool
+    with _parser_pool_lock:
+        if _parser_pool is None:
+            _parser_pool = ProcessPoolExecutor(
+                max_workers=PARSER_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _parser_pool
+
+
+def document_parsing_tasks(file_location: str, loader_class) -> List[tuple]:
+    """
+    Belgeyi süreç havuzunda ayrıştırıp parçalayacak görevleri (fonksiyon, argümanlar) sayfa sırasıyla döndürür.
+    PDF_PAGES_PER_TASK'tan uzun PDF'ler sayfa aralıklarına bölünür; diğer türler loader'ları dosyayı bütün
+    okuduğu için tek görevdir.
+    """
+    if loader_class is PyPDFLoader:
+        page_count = pdf_page_count(file_location)
+        if page_count > PDF_PAGES_PER_TASK:
+            return [
+                (parse_and_split_pdf_pages, (file_location, start, min(start + PDF_PAGES_PER_TASK, page_count)))
+                for start in range(0, page_count, PDF_PAGES_PER_TASK)
+            ]
+    return [(parse_and_split_file, (file_location, loader_class))]
+
+
+def stream_parsed_chunks(files: List[tuple]):
+    """
+    (anahtar, file_location, loader_class) listesindeki belgeleri süreç havuzunda ayrıştırır ve sonuçları
+    (anahtar, parçalar, hata) olarak belge ve sayfa sırasıyla üretir. Havuzda aynı anda en fazla
+    INGESTION_PARSE_WINDOW görev bulunur; tüketici yavaşladıkça yeni görev gönderilmez (backpressure), böylece
+    bellekte belge boyutundan bağımsız olarak yalnızca pencere kadar ayrıştırılmış sayfa tutulur. Pencere dosyalar
+    arasında paylaşıldığı için küçük dosyalar da birbirleriyle paralel ayrıştırılır. Bir dosya başarısız olursa
+    hatası bir kez bildirilir ve o dosyanın kalan sonuçları atlanır.
+    """
+    pool = get_parser_pool()
+
+    def tasks():
+        for key, file_location, loader_class in files:
+            try:
+                file_tasks = document_parsing_tasks(file_location, loader_class)
+            except Exception as e:
+                yield key, None, e
+                continue
+            for task in file_tasks:
+                yield key, task, None
+
+    pending_tasks = tasks()
+    in_flight = deque()
+    failed = set()
+
+    def fill_window():
+        while len(in_flight) < INGESTION_PARSE_WINDOW:
+            item = next(pending_tasks, None)
+            if item is None:
+                return
+            key, task, error = item
+            if key in failed:
+                continue
+            in_flight.append((key, pool.submit(task[0], *task[1]) if task is not None else None, error))
+
+    try:
+        fill_window()
+        while in_flight:
+            key, future, error = in_flight.popleft()
+            if key in failed:
+                if future is not None:
+                    future.cancel()
+                fill_window()
+                continue
+            chunks = []
+            if future is not None:
+                try:
+                    chunks = future.result()
+                except Exception as e:
+                    error = e
+            if error is not None:
+                failed.add(key)
+            fill_window()
+            yield key, chunks, error
+    finally:
+        # Tüketici erken çıkarsa (hata) henüz başlamamış görevler iptal edilir
+        for _, future, _ in in_flight:
+            if future is not None:
+                future.cancel()
+
+
+def file_content_hash(file_location: str) -> bytes:
+    digest = hashlib.sha256()
+    with open(file_location, "rb") as file_object:
+        for block in iter(lambda: file_object.read(UPLOAD_CHUNK_BYTES), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def chunk_content_hash(text: str) -> bytes:
+    """Parça içeriğinin modelden bağımsız hash'i; yeniden yüklemede değişmeyen parçaları tanımak için kullanılır."""
+    return hashlib.sha256(normalize_chunk_text(text).encode("utf-8")).digest()
+
+
+def load_file_chunk_hashes(cursor, chatbot_id: int, filename: str) -> Dict[bytes, List[int]]:
+    """
+    Aynı isimle daha önce yüklenmiş dosyanın parçalarını içerik hash'ine göre gruplar: {hash: [documents.id, ...]}.
+    Yeni parçalar akış sırasında bu tabloyla eşleştirilir; aynı içerikli tekrar eden parçalar adet olarak eşleşir
+    ve sonunda eşleşmeden kalan ID'ler dosyadan kalkan parçalardır.
+    """
+    cursor.execute(
+        """
+        SELECT d.id, d.content_hash, CASE WHEN d.content_hash IS NULL THEN d.content END
+        FROM chatbot_documents cd JOIN documents d ON d.id = cd.document_id
+        WHERE cd.chatbot_id = %s AND cd.original_filename = %s
+        ORDER BY d.id;
+        """,
+        (chatbot_id, filename)
+    )
+    existing: Dict[bytes, List[int]] = {}
+    for doc_id, content_hash, content in cursor.fetchall():
+        # Hash sütunundan önce yüklenmiş parçaların hash'i içerikten hesaplanır
+        key = bytes(content_hash) if content_hash is not None else chunk_content_hash(content)
+        existing.setdefault(key, []).append(doc_id)
+    return existing
+
+
+def insert_document_chunks(cursor, chatbot_id: int, filename: str, chunks: List[Document], vectors=None) -> List[int]:
+    """
+    Parçaları `documents` ve `chatbot_documents` tablolarına toplu olarak yazar ve belge ID'lerini parça sırasıyla döndürür.
+    ID'ler önce dizi (sequence) üzerinden tek sorguda ayrılır; böylece çok satırlı INSERT'lerin RETURNING
+    sırasına güvenmeden her parçanın ID'si bilinir. 2.000 parça için 4.000 yerine birkaç sorgu yapılır.
+    `vectors` verilirse embedding'ler aynı INSERT ile yazılır.
+    """
+    if not chunks:
+        return []
+    cursor.execute(
+        "SELECT nextval(pg_get_serial_sequence('documents', 'id')) FROM generate_series(1, %s);",
+        (len(chunks),)
+    )
+    document_ids = [row[0] for row in cursor.fetchall()]
+    encoded_vectors = [encode_embedding(vector) for vector in vectors] if vectors is not None else [None] * len(chunks)
+
+    psycopg2.extras.execute_values(
+        cursor,
+        "INSERT INTO documents (id, page_number, content, content_hash, embedding) VALUES %s;",
+        [
+            # page_number yoksa chunk indexini kullan
+            (doc_id, chunk.metadata.get("page", i), chunk.page_content, psycopg2.Binary(chunk_content_hash(chunk.page_content)), encoded_vector)
+            for i, (doc_id, chunk, encoded_vector) in enumerate(zip(document_ids, chunks, encoded_vectors))
+        ],
+        page_size=INGESTION_DB_PAGE_SIZE
+    )
+    psycopg2.extras.execute_values(
+        cursor,
+        "INSERT INTO chatbot_documents (chatbot_id, document_id, original_filename) VALUES %s;",
+        [(chatbot_id, doc_id, filename) for doc_id in document_ids],
+        page_size=INGESTION_DB_PAGE_SIZE
+    )
+    return document_ids
+
+
+class StreamingChunkWriter:
+    """
+    Ayrıştırılan parçaları akış halinde işler: her parça geldiği anda dosyanın önceki yüklemesiyle (içerik hash'i)
+    karşılaştırılır; yeni olanlar işin tamamı için tek olan bir tampona girer. Tampon INGESTION_STREAM_BATCH_SIZE
+    parçaya ulaşınca dosya sınırlarından bağımsız olarak tek batch'te embed edilir, parçalar embedding'leriyle
+    birlikte dosya bazında açık işleme (transaction) yazılır ve bellekteki delta segmentine eklenir. Böylece çok
+    sayıda küçük dosya için embedding çağrısı sayısı dosya sayısına değil toplam parça sayısına bağlıdır.
+    Segment INGESTION_SEGMENT_MAX_CHUNKS vektöre ulaşınca manifest'e eklenmeden diske yazılıp bellekten atılır;
+    bu segmentler işlem commit edildikten sonra `register_segments` ile tek adımda indekse eklenir. Bellekte belge
+    boyutundan bağımsız olarak en fazla bir batch ve bir segment bulunur.
+
+    Her dosyanın kendi satırları bir savepoint içinde yazılır; ayrıştırması yarıda başarısız olan dosya
+    `discard_file` ile diğer dosyalara dokunmadan geri alınır. Savepoint, dosyanın ilk satırı yazılmadan hemen
+    önce açılır: tamponda bekleyen önceki (tamamlanmış) dosyaların parçaları aynı batch'te ondan önce yazıldığı
+    için hiçbir zaman başka bir dosyanın savepoint'ine girmez. Tamamlanmış dosyaların tamponda kalan parçaları
+    sonraki batch'te ya da `flush` ile commit'ten önce yazılır.
+    """
+
+    def __init__(self, cursor, job_id: int, chatbot_id: int, store_key):
+        self.cursor = cursor
+        self.job_id = job_id
+        self.chatbot_id = chatbot_id
+        self.store_key = store_key
+        self.segment = _create_empty_faiss_index()
+        self.staged_segments: List[tuple] = [] # (segment adı, vektör sayısı)
+        self.removed_ids: List[int] = []
+        self.discarded_ids: List[int] = [] # Geri alınan dosyaların, diske yazılmış segmentlerde kalan ID'leri
+        self.chunks_seen = 0
+        self.chunks_added = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.embedding_batches = 0
+        self._pending: List[tuple] = [] # (dosya durumu, parça): embed edilmeyi bekleyen yeni parçalar, tüm dosyalar için
+        self._file = None
+
+    def start_file(self, filename: str):
+        self._file = {
+            "filename": filename,
+            "existing": load_file_chunk_hashes(self.cursor, self.chatbot_id, filename),
+            "savepoint": False,
+            "document_ids": [],
+            "new_chunks": 0,
+            "chunk_index": 0,
+            "kept": 0,
+        }
+
+    def add_chunks(self, chunks: List[Document]):
+        current = self._file
+        for chunk in chunks:
+            chunk.metadata.setdefault("page", current["chunk_index"]) # page_number yoksa dosyadaki parça sırası
+            current["chunk_index"] += 1
+            matching_ids = current["existing"].get(chunk_content_hash(chunk.page_content))
+            if matching_ids:
+                matching_ids.pop(0)
+                current["kept"] += 1
+            else:
+                self._pending.append((current, chunk))
+                current["new_chunks"] += 1
+        self.chunks_seen += len(chunks)
+        while len(self._pending) >= INGESTION_STREAM_BATCH_SIZE:
+            self._write_batch(self._pending[:INGESTION_STREAM_BATCH_SIZE])
+            del self._pending[:INGESTION_STREAM_BATCH_SIZE]
+
+    def flush(self):
+        """Tamponda kalan parçaları yazar; işlem commit edilmeden önce çağrılmalıdır."""
+        if self._pending:
+            self._write_batch(self._pending)
+            self._pending = []
+
+    def _write_batch(self, items: List[tuple]):
+        # Embedding'ler içerik hash önbelleğinden gelir; yalnızca önbellekte olmayan parçalar API'ye gider.
+        vectors, stats = cached_embeddings.embed_documents_with_stats([chunk.page_content for _, chunk in items])
+        self.cache_hits += stats["cache_hits"]
+        self.cache_misses += stats["cache_misses"]
+        self.embedding_batches += 1
+
+        # Tampon sıralı olduğundan batch, dosyalara göre ardışık gruplara ayrılır; varsa açık dosyanınki sonuncudur.
+        start = 0
+        while start < len(items):
+            file_state = items[start][0]
+            end = start
+            while end < len(items) and items[end][0] is file_state:
+                end += 1
+            chunks = [chunk for _, chunk in items[start:end]]
+            if file_state is self._file and not file_state["savepoint"]:
+                self.cursor.execute("SAVEPOINT ingest_file;")
+                file_state["savepoint"] = True
+            document_ids = insert_document_chunks(self.cursor, self.chatbot_id, file_state["filename"], chunks, vectors[start:end])
+            for chunk, doc_id in zip(chunks, document_ids):
+                chunk.metadata["doc_id"] = doc_id
+                chunk.metadata["chatbot_id"] = self.chatbot_id
+                chunk.metadata["original_filename"] = file_state["filename"]
+            add_chunks_to_faiss_index(self.segment, chunks, vectors[start:end])
+            file_state["document_ids"].extend(document_ids)
+            start = end
+        if self.segment.index.ntotal >= INGESTION_SEGMENT_MAX_CHUNKS:
+            self._stage_segment()
+        update_ingestion_job(self.job_id, total_chunks=self.chunks_seen)
+
+    def finish_file(self, file_hash: bytes) -> Dict[str, int]:
+        """
+        Artık bulunmayan parçaları siler ve dosya hash'ini kaydeder. Dosyanın tamponda bekleyen yeni parçaları
+        sonraki dosyaların parçalarıyla aynı batch'te embed edilip yazılır.
+        """
+        current = self._file
+        removed_ids = [doc_id for doc_ids in current["existing"].values() for doc_id in doc_ids]
+        if removed_ids:
+            self.cursor.execute("DELETE FROM documents WHERE id = ANY(%s);", (removed_ids,))
+        self.cursor.execute(
+            """
+            INSERT INTO chatbot_files (chatbot_id, original_filename, content_hash) VALUES (%s, %s, %s)
+            ON CONFLICT (chatbot_id, original_filename)
+            DO UPDATE SET content_hash = EXCLUDED.content_hash, updated_at = CURRENT_TIMESTAMP;
+            """,
+            (self.chatbot_id, current["filename"], psycopg2.Binary(file_hash))
+        )
+        if current["savepoint"]:
+            self.cursor.execute("RELEASE SAVEPOINT ingest_file;")
+        self.removed_ids.extend(removed_ids)
+        self.chunks_added += current["new_chunks"]
+        self._file = None
+        return {"chunks": current["new_chunks"], "kept": current["kept"], "removed": len(removed_ids)}
+
+    def discard_file(self):
+        """Yarıda kalan dosyanın satırlarını savepoint'e geri alır, tampondaki parçalarını atar ve vektörlerini segmentten çıkarır."""
+        current = self._file
+        if current["savepoint"]:
+            self.cursor.execute("ROLLBACK TO SAVEPOINT ingest_file;")
+            self.cursor.execute("RELEASE SAVEPOINT ingest_file;")
+        self._pending = [item for item in self._pending if item[0] is not current]
+        document_ids = current["document_ids"]
+        # Bellekteki segmentte kalanlar doğrudan silinir; diske yazılmış segmentlere girenler tombstone olur.
+        self.discarded_ids.extend(doc_id for doc_id in document_ids if doc_id not in self.segment.index_to_docstore_id)
+        remove_ids_from_faiss_index(self.segment, document_ids)
+        self._file = None
+
+    def _stage_segment(self):
+        ntotal = int(self.segment.index.ntotal)
+        if ntotal == 0:
+            return
+        stage_name = f"job{self.job_id}_{len(self.staged_segments) + 1}"
+        self.staged_segments.append((write_staged_faiss_segment(self.segment, self.store_key, stage_name), ntotal))
+        self.segment = _create_empty_faiss_index()
+
+    def register_segments(self) -> int:
+        """İşlem commit edildikten sonra çağrılır: segmentleri ve silmeleri indekse işler, bekleyen değişiklik sayısını döndürür."""
+        self._stage_segment()
+        pending_changes = 0
+        if self.staged_segments:
+            pending_changes = register_faiss_segments(self.staged_segments, self.store_key)
+            self.staged_segments = []
+        if self.removed_ids or self.discarded_ids:
+            pending_changes = append_faiss_tombstones(self.removed_ids + self.discarded_ids, self.store_key)
+        return pending_changes
+
+    def discard_staged_segments(self):
+        for segment_name, _ in self.staged_segments:
+            _remove_faiss_part(os.path.join(FAISS_INDEX_DIR, segment_name))
+        self.staged_segments = []
+
+    def embedding_cache_stats(self) -> Dict[str, Any]:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "chunks": lookups,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "hit_rate": (self.cache_hits / lookups) if lookups else 0.0,
+            "api_calls_saved": self.cache_hits,
+            "batches": self.embedding_batches,
+        }
+
+
+def ingest_documents(job_id: int, chatbot_id: int, files: List[tuple]) -> Dict[str, Any]:
+    """
+    Bir veya birden çok belgeyi (file_location, filename, loader_class) sınırlı bir akış hattında işler:
+    sayfalar süreç havuzunda ayrıştırılıp parçalanır, parçalar önceki yüklemeyle karşılaştırılır, yeni olanlar
+    dosyalar arasında ortak batch'lerde embed edilir, embedding'leriyle birlikte tek işlemde (transaction)
+    PostgreSQL'e yazılır ve delta segmentlerine eklenir (bkz. StreamingChunkWriter). Aşamalar arasında
+    backpressure olduğu için bellek kullanımı belge boyutundan bağımsızdır. Segmentler işlem commit edildikten sonra chatbot'un deposuna eklenir.
+    Aynı isimle daha önce yüklenmiş bir dosya aynıysa atlanır (unchanged); değiştiyse yalnızca yeni parçalar
+    eklenir, artık bulunmayan parçalar silinir ve değişmeyen parçalar vektörleriyle birlikte korunur.
+    Ayrıştırılamayan dosyalar dosya bazında başarısız raporlanır; hiçbiri işlenemezse iş başarısız olur.
+    İş kaydındaki stage/progress, INGESTION_STAGES'te tanımlanan aşamalara ulaşıldıkça güncellenir.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    writer = None
+    storage_locked = False
+    try:
+        # Depolama taşıması sürüyorsa bitmesi beklenir; kilit, segmentler depoya eklenene kadar tutulur
+        # (bkz. move_chatbot_storage). Ardından chatbot'un varlığını kontrol et ve depoyu belirle.
+        cursor.execute("SELECT pg_advisory_lock_shared(%s);", (chatbot_id,))
+        storage_locked = True
+        cursor.execute("SELECT index_storage FROM chatbots WHERE id = %s;", (chatbot_id,))
+        chatbot_row = cursor.fetchone()
+        if not chatbot_row:
+            raise ValueError(f"Chatbot ID {chatbot_id} bulunamadı.")
+        store_key = index_store_key(chatbot_id, chatbot_row[0])
+
+        # Aynı (chatbot, dosya adı) için eşzamanlı işler işlem sonuna kadar advisory lock ile sıraya sokulur.
+        to_parse = []
+        file_hashes: Dict[int, bytes] = {}
+        file_results = []
+        for file_number, (file_location, filename, loader_class) in enumerate(files):
+            file_result = {"filename": filename, "status": "succeeded", "chunks": 0, "kept": 0, "removed": 0, "error": None}
+            file_results.append(file_result)
+            try:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s));", (chatbot_id, filename))
+                file_hash = file_content_hash(file_location)
+                cursor.execute(
+                    "SELECT content_hash FROM chatbot_files WHERE chatbot_id = %s AND original_filename = %s;",
+                    (chatbot_id, filename)
+                )
+                previous = cursor.fetchone()
+                if previous and bytes(previous[0]) == file_hash:
+                    file_result["status"] = "unchanged"
+                    continue
+                file_hashes[file_number] = file_hash
+                to_parse.append((file_number, file_location, loader_class))
+            except Exception as e:
+                file_result.update(status="failed", error=str(e))
+
+        writer = StreamingChunkWriter(cursor, job_id, chatbot_id, store_key)
+        _report_stage(job_id, "processing")
+        files_done = 0
+
+        def _file_done():
+            nonlocal files_done
+            files_done += 1
+            _report_stage(job_id, "processing", fraction=files_done / len(to_parse), total_chunks=writer.chunks_seen)
+
+        current_file = None
+        for file_number, file_chunks, error in stream_parsed_chunks(to_parse):
+            if file_number != current_file:
+                if current_file is not None:
+                    file_results[current_file].update(writer.finish_file(file_hashes[current_file]))
+                    _file_done()
+                writer.start_file(files[file_number][1])
+                current_file = file_number
+            if error is not None:
+                print(f"'{files[file_number][1]}' ayrıştırılırken hata oluştu: {error}")
+                writer.discard_file()
+                file_results[file_number].update(status="failed", error=str(error))
+                _file_done()
+                current_file = None
+                continue
+            writer.add_chunks(file_chunks)
+        if current_file is not None:
+            file_results[current_file].update(writer.finish_file(file_hashes[current_file]))
+            _file_done()
+        writer.flush()
+        if all(r["status"] == "failed" for r in file_results):
+            raise ValueError("; ".join(f"{r['filename']}: {r['error']}" for r in file_results))
+
+        # Embedding'ler parçalarla aynı işlemde (transaction) veritabanına yazıldı; böylece indeks her an
+        # veritabanından, embedding API'sine gitmeden yeniden kurulabilir.
+        embedding_cache_stats = writer.embedding_cache_stats()
+        print(f"İş {job_id} ({len(to_parse)} dosya) için embedding önbelleği: {embedding_cache_stats}")
+        conn.commit()
+        _report_stage(job_id, "committed", total_chunks=writer.chunks_seen)
+
+        # Mevcut indeksi yüklemek yerine yalnızca yeni parçaları içeren delta segmentleri ekliyoruz;
+        # yükleme maliyeti böylece toplam korpusa değil yalnızca yeni dosyaların boyutuna bağlı kalır.
+        # Değişen dosyalardan kalkan parçalar indeksten tombstone olarak silinir.
+        pending_changes = writer.register_segments()
+        if writer.chunks_added or writer.removed_ids:
+            faiss_index_cache.invalidate(store_key)
+            schedule_faiss_compaction(store_key, pending_changes)
+            schedule_index_promotion(store_key)
+
+        chunks_added = writer.chunks_added
+        removed_count = len(writer.removed_ids)
+        processed = sum(1 for r in file_results if r["status"] != "failed")
+        unchanged = sum(1 for r in file_results if r["status"] == "unchanged")
+        if len(files) == 1 and unchanged:
+            message = f"Belge '{files[0][1]}' değişmemiş; Chatbot ID {chatbot_id} için yeniden işlenmedi."
+        elif len(files) == 1:
+            message = f"Belge '{files[0][1]}' başarıyla yüklendi ve Chatbot ID {chatbot_id} için işlendi. {chunks_added} yeni parça eklendi, {removed_count} parça kaldırıldı."
+        else:
+            message = f"{processed}/{len(files)} belge Chatbot ID {chatbot_id} için işlendi ({unchanged} değişmemiş). {chunks_added} yeni parça eklendi, {removed_count} parça kaldırıldı."
+        return {
+            "message": message,
+            "chunks": chunks_added,
+            "removed_chunks": removed_count,
+            "embedding_cache": embedding_cache_stats,
+            "files": file_results,
+        }
+    except Exception:
+        conn.rollback()
+        if writer is not None:
+            writer.discard_staged_segments()
+        raise
+    finally:
+        try:
+            if storage_locked:
+                cursor.execute("SELECT pg_advisory_unlock_shared(%s);", (chatbot_id,))
+                conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+
+
+def run_ingestion_job(job_id: int, chatbot_id: int, files: List[tuple]):
+    """
+    İşçi thread'inde çalışır: işi yürütür, sonucunu/hatasını iş kaydına yazar. Geçici dosyalar yalnızca
+    başarıda silinir; başarısız işler `POST .../retry` ile aynı dosyalardan yeniden denenebilir.
+    """
+    try:
+        update_ingestion_job(job_id, status="running", error=None)
+        result = ingest_documents(job_id, chatbot_id, files)
+        update_ingestion_job(job_id, status="succeeded", stage="indexed", progress=1.0, result=result, lease_expires_at=None)
+    except Exception as e:
+        print(f"Belge işleme hatası (iş {job_id}): {e}")
+        update_ingestion_job(job_id, status="failed", error=str(e), lease_expires_at=None)
+        return
+    finally:
+        with _ingestion_futures_lock:
+            _ingestion_futures.pop(job_id, None)
+    for file_location, _, _ in files:
+        if os.path.exists(file_location):
+            os.remove(file_location)
+
+
+def fail_interrupted_ingestion_jobs(startup: bool = False) -> int:
+    """
+    Sahibi çöktüğü veya yeniden başlatıldığı için yarıda kalan işleri yeniden denenebilir (failed) olarak işaretler:
+    kirası dolmuş işler ve `startup` iken bu sürecin kimliğiyle (aynı host:pid) kayıtlı önceki örneğin işleri.
+    Diğer worker'ların kirası süren işlerine dokunulmaz. İşaretlenen iş sayısını döndürür.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            UPDATE ingestion_jobs SET status = 'failed', error = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE status IN ('queued', 'running')
+              AND (lease_expires_at IS NULL OR lease_expires_at < CURRENT_TIMESTAMP OR (%s AND owner = %s));
+            """,
+            ("İşi yürüten sunucu süreci durduğu için iş yarıda kaldı.", startup, job_owner())
+        )
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def submit_ingestion_job(job_id: int, *args):
+    with _ingestion_futures_lock:
+        _ingestion_futures[job_id] = ingestion_executor.submit(run_ingestion_job, job_id, *args)
+
+
+def pending_ingestion_job_count() -> int:
+    with _ingestion_futures_lock:
+        return len(_ingestion_futures)
+
+
+def update_storage_move_job(job_id: int, **fields):
+    """
+    Taşıma işi kaydının verilen alanlarını günceller. Kayıt yazılamazsa taşımanın kendisi durdurulmaz.
+    Ingestion işlerinde olduğu gibi yalnızca işin sahibi olan süreç yazabilir.
+    """
+    assignments = ", ".join(f"{column} = %s" for column in fields)
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE storage_move_jobs SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = %s AND owner = %s;",
+                (*fields.values(), job_id, job_owner())
+            )
+        conn.commit()
+    except Exception as e:
+        print(f"Taşıma işi {job_id} durumu güncellenirken hata oluştu: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def run_storage_move_job(job_id: int, chatbot_id: int, from_storage: str | None, to_storage: str | None):
+    """İşçi thread'inde çalışır: depolama taşımasını yürütür, sonucunu/hatasını iş kaydına yazar."""
+    try:
+        update_storage_move_job(job_id, status="running", error=None)
+        move_chatbot_storage(chatbot_id, from_storage, to_storage)
+        update_storage_move_job(job_id, status="succeeded", lease_expires_at=None)
+    except Exception as e:
+        print(f"Chatbot ID {chatbot_id} depolama modu değiştirilirken hata oluştu (iş {job_id}): {e}")
+        update_storage_move_job(job_id, status="failed", error=str(e), lease_expires_at=None)
+    finally:
+        with _ingestion_futures_lock:
+            _storage_move_futures.pop(job_id, None)
+
+
+_storage_move_futures: Dict[int, Any] = {}
+
+
+def submit_storage_move_job(job_id: int, *args):
+    with _ingestion_futures_lock:
+        _storage_move_futures[job_id] = ingestion_executor.submit(run_storage_move_job, job_id, *args)
+
+
+def fail_interrupted_storage_moves(startup: bool = False) -> int:
+    """
+    Sahibi çöktüğü için yarıda kalan taşımaları başarısız olarak işaretler (kapsam için bkz.
+    fail_interrupted_ingestion_jobs). `index_storage` yalnızca taşıma sonunda değiştiği için chatbot eski deposundan
+    yanıt vermeye devam eder; taşıma yeniden istenebilir. İşaretlenen iş sayısını döndürür.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            UPDATE storage_move_jobs SET status = 'failed', error = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE status IN ('queued', 'running')
+              AND (lease_expires_at IS NULL OR lease_expires_at < CURRENT_TIMESTAMP OR (%s AND owner = %s));
+            """,
+            ("Taşımayı yürüten sunucu süreci durduğu için taşıma yarıda kaldı.", startup, job_owner())
+        )
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def storage_move_job_to_dict(row) -> Dict[str, Any]:
+    job_id, from_storage, to_storage, status, error, created_at, updated_at = row
+    return {
+        "job_id": job_id,
+        "from_storage": from_storage or FAISS_DEFAULT_STORAGE_MODE,
+        "to_storage": to_storage or FAISS_DEFAULT_STORAGE_MODE,
+        "status": status,
+        "error": error,
+        "created_at": created_at.isoformat(),
+        "updated_at": updated_at.isoformat(),
+    }
+
+
+class JobLeaseKeeper:
+    """
+    Bu sürecin üstlendiği işlerin kirasını (lease) canlı tutan arka plan thread'i. Her JOB_LEASE_SECONDS / 3
+    saniyede bu sürecin kuyrukta bekleyen ve çalışan işlerinin kirasını uzatır, ardından kirası dolmuş (sahibi
+    çökmüş veya veritabanına ulaşamayan) işleri başarısız olarak işaretler. Birden çok uvicorn worker'ı varken
+    bir worker'ın başlaması veya çökmesi, diğerlerinin sürmekte olan işlerini etkilemez.
+    """
 
+    def __init__(self, lease_seconds: float):
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._thread = None
+        self.renewals = 0
+        self.expired = 0
+        self.errors = 0
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="job-lease-keeper", daemon=True)
+            self._thread.start()
+
+    def renew(self) -> int:
+        """Bu sürecin sahip olduğu kuyruktaki/çalışan işlerin kirasını uzatır; uzatılan iş sayısını döndürür."""
+        renewed = 0
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                for table in ("ingestion_jobs", "storage_move_jobs"):
+                    cursor.execute(
+                        f"""
+                        UPDATE {table} SET lease_expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+                        WHERE owner = %s AND status IN ('queued', 'running');
+                        """,
+                        (self.lease_seconds, job_owner())
+                    )
+                    renewed += cursor.rowcount
+            conn.commit()
+        return renewed
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.renewals += self.renew()
+                self.expired += fail_interrupted_ingestion_jobs() + fail_interrupted_storage_moves()
+            except Exception as e:
+                self.errors += 1
+                print(f"İş kiraları yenilenirken hata oluştu: {e}")
+
+    def close(self):
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "owner": job_owner(),
+            "lease_seconds": self.lease_seconds,
+            "renewals": self.renewals,
+            "expired": self.expired,
+            "errors": self.errors,
+        }
+
+
+job_lease_keeper = JobLeaseKeeper(JOB_LEASE_SECONDS)
+
+
+def shutdown_ingestion_workers():
+    """Kuyrukta bekleyen işleri iptal edip başarısız olarak işaretler, çalışanların bitmesini bekler."""
+    with _ingestion_futures_lock:
+        queued = {job_id: future for job_id, future in _ingestion_futures.items() if future.cancel()}
+        queued_moves = [job_id for job_id, future in _storage_move_futures.items() if future.cancel()]
+    for job_id in queued:
+        update_ingestion_job(job_id, status="failed", error="Sunucu kapatıldığı için iş başlatılamadı.", lease_expires_at=None)
+    for job_id in queued_moves:
+        update_storage_move_job(job_id, status="failed", error="Sunucu kapatıldığı için taşıma başlatılamadı.", lease_expires_at=None)
+    ingestion_executor.shutdown(wait=True)
+    if _parser_pool is not None:
+        _parser_pool.shutdown(wait=True)
 # --- ---
 
 # Uygulama başlangıcında çalışacak fonksiyonlar
 @app.on_event("startup")
 async def startup_event():
+    # Bağlantı havuzu önce açılır; veritabanına ulaşılamıyorsa uygulama başlamaz.
+    get_db_pool().open()
     create_tables()
+    create_indexes()
+    maintain_chat_message_partitions(force=True)
+    chatbot_config_cache.start_listener(DATABASE_URL)
+    chat_message_writer.start()
+    # Yalnızca kirası dolmuş işler ve bu sürecin önceki örneğinin işleri başarısız sayılır; diğer worker'ların
+    # sürmekte olan işleri kiraları yenilendiği sürece olduğu gibi kalır.
+    fail_interrupted_ingestion_jobs(startup=True)
+    fail_interrupted_storage_moves(startup=True)
+    job_lease_keeper.start()
     # Artık burada tüm FAISS indekslerini yüklememize gerek yok,
     # ilgili chatbot seçildiğinde yüklenecekler.
 
@@ -283,8 +3624,13 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     # Kapanışta da her FAISS indeksini tek tek kaydetmemize gerek yok,
-    # her yükleme/ekleme işleminden sonra save_faiss_index çağrılacak.
-    pass # Bu fonksiyon boş kalabilir veya daha sonra temizlik için kullanılabilir.
+    # her yükleme/ekleme işleminden sonra delta segmenti yazılıyor.
+    shutdown_ingestion_workers()
+    job_lease_keeper.close()
+    # Kuyrukta bekleyen sohbet mesajları bağlantı havuzu kapanmadan önce yazılır
+    chat_message_writer.close()
+    chatbot_config_cache.stop_listener()
+    close_db_pool()
 
 # --- ---
 
@@ -307,13 +3653,8 @@ class UpdateChatbotRequest(BaseModel):
     boundary_text: str | None = None
 
 
-# --- FastAPI Uç Noktaları (Endpoints) ---
-@app.post("/chatbots/{chatbot_id}/upload_document/")
-async def upload_document_to_chatbot(chatbot_id: int, file: UploadFile = File(...)):
-    """
-    Belirli bir chatbot'a belge yükler. Yüklenen belgeyi işler,
-    PostgreSQL'e kaydeder ve embedding'lerini ilgili chatbot'un FAISS'ine ekler.
-    """
+def select_loader_class(file: UploadFile):
+    """Dosyanın içerik tipine veya uzantısına göre uygun LangChain loader sınıfını döndürür; desteklenmiyorsa None."""
     # Desteklenen dosya türleri ve yükleyicilerin haritası
     supported_loaders = {
         "application/pdf": PyPDFLoader,
@@ -348,294 +3689,451 @@ async def upload_document_to_chatbot(chatbot_id: int, file: UploadFile = File(..
     #         print(f"'{file.filename}' için UnstructuredFileLoader kullanılıyor.")
     #     except ImportError:
     #         raise HTTPException(status_code=400, detail="Desteklenmeyen dosya türü. Unstructured kütüphanesi yüklü değil veya dosya tipi bilinmiyor.")
+    return loader_class
+
+
+def ensure_chatbot_exists(chatbot_id: int):
+    if get_chatbot_config(chatbot_id) is None:
+        raise HTTPException(status_code=404, detail=f"Chatbot ID {chatbot_id} bulunamadı.")
 
 
+def queue_ingestion_job(chatbot_id: int, files: List[tuple]) -> int:
+    """Diske kaydedilmiş dosyalar için iş kaydı oluşturur ve işi kuyruğa alır; iş oluşturulamazsa dosyaları siler."""
+    try:
+        job_id = create_ingestion_job(chatbot_id, ", ".join(filename for _, filename, _ in files)[:255], files)
+    except Exception as e:
+        for file_location, _, _ in files:
+            os.remove(file_location)
+        print(f"Belge işleme işi oluşturma hatası: {e}")
+        raise HTTPException(status_code=500, detail=f"Belge işleme işi oluşturulurken bir hata oluştu: {e}")
+    submit_ingestion_job(job_id, chatbot_id, files)
+    return job_id
+
+
+# --- FastAPI Uç Noktaları (Endpoints) ---
+@app.post("/chatbots/{chatbot_id}/upload_document/")
+async def upload_document_to_chatbot(chatbot_id: int, file: UploadFile = File(...)):
+    """
+    Belirli bir chatbot'a belge yükler. Belge hemen kuyruğa alınır ve bir iş ID'si döndürülür;
+    ayrıştırma, PostgreSQL'e kayıt ve FAISS'e ekleme arka plandaki işçi havuzunda yapılır.
+    İlerleme `GET /chatbots/{chatbot_id}/ingestion_jobs/{job_id}` ile izlenir.
+    """
+    loader_class = select_loader_class(file)
+    file_extension = os.path.splitext(file.filename)[1].lower()
     if loader_class is None:
         raise HTTPException(status_code=400, detail=f"Desteklenmeyen dosya türü: {file.content_type} veya uzantı: {file_extension}. Sadece PDF, TXT, DOCX şu anda desteklenmektedir.")
 
+    if pending_ingestion_job_count() >= INGESTION_MAX_PENDING_JOBS:
+        raise HTTPException(status_code=503, detail="Belge işleme kuyruğu dolu. Lütfen biraz sonra tekrar deneyin.")
+    await run_db(ensure_chatbot_exists, chatbot_id)
 
-    # Geçici bir dosyaya kaydet
-    file_location = f"temp_{file.filename}"
-    with open(file_location, "wb+") as file_object:
-        file_object.write(file.file.read())
+    # Benzersiz bir geçici dosyaya parça parça kaydet; aynı isimli eşzamanlı yüklemeler birbirini ezmez.
+    # Loader'lar dosya yolu beklediği ve iş, istek kapandıktan sonra çalıştığı için Starlette'in
+    # spool dosyası doğrudan kullanılamaz; bu dosya tek kopyadır ve iş bitince silinir.
+    file_location = await save_upload_to_temp_file(file, file_extension)
+    job_id = await run_db(queue_ingestion_job, chatbot_id, [(file_location, file.filename, loader_class)])
+
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": f"Belge '{file.filename}' kuyruğa alındı.",
+            "job_id": job_id,
+            "status_url": f"/chatbots/{chatbot_id}/ingestion_jobs/{job_id}",
+        }
+    )
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        # Chatbot'un varlığını kontrol et
-        cursor.execute("SELECT COUNT(*) FROM chatbots WHERE id = %s;", (chatbot_id,))
-        if cursor.fetchone()[0] == 0:
-            raise HTTPException(status_code=404, detail=f"Chatbot ID {chatbot_id} bulunamadı.")
-
-        # Dinamik olarak loader'ı kullan
-        loader = loader_class(file_location)
-        # `load()` veya `load_and_split()` metodu loader'a göre değişebilir.
-        # Çoğu loader için `load_and_split()` güvenlidir.
-        # Eğer hata alırsanız sadece `load()` kullanıp sonra manuel split yapabilirsiniz.
-        pages = loader.load_and_split() 
-
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-        )
-        chunks = text_splitter.split_documents(pages)
 
-        document_ids = []
-        for i, chunk in enumerate(chunks):
+@app.post("/chatbots/{chatbot_id}/upload_documents/")
+async def upload_documents_to_chatbot(chatbot_id: int, files: List[UploadFile] = File(...)):
+    """
+    Birden çok belgeyi tek istekte yükler. Kabul edilen dosyalar tek bir işte birlikte işlenir: parçaları ortak
+    embedding batch'lerinde hesaplanır ve indeks sonunda bir kez güncellenir. Desteklenmeyen veya çok büyük
+    dosyalar `rejected` listesinde döner; diğerlerinin dosya bazında sonucu iş tamamlanınca `result.files` içindedir.
+    """
+    if pending_ingestion_job_count() >= INGESTION_MAX_PENDING_JOBS:
+        raise HTTPException(status_code=503, detail="Belge işleme kuyruğu dolu. Lütfen biraz sonra tekrar deneyin.")
+    await run_db(ensure_chatbot_exists, chatbot_id)
+
+    accepted = []
+    rejected = []
+    try:
+        for file in files:
+            loader_class = select_loader_class(file)
+            file_extension = os.path.splitext(file.filename)[1].lower()
+            if loader_class is None:
+                rejected.append({"filename": file.filename, "error": f"Desteklenmeyen dosya türü: {file.content_type} veya uzantı: {file_extension}."})
+                continue
+            try:
+                file_location = await save_upload_to_temp_file(file, file_extension)
+            except HTTPException as e:
+                rejected.append({"filename": file.filename, "error": e.detail})
+                continue
+            accepted.append((file_location, file.filename, loader_class))
+    except BaseException:
+        for file_location, _, _ in accepted:
+            os.remove(file_location)
+        raise
+
+    if not accepted:
+        raise HTTPException(status_code=400, detail={"message": "Yüklenen dosyaların hiçbiri kabul edilmedi.", "rejected": rejected})
+    job_id = await run_db(queue_ingestion_job, chatbot_id, accepted)
+
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": f"{len(accepted)} belge kuyruğa alındı.",
+            "job_id": job_id,
+            "status_url": f"/chatbots/{chatbot_id}/ingestion_jobs/{job_id}",
+            "accepted": [filename for _, filename, _ in accepted],
+            "rejected": rejected,
+        }
+    )
+
+
+@app.get("/chatbots/{chatbot_id}/ingestion_jobs/{job_id}")
+async def get_ingestion_job(chatbot_id: int, job_id: int):
+    """Bir belge yükleme işinin durumunu, aşamasını (bkz. INGESTION_STAGES) ve ilerlemesini döndürür."""
+    def _load_job():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
             cursor.execute(
-                "INSERT INTO documents (page_number, content) VALUES (%s, %s) RETURNING id;",
-                (chunk.metadata.get("page", i), chunk.page_content) # page_number yoksa chunk indexini kullan
+                """
+                SELECT id, filename, status, stage, progress, total_chunks, error, result, created_at, updated_at
+                FROM ingestion_jobs WHERE id = %s AND chatbot_id = %s;
+                """,
+                (job_id, chatbot_id)
             )
-            doc_id = cursor.fetchone()[0]
-            document_ids.append(doc_id)
-
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+            conn.close()
+        if not row:
+            raise HTTPException(status_code=404, detail=f"İş ID {job_id} bulunamadı.")
+        _, filename, status, stage, progress, total_chunks, error, result, created_at, updated_at = row
+        return {
+            "job_id": job_id,
+            "chatbot_id": chatbot_id,
+            "filename": filename,
+            "status": status,
+            "stage": stage,
+            "progress": progress,
+            "total_chunks": total_chunks,
+            "error": error,
+            "result": result,
+            "created_at": created_at.isoformat(),
+            "updated_at": updated_at.isoformat(),
+        }
+
+    return await run_db(_load_job)
+
+
+@app.post("/chatbots/{chatbot_id}/ingestion_jobs/{job_id}/retry")
+async def retry_ingestion_job(chatbot_id: int, job_id: int):
+    """
+    Başarısız bir işi aynı geçici dosyalardan yeniden kuyruğa alır. Önceki denemede embed edilip önbelleğe
+    yazılmış batch'ler yeniden embed edilmez. Parçalar veritabanına işlendikten (committed) sonra başarısız olan
+    işler yeniden denenmez; onlar için indeks `POST /admin/chatbots/{chatbot_id}/rebuild_index` ile onarılır.
+    Kirası hâlâ süren (başka bir süreçte çalışıyor olabilecek) işler yeniden denenmez. İş bu süreç tarafından
+    üstlenilir; kontrol ve sahiplik değişikliği aynı satır kilidi altında yapıldığından iş iki kez kuyruğa alınamaz.
+    """
+    def _retry():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
             cursor.execute(
-                "INSERT INTO chatbot_documents (chatbot_id, document_id, original_filename) VALUES (%s, %s, %s);",
-                (chatbot_id, doc_id, file.filename)
+                """
+                SELECT status, stage, files, lease_expires_at > CURRENT_TIMESTAMP FROM ingestion_jobs
+                WHERE id = %s AND chatbot_id = %s FOR UPDATE;
+                """,
+                (job_id, chatbot_id)
             )
-            chunk.metadata["doc_id"] = doc_id
-            chunk.metadata["chatbot_id"] = chatbot_id
-            chunk.metadata["original_filename"] = file.filename
-
-        conn.commit()
-
-        current_faiss_index = load_or_create_faiss_index(chatbot_id)
-        current_faiss_index.add_documents(chunks)
-        save_faiss_index(current_faiss_index, chatbot_id)
+            row = cursor.fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail=f"İş ID {job_id} bulunamadı.")
+            status, stage, stored_files, lease_active = row
+            if status != "failed":
+                raise HTTPException(status_code=409, detail=f"Yalnızca başarısız işler yeniden denenebilir (durum: {status}).")
+            if lease_active:
+                raise HTTPException(status_code=409, detail="İşin kirası henüz dolmadı; önceki deneme hâlâ sürüyor olabilir.")
+            if INGESTION_STAGES.index(stage) >= INGESTION_STAGES.index("committed"):
+                raise HTTPException(status_code=409, detail="Parçalar zaten kaydedildi; indeksi yeniden oluşturmak için rebuild_index kullanın.")
+            files = [(f["path"], f["filename"], INGESTION_LOADERS[f["loader"]]) for f in stored_files or []]
+            if not files or not all(os.path.exists(file_location) for file_location, _, _ in files):
+                raise HTTPException(status_code=410, detail="İşin geçici dosyaları artık mevcut değil. Lütfen belgeleri yeniden yükleyin.")
+            if pending_ingestion_job_count() >= INGESTION_MAX_PENDING_JOBS:
+                raise HTTPException(status_code=503, detail="Belge işleme kuyruğu dolu. Lütfen biraz sonra tekrar deneyin.")
 
+            cursor.execute(
+                """
+                UPDATE ingestion_jobs SET status = 'queued', stage = 'queued', progress = 0, error = NULL,
+                    owner = %s, lease_expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second', updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s;
+                """,
+                (job_owner(), JOB_LEASE_SECONDS, job_id)
+            )
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        submit_ingestion_job(job_id, chatbot_id, files)
         return JSONResponse(
-            status_code=200,
-            content={"message": f"Belge '{file.filename}' başarıyla yüklendi ve Chatbot ID {chatbot_id} için işlendi. Toplam {len(chunks)} parça oluşturuldu."}
+            status_code=202,
+            content={"message": f"İş {job_id} yeniden kuyruğa alındı.", "job_id": job_id, "status_url": f"/chatbots/{chatbot_id}/ingestion_jobs/{job_id}"}
         )
 
-    except Exception as e:
-        conn.rollback()
-        print(f"Belge işleme hatası: {e}")
-        raise HTTPException(status_code=500, detail=f"Belge işlenirken bir hata oluştu: {e}")
-    finally:
-        cursor.close()
-        conn.close()
-        if os.path.exists(file_location):
-            os.remove(file_location)
+    return await run_db(_retry)
 
 
 @app.put("/chatbots/{chatbot_id}", response_model=ChatbotResponse)
 async def update_chatbot(chatbot_id: int, request: UpdateChatbotRequest):
     """Belirli bir chatbot'u günceller."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        # Önce chatbot'un varlığını kontrol et
-        cursor.execute("SELECT name, description, boundary_text FROM chatbots WHERE id = %s;", (chatbot_id,))
-        existing_chatbot = cursor.fetchone()
-        if not existing_chatbot:
-            raise HTTPException(status_code=404, detail=f"Chatbot ID {chatbot_id} bulunamadı.")
-
-        updates = []
-        params = []
-
-        if request.name is not None:
-            updates.append("name = %s")
-            params.append(request.name)
-        if request.description is not None:
-            updates.append("description = %s")
-            params.append(request.description)
-        if request.boundary_text is not None:
-            updates.append("boundary_text = %s")
-            params.append(request.boundary_text)
-
-        if not updates:
-            raise HTTPException(status_code=400, detail="Güncellenecek veri sağlanmadı.")
-
-        params.append(chatbot_id) # WHERE koşulu için chatbot_id'yi en sona ekle
-
-        query = f"UPDATE chatbots SET {', '.join(updates)} WHERE id = %s RETURNING id, name, description, boundary_text;"
-        cursor.execute(query, params)
-        updated_data = cursor.fetchone()
+    def _update():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            # Önce chatbot'un varlığını kontrol et
+            cursor.execute("SELECT name, description, boundary_text FROM chatbots WHERE id = %s;", (chatbot_id,))
+            existing_chatbot = cursor.fetchone()
+            if not existing_chatbot:
+                raise HTTPException(status_code=404, detail=f"Chatbot ID {chatbot_id} bulunamadı.")
+
+            updates = []
+            params = []
+
+            if request.name is not None:
+                updates.append("name = %s")
+                params.append(request.name)
+            if request.description is not None:
+                updates.append("description = %s")
+                params.append(request.description)
+            if request.boundary_text is not None:
+                updates.append("boundary_text = %s")
+                params.append(request.boundary_text)
+
+            if not updates:
+                raise HTTPException(status_code=400, detail="Güncellenecek veri sağlanmadı.")
+
+            params.append(chatbot_id) # WHERE koşulu için chatbot_id'yi en sona ekle
+
+            updates.append("config_version = config_version + 1")
+            query = f"UPDATE chatbots SET {', '.join(updates)} WHERE id = %s RETURNING id, name, description, boundary_text, config_version;"
+            cursor.execute(query, params)
+            updated_data = cursor.fetchone()
+
+            if updated_data:
+                publish_chatbot_config_change(cursor, chatbot_id, updated_data[4])
+                conn.commit()
+                chatbot_config_cache.invalidate(chatbot_id, updated_data[4])
+                return ChatbotResponse(
+                    id=updated_data[0],
+                    name=updated_data[1],
+                    description=updated_data[2],
+                    boundary_text=updated_data[3]
+                )
+            else:
+                raise HTTPException(status_code=404, detail=f"Chatbot ID {chatbot_id} bulunamadı veya güncellenemedi.")
 
-        if updated_data:
-            conn.commit()
-            return ChatbotResponse(
-                id=updated_data[0],
-                name=updated_data[1],
-                description=updated_data[2],
-                boundary_text=updated_data[3]
-            )
-        else:
-            raise HTTPException(status_code=404, detail=f"Chatbot ID {chatbot_id} bulunamadı veya güncellenemedi.")
+        except psycopg2.errors.UniqueViolation:
+            conn.rollback()
+            raise HTTPException(status_code=400, detail="Bu isimde bir chatbot zaten mevcut.")
+        except Exception as e:
+            conn.rollback()
+            print(f"Chatbot güncelleme hatası: {e}")
+            raise HTTPException(status_code=500, detail=f"Chatbot güncellenirken bir hata oluştu: {e}")
+        finally:
+            cursor.close()
+            conn.close()
 
-    except psycopg2.errors.UniqueViolation:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail="Bu isimde bir chatbot zaten mevcut.")
-    except Exception as e:
-        conn.rollback()
-        print(f"Chatbot güncelleme hatası: {e}")
-        raise HTTPException(status_code=500, detail=f"Chatbot güncellenirken bir hata oluştu: {e}")
-    finally:
-        cursor.close()
-        conn.close()
+    return await run_db(_update)
 
 @app.delete("/chatbots/{chatbot_id}", status_code=204) # 204 No Content for successful deletion
 async def delete_chatbot(chatbot_id: int):
     """Belirli bir chatbot'u ve ilişkili tüm dokümanlarını siler."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        # Önce chatbot'un varlığını kontrol et
-        cursor.execute("SELECT COUNT(*) FROM chatbots WHERE id = %s;", (chatbot_id,))
-        if cursor.fetchone()[0] == 0:
-            raise HTTPException(status_code=404, detail=f"Chatbot ID {chatbot_id} bulunamadı.")
-
-        # `ON DELETE CASCADE` sayesinde `chatbot_documents` tablosundaki ilgili girişler otomatik silinecektir.
-        # Ancak, `documents` tablosundaki orijinal doküman parçaları silinmez.
-        # Eğer bir doküman birden fazla chatbota bağlıysa, sadece o chatbot'a ait bağlantı silinir.
-        # Eğer bir doküman sadece bu chatbota bağlıysa ve onu tamamen silmek istiyorsanız, daha karmaşık bir mantık gerekir.
-        # Şimdilik, sadece chatbot_documents bağlantısını ve chatbot'u silmek yeterlidir.
-
-        # Chatbot'u sil
-        cursor.execute("DELETE FROM chatbots WHERE id = %s RETURNING id;", (chatbot_id,))
-        deleted_id = cursor.fetchone()
-
-        if not deleted_id:
-            raise HTTPException(status_code=404, detail=f"Chatbot ID {chatbot_id} bulunamadı veya silinemedi.")
-
-        conn.commit()
+    def _delete():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            # Önce chatbot'un varlığını kontrol et
+            cursor.execute("SELECT index_storage FROM chatbots WHERE id = %s;", (chatbot_id,))
+            chatbot_row = cursor.fetchone()
+            if not chatbot_row:
+                raise HTTPException(status_code=404, detail=f"Chatbot ID {chatbot_id} bulunamadı.")
+            store_key = index_store_key(chatbot_id, chatbot_row[0])
+
+            # Ortak parçadaki vektörleri silebilmek için, bağlantılar cascade ile silinmeden önce belge id'lerini al
+            shared_doc_ids = []
+            if is_shared_store_key(store_key):
+                cursor.execute("SELECT document_id FROM chatbot_documents WHERE chatbot_id = %s;", (chatbot_id,))
+                shared_doc_ids = [row[0] for row in cursor.fetchall()]
+
+            # `ON DELETE CASCADE` sayesinde `chatbot_documents` tablosundaki ilgili girişler otomatik silinecektir.
+            # Ancak, `documents` tablosundaki orijinal doküman parçaları silinmez.
+            # Eğer bir doküman birden fazla chatbota bağlıysa, sadece o chatbot'a ait bağlantı silinir.
+            # Eğer bir doküman sadece bu chatbota bağlıysa ve onu tamamen silmek istiyorsanız, daha karmaşık bir mantık gerekir.
+            # Şimdilik, sadece chatbot_documents bağlantısını ve chatbot'u silmek yeterlidir.
+
+            # Chatbot'u sil
+            cursor.execute("DELETE FROM chatbots WHERE id = %s RETURNING id;", (chatbot_id,))
+            deleted_id = cursor.fetchone()
+
+            if not deleted_id:
+                raise HTTPException(status_code=404, detail=f"Chatbot ID {chatbot_id} bulunamadı veya silinemedi.")
+
+            publish_chatbot_config_change(cursor, chatbot_id, None)
+            conn.commit()
+            chatbot_config_cache.invalidate(chatbot_id)
+
+            if is_shared_store_key(store_key):
+                # Ortak parçadaki vektörleri silindi olarak işaretle; diğer chatbot'ların verisine dokunulmaz
+                if shared_doc_ids:
+                    pending_changes = append_faiss_tombstones(shared_doc_ids, store_key)
+                    schedule_faiss_compaction(store_key, pending_changes)
+                faiss_index_cache.invalidate(store_key)
+            else:
+                faiss_index_cache.invalidate(chatbot_id)
+                delete_faiss_index_files(chatbot_id)
 
-        # İlişkili FAISS indeks dosyasını diskten sil
-        chatbot_faiss_path = os.path.join(FAISS_INDEX_DIR, f"faiss_index_{chatbot_id}.bin")
-        if os.path.exists(chatbot_faiss_path):
-            os.remove(chatbot_faiss_path)
-            print(f"Chatbot ID {chatbot_id} için FAISS indeksi dosyası silindi.")
+            return Response(status_code=204) # 204 No Content
 
-        return Response(status_code=204) # 204 No Content
+        except Exception as e:
+            conn.rollback()
+            print(f"Chatbot silme hatası: {e}")
+            raise HTTPException(status_code=500, detail=f"Chatbot silinirken bir hata oluştu: {e}")
+        finally:
+            cursor.close()
+            conn.close()
 
-    except Exception as e:
-        conn.rollback()
-        print(f"Chatbot silme hatası: {e}")
-        raise HTTPException(status_code=500, detail=f"Chatbot silinirken bir hata oluştu: {e}")
-    finally:
-        cursor.close()
-        conn.close()
+    return await run_db(_delete)
 
 # Chatbot'a yüklenen belirli bir dokümanı kaldırma endpoint'i (İsteğe Bağlı ama İyi olur)
 @app.delete("/chatbots/{chatbot_id}/documents/{document_id}", status_code=204)
 async def remove_document_from_chatbot(chatbot_id: int, document_id: int):
     """Belirli bir dokümanı belirli bir chatbota bağlantısından kaldırır."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        # Chatbot ve doküman bağlantısının varlığını kontrol et
-        cursor.execute(
-            "SELECT COUNT(*) FROM chatbot_documents WHERE chatbot_id = %s AND document_id = %s;",
-            (chatbot_id, document_id)
-        )
-        if cursor.fetchone()[0] == 0:
-            raise HTTPException(status_code=404, detail="Belirtilen chatbot ve doküman bağlantısı bulunamadı.")
+    def _remove():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            # Depolama taşıması sürüyorsa yeni depo bu silmeyi kaçırabilirdi (bkz. move_chatbot_storage)
+            cursor.execute("SELECT pg_try_advisory_xact_lock_shared(%s);", (chatbot_id,))
+            if not cursor.fetchone()[0]:
+                raise HTTPException(status_code=409, detail="Bu chatbot için süren bir depolama taşıması var; bitmesini bekleyin.")
 
-        # chatbot_documents tablosundaki bağlantıyı sil
-        cursor.execute(
-            "DELETE FROM chatbot_documents WHERE chatbot_id = %s AND document_id = %s;",
-            (chatbot_id, document_id)
-        )
-        conn.commit()
+            # Chatbot ve doküman bağlantısının varlığını kontrol et
+            cursor.execute(
+                """
+                SELECT c.index_storage FROM chatbot_documents cd JOIN chatbots c ON c.id = cd.chatbot_id
+                WHERE cd.chatbot_id = %s AND cd.document_id = %s;
+                """,
+                (chatbot_id, document_id)
+            )
+            link_row = cursor.fetchone()
+            if not link_row:
+                raise HTTPException(status_code=404, detail="Belirtilen chatbot ve doküman bağlantısı bulunamadı.")
+            store_key = index_store_key(chatbot_id, link_row[0])
 
-        # FAISS indeksini yeniden oluştur (veya güncelleyip kaydet)
-        # Bu kısım karmaşıklaşabilir, çünkü bir dokümanı FAISS'ten tam olarak kaldırmak zordur.
-        # En basit yol, FAISS indeksini tamamen yeniden oluşturmaktır (dokümanları DB'den çekerek).
-        # Büyük indeksler için performans sorunu yaratabilir.
-        # Daha verimli bir yöntem, FAISS'te "soft delete" veya "rebuild on demand" uygulamaktır.
-        # Şimdilik, sadece FAISS indeksini yenilemiyoruz, çünkü bir sonraki yüklemede veya
-        # yeni doküman eklemede indeks otomatik güncellenecektir.
-        # Veya basitçe tüm dokümanları çekip yeniden indeksleyebiliriz (büyük verilerde sorun).
-        # Daha iyi bir yaklaşım: İndeksi yeniden oluşturmak için bir yardımcı fonksiyon yazmak.
-        
-        # Basit bir yeniden oluşturma örneği (performans açısından sorunlu olabilir):
-        # documents_for_reindexing = []
-        # cursor.execute("""
-        #     SELECT d.page_number, d.content, cd.original_filename, cd.chatbot_id, d.id as doc_id
-        #     FROM documents d
-        #     JOIN chatbot_documents cd ON d.id = cd.document_id
-        #     WHERE cd.chatbot_id = %s;
-        # """, (chatbot_id,))
-        # for page_num, content, filename, cb_id, d_id in cursor.fetchall():
-        #     new_doc = Document(page_content=content, metadata={"page": page_num, "original_filename": filename, "chatbot_id": cb_id, "doc_id": d_id})
-        #     documents_for_reindexing.append(new_doc)
-        
-        # faiss_base_index = faiss.IndexFlatL2(GEMINI_EMBEDDING_DIM)
-        # current_faiss_index = FAISS(
-        #     embedding_function=embeddings.embed_query,
-        #     index=faiss_base_index,
-        #     docstore=InMemoryDocstore(),
-        #     index_to_docstore_id={}
-        # )
-        # if documents_for_reindexing:
-        #     current_faiss_index.add_documents(documents_for_reindexing)
-        # save_faiss_index(current_faiss_index, chatbot_id)
-        # print(f"Chatbot ID {chatbot_id} için FAISS indeksi yeniden oluşturuldu.")
+            # chatbot_documents tablosundaki bağlantıyı sil. Dosyanın kayıtlı hash'i de silinir; aksi halde aynı dosya
+            # yeniden yüklendiğinde "değişmemiş" sayılır ve kaldırılan parça geri eklenmezdi.
+            cursor.execute(
+                """
+                DELETE FROM chatbot_files cf USING chatbot_documents cd
+                WHERE cd.chatbot_id = %s AND cd.document_id = %s
+                  AND cf.chatbot_id = cd.chatbot_id AND cf.original_filename = cd.original_filename;
+                """,
+                (chatbot_id, document_id)
+            )
+            cursor.execute(
+                "DELETE FROM chatbot_documents WHERE chatbot_id = %s AND document_id = %s;",
+                (chatbot_id, document_id)
+            )
+            conn.commit()
 
+            # Belgenin vektörünü ve docstore girdisini indeksten kaldır. İndeks documents.id ile anahtarlandığı için
+            # yeniden embed veya tüm indeksi yeniden yazma gerekmez; silme manifest'e işlenir ve compaction'da kalıcılaşır.
+            pending_changes = append_faiss_tombstones([document_id], store_key)
+            faiss_index_cache.invalidate(store_key)
+            schedule_faiss_compaction(store_key, pending_changes)
 
-        return Response(status_code=204)
+            return Response(status_code=204)
 
-    except Exception as e:
-        conn.rollback()
-        print(f"Doküman kaldırma hatası: {e}")
-        raise HTTPException(status_code=500, detail=f"Doküman kaldırılırken bir hata oluştu: {e}")
-    finally:
-        cursor.close()
-        conn.close()
+        except HTTPException:
+            conn.rollback()
+            raise
+        except Exception as e:
+            conn.rollback()
+            print(f"Doküman kaldırma hatası: {e}")
+            raise HTTPException(status_code=500, detail=f"Doküman kaldırılırken bir hata oluştu: {e}")
+        finally:
+            cursor.close()
+            conn.close()
+
+    return await run_db(_remove)
 
 # Bir chatbota ait tüm dokümanları listeleme endpoint'i (Frontend için faydalı)
 @app.get("/chatbots/{chatbot_id}/documents/", response_model=List[dict])
 async def list_chatbot_documents(chatbot_id: int):
     """Belirli bir chatbota ait tüm dokümanları listeler."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        # Chatbot'un varlığını kontrol et
-        cursor.execute("SELECT COUNT(*) FROM chatbots WHERE id = %s;", (chatbot_id,))
-        if cursor.fetchone()[0] == 0:
-            raise HTTPException(status_code=404, detail=f"Chatbot ID {chatbot_id} bulunamadı.")
-
-        cursor.execute("""
-            SELECT cd.document_id, cd.original_filename, d.page_number
-            FROM chatbot_documents cd
-            JOIN documents d ON cd.document_id = d.id
-            WHERE cd.chatbot_id = %s
-            GROUP BY cd.document_id, cd.original_filename, d.page_number
-            ORDER BY cd.original_filename, d.page_number;
-        """, (chatbot_id,))
+    def _list():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            # Chatbot'un varlığını kontrol et (önbellekte varsa veritabanına gidilmez)
+            if get_chatbot_config(chatbot_id, conn) is None:
+                raise HTTPException(status_code=404, detail=f"Chatbot ID {chatbot_id} bulunamadı.")
+
+            cursor.execute("""
+                SELECT cd.document_id, cd.original_filename, d.page_number
+                FROM chatbot_documents cd
+                JOIN documents d ON cd.document_id = d.id
+                WHERE cd.chatbot_id = %s
+                GROUP BY cd.document_id, cd.original_filename, d.page_number
+                ORDER BY cd.original_filename, d.page_number;
+            """, (chatbot_id,))
         
-        documents_data = {}
-        for doc_id, filename, page_number in cursor.fetchall():
-            if filename not in documents_data:
-                documents_data[filename] = {
-                    "filename": filename,
-                    "document_ids": [],
-                    "pages": []
-                }
-            documents_data[filename]["document_ids"].append(doc_id)
-            documents_data[filename]["pages"].append(page_number)
+            documents_data = {}
+            for doc_id, filename, page_number in cursor.fetchall():
+                if filename not in documents_data:
+                    documents_data[filename] = {
+                        "filename": filename,
+                        "document_ids": [],
+                        "pages": []
+                    }
+                documents_data[filename]["document_ids"].append(doc_id)
+                documents_data[filename]["pages"].append(page_number)
         
-        # Liste haline getir
-        response_list = [
-            {"filename": k, "document_ids": list(set(v["document_ids"])), "pages": sorted(list(set(v["pages"])))}
-            for k, v in documents_data.items()
-        ]
+            # Liste haline getir
+            response_list = [
+                {"filename": k, "document_ids": list(set(v["document_ids"])), "pages": sorted(list(set(v["pages"])))}
+                for k, v in documents_data.items()
+            ]
         
-        return response_list
+            return response_list
+
+        except Exception as e:
+            print(f"Chatbot dokümanlarını listeleme hatası: {e}")
+            raise HTTPException(status_code=500, detail=f"Chatbot dokümanları listelenirken bir hata oluştu: {e}")
+        finally:
+            cursor.close()
+            conn.close()
+
+    return await run_db(_list)
+
 
-    except Exception as e:
-        print(f"Chatbot dokümanlarını listeleme hatası: {e}")
-        raise HTTPException(status_code=500, detail=f"Chatbot dokümanları listelenirken bir hata oluştu: {e}")
-    finally:
-        cursor.close()
-        conn.close()
 
+class IndexPolicyRequest(BaseModel):
+    index_type: str | None = None # "flat", "ivf" veya "hnsw"
+    index_codec: str | None = None # "none", "fp16", "sq8" veya "pq"
+    storage_mode: str | None = None # "per_bot" veya "shared"
+    promotion_threshold: int | None = None
+    nprobe: int | None = None
+    ef_search: int | None = None
 
 
 class ChatRequest(BaseModel):
     query: str
+    # Verilmezse her istekte yeni bir oturum açılır (session_created=true); konuşmayı sürdürmek için istemci
+    # yanıttaki session_id'yi sonraki isteklerde göndermelidir.
+    session_id: uuid.UUID | None = None
 
 
 # Selamlama kalıplarını belirleyelim
@@ -646,36 +4144,57 @@ async def chat_with_chatbot(chatbot_id: int, request: ChatRequest):
     """
     Belirli bir chatbot'a göre kullanıcı sorularını yanıtlar.
     Konuşma geçmişini yönetir ve Guardrails ile çıktıyı doğrular.
+
+    Geçmiş oturum bazındadır: `session_id` verilmezse önceki sürümlerdeki gibi chatbot'un tüm geçmişi
+    kullanılmaz, boş geçmişli yeni bir oturum açılır ve yanıtta `session_created: true` ile bildirilir.
+    Konuşmayı sürdürmek için yanıttaki `session_id` sonraki isteklerde gönderilmelidir.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # İsteğin okumaları tek bir havuz bağlantısıyla, olay döngüsünü bloklamadan db_executor'da yapılır;
+    # bağlantı LLM çağrısı süresince tutulmaz. Geçmiş yalnızca isteğin oturumundan okunur.
+    def _load_chatbot_and_history():
+        with db_connection() as conn:
+            # Chatbot yapılandırması önbellekten gelir; yalnızca ıskalamada veritabanına gidilir
+            config = get_chatbot_config(chatbot_id, conn)
+            if config is None:
+                raise HTTPException(status_code=404, detail=f"Chatbot ID {chatbot_id} bulunamadı.")
+            chatbot_data = (config["name"], config["boundary_text"], config["index_storage"])
+            with conn.cursor() as cursor:
+                if request.session_id is None:
+                    session_id, _ = create_chat_session(cursor, chatbot_id)
+                    conn.commit()
+                    return chatbot_data, session_id, []
+                session_id = str(request.session_id)
+                started_at = get_chat_session_start(cursor, chatbot_id, session_id)
+            # Bu süreçte kuyrukta bekleyen (henüz yazılmamış) önceki turlar da pencereye eklenir. Kuyruk görüntüsü
+            # sorgudan önce alınır: görüntüde olmayan bir mesaj zaten commit edilmiştir ve sorguda görünür.
+            pending = chat_message_writer.pending_messages(session_id)
+            chat_history = load_chat_history_from_db(session_id, started_at, conn, pending=pending)
+        return chatbot_data, session_id, chat_history
+
     try:
-        cursor.execute("SELECT name, boundary_text FROM chatbots WHERE id = %s;", (chatbot_id,))
-        chatbot_data = cursor.fetchone()
-        if not chatbot_data:
-            raise HTTPException(status_code=404, detail=f"Chatbot ID {chatbot_id} bulunamadı.")
-        chatbot_name, boundary_text = chatbot_data
+        (chatbot_name, boundary_text, index_storage), session_id, loaded_chat_history_messages = await run_db(_load_chatbot_and_history)
 
-        current_faiss_index = load_or_create_faiss_index(chatbot_id)
+        store_key = index_store_key(chatbot_id, index_storage)
+        # Önbellekte yoksa indeks diskten okunur; bu da olay döngüsü dışında yapılır.
+        current_faiss_index = await asyncio.to_thread(get_faiss_index, store_key)
 
         context_str = ""
-        if current_faiss_index is None or (hasattr(current_faiss_index.index, 'ntotal') and current_faiss_index.index.ntotal == 0):
+        if current_faiss_index is None or chatbot_vector_count(current_faiss_index, chatbot_id, store_key) == 0:
             print(f"Uyarı: '{chatbot_name}' için henüz taranmış bir belge bulunmuyor. Genel bilgi ile devam ediliyor.")
         else:
-            # Kullanıcının sorgusuyla ilgili dokümanları çek
-            # LangChainDeprecationWarning'i çözmek için .invoke() kullanıyoruz.
-            docs = await current_faiss_index.as_retriever().ainvoke(request.query)
+            # Kullanıcının sorgusuyla ilgili dokümanları çek. Sorgu embedding'i önbellekteyse
+            # embedding modeline ağ çağrısı yapılmadan doğrudan vektör araması yapılır.
+            query_vector = await get_query_embedding(request.query)
+            docs = await search_chatbot_documents(current_faiss_index, chatbot_id, store_key, query_vector, RETRIEVER_TOP_K)
             context_str = "\n".join([doc.page_content for doc in docs])
 
 
-        loaded_chat_history_messages = load_chat_history_from_db(chatbot_id)
-
         # LangChain memory nesnesini oluştur (Bu deprecation uyarısı devam edebilir, LangChain'in iç yapısıyla ilgili)
         memory = ConversationBufferWindowMemory(
             memory_key="chat_history", 
             return_messages=True, 
             output_key='answer',
-            k=5 
+            k=CHAT_HISTORY_TURNS
         )
         # Geçmiş mesajları memory'ye ekle
         for msg in loaded_chat_history_messages:
@@ -715,7 +4234,9 @@ async def chat_with_chatbot(chatbot_id: int, request: ChatRequest):
 
         # Guardrails'ı kullanarak LLM'den yanıt al
         try:
-            validated_output = guard_therapist(
+            # Guardrails çağrısı (LLM isteği ve yeniden sormalar) senkron olduğu için thread'de çalışır.
+            validated_output = await asyncio.to_thread(
+                guard_therapist,
                 call_llm_with_guardrails, 
                 llm_model=llm,            
                 messages=messages_for_guardrails, 
@@ -764,12 +4285,19 @@ async def chat_with_chatbot(chatbot_id: int, request: ChatRequest):
             sentiment_score = response_data_from_guardrails.get("sentiment_score")
             safety_flag = response_data_from_guardrails.get("safety_flag")
 
-            save_chat_message_to_db(chatbot_id, "user", request.query)
-            save_chat_message_to_db(chatbot_id, "bot", therapist_response)
+            # Mesajlar write-behind kuyruğuna eklenir; yanıt veritabanı yazımını beklemez. Kuyruk doluysa bir
+            # süre yer açılması beklenir, yine de eklenemezse mesajlar doğrudan yazılır.
+            turn = [("user", request.query), ("bot", therapist_response)]
+            if not chat_message_writer.enqueue(chatbot_id, session_id, turn):
+                if not await asyncio.to_thread(chat_message_writer.enqueue, chatbot_id, session_id, turn, CHAT_WRITER_ENQUEUE_TIMEOUT_SECONDS):
+                    timestamp = datetime.now(timezone.utc)
+                    await run_db(save_chat_messages_to_db, [(chatbot_id, session_id, sender, message, timestamp) for sender, message in turn])
 
             return JSONResponse(
                 status_code=200,
                 content={
+                    "session_id": session_id,
+                    "session_created": request.session_id is None,
                     "answer": therapist_response,
                     "sentiment_score": sentiment_score,
                     "safety_flag": safety_flag
@@ -802,7 +4330,7 @@ async def chat_with_chatbot(chatbot_id: int, request: ChatRequest):
 
             return JSONResponse(
                 status_code=500,
-                content={"answer": error_message, "error_details": str(guardrails_or_llm_e)}
+                content={"session_id": session_id, "session_created": request.session_id is None, "answer": error_message, "error_details": str(guardrails_or_llm_e)}
             )
 
     except HTTPException as e:
@@ -812,101 +4340,435 @@ async def chat_with_chatbot(chatbot_id: int, request: ChatRequest):
         print(f"Genel chatbot sohbet hatası (dış blok): {e}")
         # Diğer genel hatalar için yakalama
         raise HTTPException(status_code=500, detail=f"Soru işlenirken beklenmeyen bir hata oluştu: {e}. Güvenliğiniz benim için önemli.")
-    finally:
-        cursor.close()
-        conn.close()
 
     
 
 # --- Yeni Chatbot Yönetim Endpoints'leri ---
 
+def load_history_page(chatbot_id: int, session_id: str, limit: int, before: int | None = None, since: int | None = None) -> tuple:
+    """
+    Oturumun sohbet geçmişinden bir sayfa okur (keyset pagination). İmleç bir mesaj ID'sidir; sıralama (timestamp, id)
+    üzerinden yapıldığı için sorgular (session_id, timestamp, id) indeksini kullanır ve sayfa derinliğinden bağımsızdır.
+    Oturumun başlangıç zamanı alt sınır olarak eklenir; oturumdan eski aylık bölümler okunmaz.
+    `since` verilirse o mesajdan sonraki en eski `limit` mesaj, aksi halde (`before`'dan önceki) en yeni `limit` mesaj
+    okunur. Mesajlar eskiden yeniye sıralı döner. (mesajlar, devamı_var_mı) döndürür.
+    """
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            started_at = get_chat_session_start(cursor, chatbot_id, session_id)
+            conditions = ["session_id = %s", "timestamp >= %s"]
+            params: List[Any] = [session_id, started_at]
+            cursor_row = "(SELECT timestamp, id FROM chat_messages WHERE id = %s AND session_id = %s AND timestamp >= %s)"
+            if before is not None:
+                conditions.append(f"(timestamp, id) < {cursor_row}")
+                params.extend([before, session_id, started_at])
+            if since is not None:
+                conditions.append(f"(timestamp, id) > {cursor_row}")
+                params.extend([since, session_id, started_at])
+            direction = "ASC" if since is not None else "DESC"
+            params.append(limit + 1) # Bir fazlası, devamı olup olmadığını anlamak için
+            cursor.execute(
+                f"""
+                SELECT id, sender, message, timestamp FROM chat_messages
+                WHERE {' AND '.join(conditions)}
+                ORDER BY timestamp {direction}, id {direction}
+                LIMIT %s;
+                """,
+                params
+            )
+            rows = cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if since is None:
+        rows.reverse()
+    messages = [
+        {"id": message_id, "sender": sender, "message": message, "timestamp": timestamp.isoformat()}
+        for message_id, sender, message, timestamp in rows
+    ]
+    return messages, has_more
+
+
+def history_page_etag(session_id, messages: List[Dict[str, Any]], has_more: bool) -> str:
+    """Geçmiş sayfasının zayıf ETag'i. Yazılmış mesajlar değişmediği için sayfadaki ID aralığı ve sayısı içeriği belirler."""
+    oldest_id = messages[0]["id"] if messages else None
+    newest_id = messages[-1]["id"] if messages else None
+    return f'W/"{session_id}-{oldest_id}-{newest_id}-{len(messages)}-{int(has_more)}"'
+
+
 @app.get("/chatbots/{chatbot_id}/history/")
-async def get_chatbot_history(chatbot_id: int):
+async def get_chatbot_history(
+    chatbot_id: int,
+    session_id: uuid.UUID,
+    limit: int = Query(default=HISTORY_PAGE_DEFAULT_LIMIT, ge=1, le=HISTORY_PAGE_MAX_LIMIT),
+    before: int | None = None,
+    since: int | None = None,
+    if_none_match: str | None = Header(default=None),
+):
     """
-    Belirli bir chatbot'un sohbet geçmişini döndürür.
+    Bir sohbet oturumunun geçmişini sayfa sayfa döndürür.
+    Parametresiz istek en yeni `limit` mesajı, `before=<id>` o mesajdan öncekileri (daha eski sayfa),
+    `since=<id>` o mesajdan sonra gelen yeni mesajları döndürür. Yanıttaki `oldest_id`/`newest_id` bir
+    sonraki isteğin imlecidir; `has_more` istenen yönde başka mesaj olup olmadığını belirtir.
+    Mesajlar değişmediği için sayfa ETag'i içerdiği ID'lerden türetilir; `If-None-Match` eşleşirse 304 döner.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    if before is not None and since is not None:
+        raise HTTPException(status_code=400, detail="'before' ve 'since' birlikte kullanılamaz.")
+
     try:
-        cursor.execute(
-            "SELECT sender, message, timestamp FROM chat_messages WHERE chatbot_id = %s ORDER BY timestamp ASC;",
-            (chatbot_id,)
-        )
-        history_rows = cursor.fetchall()
-        
-        history_list = []
-        for sender, message, timestamp in history_rows:
-            history_list.append({
-                "sender": sender,
-                "message": message,
-                "timestamp": timestamp.isoformat() # Zaman damgasını ISO formatında döndür
-            })
-        
-        return JSONResponse(
-            status_code=200,
-            content={"history": history_list}
-        )
+        messages, has_more = await run_db(load_history_page, chatbot_id, str(session_id), limit, before=before, since=since)
+    except HTTPException as e:
+        raise e
     except Exception as e:
         print(f"Chat history retrieval error: {e}")
         raise HTTPException(status_code=500, detail=f"Sohbet geçmişi alınırken bir hata oluştu: {e}")
-    finally:
-        cursor.close()
-        conn.close()
+
+    oldest_id = messages[0]["id"] if messages else None
+    newest_id = messages[-1]["id"] if messages else None
+    etag = history_page_etag(session_id, messages, has_more)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(
+        status_code=200,
+        content={"history": messages, "has_more": has_more, "oldest_id": oldest_id, "newest_id": newest_id},
+        headers=headers
+    )
+
+
+@app.post("/chatbots/{chatbot_id}/sessions/", status_code=201)
+async def create_chatbot_session(chatbot_id: int):
+    """Chatbot için yeni (boş) bir sohbet oturumu açar."""
+    def _create_session():
+        with db_connection() as conn:
+            try:
+                if get_chatbot_config(chatbot_id, conn) is None:
+                    raise HTTPException(status_code=404, detail=f"Chatbot ID {chatbot_id} bulunamadı.")
+                with conn.cursor() as cursor:
+                    session_id, created_at = create_chat_session(cursor, chatbot_id)
+                conn.commit()
+            except HTTPException:
+                raise
+            except Exception as e:
+                conn.rollback()
+                print(f"Sohbet oturumu oluşturma hatası: {e}")
+                raise HTTPException(status_code=500, detail=f"Sohbet oturumu oluşturulurken bir hata oluştu: {e}")
+        return {"session_id": session_id, "chatbot_id": chatbot_id, "created_at": created_at.isoformat()}
+
+    return await run_db(_create_session)
+
+
+@app.get("/admin/chatbots/{chatbot_id}/sessions")
+async def list_chatbot_sessions(
+    chatbot_id: int,
+    limit: int = Query(default=SESSION_LIST_DEFAULT_LIMIT, ge=1, le=SESSION_LIST_MAX_LIMIT),
+):
+    """
+    Chatbot'un en son kullanılan `limit` sohbet oturumunu, en yeniden eskiye döndürür. Oturum ID'leri geçmişe
+    erişim anahtarı olduğu için bu liste son kullanıcılara değil yalnızca yönetim arayüzüne açıktır.
+    """
+    def _list_sessions():
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT id, created_at, last_active_at FROM chat_sessions
+                    WHERE chatbot_id = %s
+                    ORDER BY last_active_at DESC
+                    LIMIT %s;
+                    """,
+                    (chatbot_id, limit)
+                )
+                rows = cursor.fetchall()
+        return [
+            {"session_id": session_id, "created_at": created_at.isoformat(), "last_active_at": last_active_at.isoformat()}
+            for session_id, created_at, last_active_at in rows
+        ]
+
+    try:
+        return await run_db(_list_sessions)
+    except Exception as e:
+        print(f"Sohbet oturumları listeleme hatası: {e}")
+        raise HTTPException(status_code=500, detail=f"Sohbet oturumları alınırken bir hata oluştu: {e}")
 
 
 @app.post("/chatbots/", response_model=ChatbotResponse)
 async def create_chatbot(request: CreateChatbotRequest):
     """Yeni bir chatbot (persona) oluşturur."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "INSERT INTO chatbots (name, description, boundary_text) VALUES (%s, %s, %s) RETURNING id;",
-            (request.name, request.description, request.boundary_text)
-        )
-        chatbot_id = cursor.fetchone()[0]
-        conn.commit()
+    def _create():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                f"INSERT INTO chatbots (name, description, boundary_text) VALUES (%s, %s, %s) RETURNING id, {', '.join(CHATBOT_CONFIG_COLUMNS)};",
+                (request.name, request.description, request.boundary_text)
+            )
+            chatbot_id, *config_row = cursor.fetchone()
+            conn.commit()
+            # Yeni chatbot'un yapılandırması önbelleğe alınır; ilk sohbet ve yüklemeler için sorgu gerekmez.
+            # Diğer süreçler bu ID için hiçbir şey önbelleğe almadığından (bulunamayan ID'ler önbelleğe alınmaz)
+            # bildirim gerekmez.
+            chatbot_config_cache.put(chatbot_id, dict(zip(CHATBOT_CONFIG_COLUMNS, config_row)))
 
-        # Yeni oluşturulan chatbot için boş bir FAISS indeksi oluştur (ve diske kaydet)
-        new_faiss_index = load_or_create_faiss_index(chatbot_id)
-        save_faiss_index(new_faiss_index, chatbot_id)
+            # Yeni oluşturulan chatbot ayrı dosyalı modda ise boş bir FAISS indeksi oluştur (ve diske kaydet);
+            # ortak modda vektörler ilk yüklemede ortak parçaya eklenir.
+            if not is_shared_store_key(index_store_key(chatbot_id, None)):
+                new_faiss_index = load_or_create_faiss_index(chatbot_id, writable=True)
+                save_faiss_index(new_faiss_index, chatbot_id)
 
-        return ChatbotResponse(
-            id=chatbot_id,
-            name=request.name,
-            description=request.description,
-            boundary_text=request.boundary_text
-        )
-    except psycopg2.errors.UniqueViolation:
-        raise HTTPException(status_code=400, detail="Bu isimde bir chatbot zaten mevcut.")
-    except Exception as e:
-        print(f"Chatbot oluşturma hatası: {e}")
-        raise HTTPException(status_code=500, detail=f"Chatbot oluşturulurken bir hata oluştu: {e}")
-    finally:
-        cursor.close()
-        conn.close()
+            return ChatbotResponse(
+                id=chatbot_id,
+                name=request.name,
+                description=request.description,
+                boundary_text=request.boundary_text
+            )
+        except psycopg2.errors.UniqueViolation:
+            raise HTTPException(status_code=400, detail="Bu isimde bir chatbot zaten mevcut.")
+        except Exception as e:
+            print(f"Chatbot oluşturma hatası: {e}")
+            raise HTTPException(status_code=500, detail=f"Chatbot oluşturulurken bir hata oluştu: {e}")
+        finally:
+            cursor.close()
+            conn.close()
+
+    return await run_db(_create)
 
 @app.get("/chatbots/", response_model=List[ChatbotResponse])
 async def list_chatbots():
     """Tüm kayıtlı chatbot'ları listeler."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT id, name, description, boundary_text FROM chatbots ORDER BY name;")
-        chatbots_data = cursor.fetchall()
+    def _list():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id, name, description, boundary_text FROM chatbots ORDER BY name;")
+            chatbots_data = cursor.fetchall()
         
-        chatbots_list = []
-        for cb_id, name, description, boundary_text in chatbots_data:
-            chatbots_list.append(ChatbotResponse(
-                id=cb_id,
-                name=name,
-                description=description,
-                boundary_text=boundary_text
-            ))
-        return chatbots_list
+            chatbots_list = []
+            for cb_id, name, description, boundary_text in chatbots_data:
+                chatbots_list.append(ChatbotResponse(
+                    id=cb_id,
+                    name=name,
+                    description=description,
+                    boundary_text=boundary_text
+                ))
+            return chatbots_list
+        except Exception as e:
+            print(f"Chatbot listeleme hatası: {e}")
+            raise HTTPException(status_code=500, detail=f"Chatbot'lar listelenirken bir hata oluştu: {e}")
+        finally:
+            cursor.close()
+            conn.close()
+
+    return await run_db(_list)
+
+
+# --- Yönetim / İzleme Endpoints'leri ---
+
+@app.get("/admin/faiss_cache/stats")
+async def get_faiss_cache_stats():
+    """FAISS indeks önbelleğinin isabet/ıskalama sayaçlarını ve doluluk bilgisini döndürür."""
+    return faiss_index_cache.stats()
+
+
+@app.get("/admin/db_pool/stats")
+async def get_db_pool_stats():
+    """Veritabanı bağlantı havuzunun doluluk, bekleme ve sağlık kontrolü sayaçlarını döndürür."""
+    return get_db_pool().stats()
+
+
+@app.get("/admin/chat_writer/stats")
+async def get_chat_writer_stats():
+    """Sohbet mesajı yazıcısının kuyruk doluluğunu, yazılan batch sayısını ve kayıp/geri çevrilen mesajları döndürür."""
+    return chat_message_writer.stats()
+
+
+@app.get("/admin/job_leases/stats")
+async def get_job_lease_stats():
+    """Bu sürecin iş kiralarını yenileme ve kirası dolmuş işleri başarısız sayma sayaçlarını döndürür."""
+    return job_lease_keeper.stats()
+
+
+@app.get("/admin/chat_messages/partitions")
+async def get_chat_message_partitions():
+    """`chat_messages` tablosunun aylık bölümlerini ve tahmini satır sayılarını döndürür."""
+    def _list_partitions():
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                partitions = list_chat_message_partitions(cursor)
+        return {
+            "retention_months": CHAT_MESSAGE_RETENTION_MONTHS,
+            "partitions": [
+                {"name": name, "month": month.isoformat(), "estimated_rows": row_estimate}
+                for name, month, row_estimate in partitions
+            ],
+        }
+
+    return await run_db(_list_partitions)
+
+
+@app.post("/admin/chat_messages/maintain_partitions")
+async def run_chat_message_partition_maintenance():
+    """İleri tarihli bölümleri oluşturur ve saklama süresini hemen uygular (normalde ayda bir, otomatik yapılır)."""
+    return await run_db(maintain_chat_message_partitions, force=True)
+
+
+@app.get("/admin/chatbot_config_cache/stats")
+async def get_chatbot_config_cache_stats():
+    """Chatbot yapılandırma önbelleğinin isabet oranını, bildirim sayısını ve dinleyici durumunu döndürür."""
+    return chatbot_config_cache.stats()
+
+
+@app.get("/admin/query_embedding_cache/stats")
+async def get_query_embedding_cache_stats():
+    """Sorgu embedding önbelleğinin isabet/ıskalama sayaçlarını döndürür."""
+    return query_embedding_cache.stats()
+
+
+@app.post("/admin/chatbots/{chatbot_id}/rebuild_index")
+async def rebuild_chatbot_index(chatbot_id: int, embed_missing: bool = False):
+    """
+    Chatbot'un FAISS indeksini veritabanında saklanan embedding'lerden yeniden oluşturur (ağ çağrısı yapmadan).
+    Ortak modda chatbot'un bulunduğu parçanın tamamı yeniden kurulur.
+    `embed_missing=true` ile embedding'i olmayan eski satırlar embed edilip saklanır.
+    """
+    try:
+        store_key = index_store_key(chatbot_id, (await run_db(load_index_policy, chatbot_id))["storage_mode"])
+        return await asyncio.to_thread(rebuild_faiss_index_from_db, store_key, embed_missing=embed_missing)
+    except HTTPException as e:
+        raise e
     except Exception as e:
-        print(f"Chatbot listeleme hatası: {e}")
-        raise HTTPException(status_code=500, detail=f"Chatbot'lar listelenirken bir hata oluştu: {e}")
-    finally:
-        cursor.close()
-        conn.close()
\ No newline at end of file
+        print(f"İndeks yeniden oluşturma hatası: {e}")
+        raise HTTPException(status_code=500, detail=f"İndeks yeniden oluşturulurken bir hata oluştu: {e}")
+
+
+@app.get("/admin/chatbots/{chatbot_id}/index_policy")
+async def get_chatbot_index_policy(chatbot_id: int):
+    """Chatbot'un indeks politikasını, diskteki indeksin güncel durumunu ve son depolama taşımasını döndürür."""
+    def _load_policy():
+        policy = load_index_policy(chatbot_id)
+        store_key = index_store_key(chatbot_id, policy["storage_mode"])
+        manifest = read_faiss_manifest(store_key)
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT id, from_storage, to_storage, status, error, created_at, updated_at
+                    FROM storage_move_jobs WHERE chatbot_id = %s ORDER BY id DESC LIMIT 1;
+                    """,
+                    (chatbot_id,)
+                )
+                move_row = cursor.fetchone()
+        return {
+            "policy": policy,
+            "store": str(store_key),
+            "current_index_type": manifest.get("index_type", "flat"),
+            "current_index_codec": manifest.get("index_codec", "none"),
+            "ntotal": manifest.get("ntotal", 0),
+            "storage_move": storage_move_job_to_dict(move_row) if move_row else None,
+        }
+
+    return await run_db(_load_policy)
+
+
+@app.get("/admin/chatbots/{chatbot_id}/storage_moves")
+async def list_storage_moves(chatbot_id: int, limit: int = 20):
+    """Chatbot'un depolama taşıma işlerini en yeniden eskiye, durum ve hata mesajlarıyla döndürür."""
+    def _list():
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT id, from_storage, to_storage, status, error, created_at, updated_at
+                    FROM storage_move_jobs WHERE chatbot_id = %s ORDER BY id DESC LIMIT %s;
+                    """,
+                    (chatbot_id, max(1, min(limit, 100)))
+                )
+                rows = cursor.fetchall()
+        return [storage_move_job_to_dict(row) for row in rows]
+
+    return await run_db(_list)
+
+
+@app.put("/admin/chatbots/{chatbot_id}/index_policy")
+async def update_chatbot_index_policy(chatbot_id: int, request: IndexPolicyRequest):
+    """
+    Chatbot'un indeks politikasını günceller ve gerekiyorsa arka planda indeks tipini/sıkıştırmasını değiştirir.
+    Mevcut indeks dosyaları yeni düzene yerinde dönüştürülür. Yalnızca istekte gönderilen alanlar değişir;
+    açıkça null gönderilen alan varsayılana döner. Depolama modu değişikliği bir taşıma işi olarak kuyruğa alınır;
+    durumu yanıttaki `storage_move` alanında ve `GET /admin/chatbots/{chatbot_id}/storage_moves` ile izlenir.
+    """
+    if request.index_type is not None and request.index_type not in INDEX_TYPES:
+        raise HTTPException(status_code=400, detail=f"Geçersiz indeks tipi: {request.index_type}. Geçerli değerler: {', '.join(INDEX_TYPES)}.")
+    if request.index_codec is not None and request.index_codec not in INDEX_CODECS:
+        raise HTTPException(status_code=400, detail=f"Geçersiz sıkıştırma: {request.index_codec}. Geçerli değerler: {', '.join(INDEX_CODECS)}.")
+    if request.storage_mode is not None and request.storage_mode not in STORAGE_MODES:
+        raise HTTPException(status_code=400, detail=f"Geçersiz depolama modu: {request.storage_mode}. Geçerli değerler: {', '.join(STORAGE_MODES)}.")
+    for field in ("promotion_threshold", "nprobe", "ef_search"):
+        value = getattr(request, field)
+        if value is not None and value <= 0:
+            raise HTTPException(status_code=400, detail=f"{field} pozitif bir tam sayı olmalıdır.")
+    fields = request.model_dump(exclude_unset=True)
+
+    def _update():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        move_job = None
+        try:
+            cursor.execute("SELECT index_storage FROM chatbots WHERE id = %s FOR UPDATE;", (chatbot_id,))
+            row = cursor.fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail=f"Chatbot ID {chatbot_id} bulunamadı.")
+            old_storage = row[0]
+            # Depo değişiyorsa index_storage burada değil, taşıma işi yeni depoyu kurduktan sonra değiştirilir
+            if "storage_mode" in fields and index_store_key(chatbot_id, fields["storage_mode"]) != index_store_key(chatbot_id, old_storage):
+                to_storage = fields.pop("storage_mode")
+                try:
+                    cursor.execute(
+                        """
+                        INSERT INTO storage_move_jobs (chatbot_id, from_storage, to_storage, owner, lease_expires_at)
+                        VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second') RETURNING id;
+                        """,
+                        (chatbot_id, old_storage, to_storage, job_owner(), JOB_LEASE_SECONDS)
+                    )
+                except psycopg2.IntegrityError:
+                    raise HTTPException(status_code=409, detail="Bu chatbot için süren bir depolama taşıması var; bitmesini bekleyin.")
+                move_job = (cursor.fetchone()[0], old_storage, to_storage)
+            _, _, version = update_index_policy_columns(cursor, chatbot_id, fields)
+            conn.commit()
+            chatbot_config_cache.invalidate(chatbot_id, version)
+        except HTTPException as e:
+            conn.rollback()
+            raise e
+        except Exception as e:
+            conn.rollback()
+            print(f"İndeks politikası güncelleme hatası: {e}")
+            raise HTTPException(status_code=500, detail=f"İndeks politikası güncellenirken bir hata oluştu: {e}")
+        finally:
+            cursor.close()
+            conn.close()
+
+        store_key = index_store_key(chatbot_id, old_storage)
+        faiss_index_cache.invalidate(store_key) # nprobe/efSearch bir sonraki yüklemede uygulanır
+        if move_job is not None:
+            # Vektörler arka planda yeni depoya taşınır; sohbet taşıma bitene kadar eski depodan yanıtlanır
+            submit_storage_move_job(move_job[0], chatbot_id, move_job[1], move_job[2])
+        else:
+            schedule_index_promotion(store_key)
+
+    await run_db(_update)
+    return await get_chatbot_index_policy(chatbot_id)
+
+
+@app.get("/admin/chatbots/{chatbot_id}/index_compression_report")
+async def get_index_compression_report(chatbot_id: int, codec: str = "sq8", k: int = 10, sample_size: int = 1000):
+    """Bir sıkıştırma seçeneğinin chatbot'un kendi parçaları üzerindeki bellek kazancını ve recall@k kaybını raporlar."""
+    if codec not in INDEX_CODECS:
+        raise HTTPException(status_code=400, detail=f"Geçersiz sıkıştırma: {codec}. Geçerli değerler: {', '.join(INDEX_CODECS)}.")
+    policy = await run_db(load_index_policy, chatbot_id)
+    if is_shared_store_key(index_store_key(chatbot_id, policy["storage_mode"])):
+        raise HTTPException(status_code=400, detail="Sıkıştırma ayarı yalnızca ayrı dosyalı (per_bot) chatbot'lar için geçerlidir.")
+    try:
+        # İndeks kurma ve recall ölçümü uzun süren CPU işidir; veritabanı thread'lerini meşgul etmemesi için varsayılan havuzda çalışır.
+        return await asyncio.to_thread(evaluate_index_compression, chatbot_id, codec, k=k, sample_size=sample_size)
+    except Exception as e:
+        print(f"Sıkıştırma raporu hatası: {e}")
+        raise HTTPException(status_code=500, detail=f"Sıkıştırma raporu oluşturulurken bir hata oluştu: {e}")
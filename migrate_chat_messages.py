@@ -0,0 +1,26 @@
+# migrate_chat_messages.py
+# Eski sürümlerin bölümlenmemiş sohbet mesajlarını bölümlenmiş `chat_messages` tablosuna taşır.
+# Sunucu başlarken eski tabloyu yalnızca `chat_messages_unpartitioned` olarak yeniden adlandırır; mesajlar bu
+# araçla, sunucu çalışırken batch'ler halinde taşınır. Yarıda kesilirse yeniden çalıştırmak yeterlidir.
+#
+# Örnek:
+#   python migrate_chat_messages.py --batch-size 5000
+import argparse
+
+from main import CHAT_MESSAGE_MIGRATION_BATCH_SIZE, close_db_pool, get_db_pool, migrate_legacy_chat_messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Eski sohbet mesajlarını bölümlenmiş tabloya taşı")
+    parser.add_argument("--batch-size", type=int, default=CHAT_MESSAGE_MIGRATION_BATCH_SIZE)
+    args = parser.parse_args()
+
+    get_db_pool().open()
+    try:
+        migrate_legacy_chat_messages(args.batch_size)
+    finally:
+        close_db_pool()
+
+
+if __name__ == "__main__":
+    main()
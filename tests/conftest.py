@@ -0,0 +1,8 @@
+import os
+import sys
+
+# main.py yüklenirken Gemini embedding istemcisini kurar; testler API'ye gitmez, anahtarın tanımlı olması yeterlidir.
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+
+# Testler depo kökündeki modülleri (main, document_parsing, validators) doğrudan import eder.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
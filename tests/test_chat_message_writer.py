@@ -0,0 +1,183 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import main
+
+
+class RecordingSaver:
+    """save_chat_messages_to_db yerine geçer; ilk `failures` çağrıda hata verir, sonra batch'leri kaydeder."""
+
+    def __init__(self, failures=0, block=None):
+        self.failures = failures
+        self.block = block
+        self.saving = threading.Event()
+        self.batches = []
+
+    def __call__(self, rows, conn=None):
+        self.saving.set()
+        if self.block is not None:
+            self.block.wait(timeout=5)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("veritabanı kullanılamıyor")
+        self.batches.append(list(rows))
+
+
+@pytest.fixture
+def saver(monkeypatch):
+    saver = RecordingSaver()
+    monkeypatch.setattr(main, "save_chat_messages_to_db", saver)
+    monkeypatch.setattr(main, "maintain_chat_message_partitions", lambda force=False: {})
+    return saver
+
+
+def make_writer(**options):
+    settings = {"batch_size": 100, "flush_interval": 0.01, "max_pending": 10, "max_retries": 2}
+    settings.update(options)
+    return main.ChatMessageWriter(**settings)
+
+
+def written_messages(saver):
+    return [(row[2], row[3]) for batch in saver.batches for row in batch]
+
+
+def test_enqueue_is_rejected_until_started(saver):
+    writer = make_writer()
+    assert writer.enqueue(1, "s1", [("user", "merhaba")]) is False
+    writer.start()
+    writer.close()
+    assert writer.enqueue(1, "s1", [("user", "merhaba")]) is False
+    assert saver.batches == []
+
+
+def test_close_flushes_all_turns_in_order(saver):
+    writer = make_writer(flush_interval=10)
+    writer.start()
+    for turn in range(3):
+        assert writer.enqueue(1, "s1", [("user", f"soru {turn}"), ("bot", f"cevap {turn}")])
+    writer.close()
+    assert written_messages(saver) == [
+        ("user", "soru 0"), ("bot", "cevap 0"),
+        ("user", "soru 1"), ("bot", "cevap 1"),
+        ("user", "soru 2"), ("bot", "cevap 2"),
+    ]
+    stats = writer.stats()
+    assert stats["written"] == 6
+    assert stats["pending_messages"] == 0
+
+
+def test_batch_is_split_at_batch_size(saver):
+    writer = make_writer(batch_size=2, flush_interval=10)
+    writer.start()
+    writer.enqueue(1, "s1", [("user", "a"), ("bot", "b")])
+    writer.enqueue(1, "s1", [("user", "c"), ("bot", "d")])
+    writer.close()
+    assert [len(batch) for batch in saver.batches] == [2, 2]
+
+
+def test_failed_batch_is_retried(saver):
+    saver.failures = 1
+    writer = make_writer(max_retries=2)
+    writer.start()
+    writer.enqueue(1, "s1", [("user", "merhaba")])
+    writer.close()
+    assert written_messages(saver) == [("user", "merhaba")]
+    stats = writer.stats()
+    assert stats["written"] == 1
+    assert stats["dropped"] == 0
+
+
+def test_batch_is_dropped_after_retries_are_exhausted(saver):
+    saver.failures = 2
+    writer = make_writer(max_retries=1)
+    writer.start()
+    writer.enqueue(1, "s1", [("user", "merhaba"), ("bot", "selam")])
+    writer.close()
+    assert saver.batches == []
+    stats = writer.stats()
+    assert stats["dropped"] == 2
+    assert stats["pending_messages"] == 0
+    assert writer.pending_messages("s1") == []
+
+
+def test_unwritten_messages_are_visible_per_session(saver):
+    saver.block = threading.Event()
+    writer = make_writer()
+    writer.start()
+    try:
+        writer.enqueue(1, "s1", [("user", "soru"), ("bot", "cevap")])
+        writer.enqueue(1, "s2", [("user", "başka oturum")])
+        assert saver.saving.wait(timeout=5)
+        assert [(sender, message) for sender, message, _ in writer.pending_messages("s1")] == [("user", "soru"), ("bot", "cevap")]
+        assert writer.pending_messages("s3") == []
+    finally:
+        saver.block.set()
+        writer.close()
+    assert writer.pending_messages("s1") == []
+
+
+def test_full_queue_rejects_turn(saver):
+    saver.block = threading.Event()
+    writer = make_writer(batch_size=1, max_pending=1)
+    writer.start()
+    try:
+        assert writer.enqueue(1, "s1", [("user", "ilk")])
+        assert saver.saving.wait(timeout=5) # İlk tur kuyruktan alındı, yazıcı bekliyor
+        assert writer.enqueue(1, "s1", [("user", "ikinci")]) # Kuyruktaki tek yer
+        assert writer.enqueue(1, "s1", [("user", "üçüncü")]) is False
+        assert [message for _, message, _ in writer.pending_messages("s1")] == ["ilk", "ikinci"]
+    finally:
+        saver.block.set()
+        writer.close()
+    assert writer.stats()["rejected"] == 1
+    assert written_messages(saver) == [("user", "ilk"), ("user", "ikinci")]
+
+
+class HistoryCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.params = None
+
+    def execute(self, sql, params=None):
+        self.params = params
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def close(self):
+        pass
+
+
+class HistoryConnection:
+    def __init__(self, rows):
+        self.history_cursor = HistoryCursor(rows)
+
+    def cursor(self):
+        return self.history_cursor
+
+    def rollback(self):
+        pass
+
+
+def test_history_skips_pending_messages_already_written():
+    started = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    first, second = started + timedelta(seconds=1), started + timedelta(seconds=2)
+    conn = HistoryConnection([("user", "soru 1", first), ("bot", "cevap 1", first)])
+    pending = [("user", "soru 1", first), ("bot", "cevap 1", first), ("user", "soru 2", second), ("bot", "cevap 2", second)]
+
+    history = main.load_chat_history_from_db("s1", started, conn=conn, turns=5, pending=pending)
+
+    assert [message.content for message in history] == ["soru 1", "cevap 1", "soru 2", "cevap 2"]
+    assert conn.history_cursor.params == ("s1", started, 10)
+
+
+def test_history_window_keeps_latest_turns():
+    started = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    rows = [("user", f"soru {turn}", started + timedelta(seconds=turn)) for turn in range(3)]
+    pending = [("user", "soru 3", started + timedelta(seconds=3))]
+
+    history = main.load_chat_history_from_db("s1", started, conn=HistoryConnection(rows), turns=1, pending=pending)
+
+    assert [message.content for message in history] == ["soru 2", "soru 3"]
@@ -0,0 +1,90 @@
+import pytest
+
+import main
+
+
+def config(version, name="bot"):
+    return {"name": name, "config_version": version}
+
+
+@pytest.fixture
+def cache():
+    cache = main.ChatbotConfigCache(max_entries=2, ttl_seconds=60)
+    cache._listening = True # Dinleyici bağlıymış gibi; bağlantı olmadan önbellek hiç kullanılmaz
+    return cache
+
+
+def test_cached_config_is_returned(cache):
+    cache.put(1, config(1))
+    assert cache.get(1) == config(1)
+    assert cache.stats()["hits"] == 1
+
+
+def test_cache_is_bypassed_while_listener_is_down():
+    cache = main.ChatbotConfigCache(max_entries=2, ttl_seconds=60)
+    cache.put(1, config(1))
+    assert cache.get(1) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_invalidate_drops_older_version_and_rejects_stale_put(cache):
+    cache.put(1, config(1))
+    cache.invalidate(1, 2)
+    assert cache.get(1) is None
+    cache.put(1, config(1)) # Bildirimden önce okunmuş eski satır
+    assert cache.get(1) is None
+    cache.put(1, config(2, name="yeni"))
+    assert cache.get(1)["name"] == "yeni"
+
+
+def test_invalidate_keeps_entry_that_is_already_current(cache):
+    cache.put(1, config(3))
+    cache.invalidate(1, 3)
+    assert cache.get(1) == config(3)
+    assert cache.stats()["invalidations"] == 0
+
+
+def test_deleted_chatbot_is_never_cached_again(cache):
+    cache.put(1, config(5))
+    cache.invalidate(1, None)
+    cache.put(1, config(6))
+    assert cache.get(1) is None
+
+
+def test_notification_invalidates_and_calls_on_change():
+    changed = []
+    cache = main.ChatbotConfigCache(max_entries=2, ttl_seconds=60, on_change=changed.append)
+    cache._listening = True
+    cache.put(7, config(1))
+    cache._apply_notification("7:2")
+    assert cache.get(7) is None
+    assert changed == [7]
+    cache._apply_notification("7:deleted")
+    cache.put(7, config(3))
+    assert cache.get(7) is None
+    assert cache.stats()["notifications"] == 2
+
+
+def test_malformed_notification_is_ignored(cache):
+    cache.put(1, config(1))
+    cache._apply_notification("not-a-chatbot")
+    assert cache.get(1) == config(1)
+    assert cache.stats()["notifications"] == 0
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    cache.put(1, config(1))
+    cache.put(2, config(1))
+    cache.get(1)
+    cache.put(3, config(1))
+    assert cache.get(2) is None
+    assert cache.get(1) is not None
+
+
+def test_expired_entry_is_dropped(cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    cache.put(1, config(1))
+    now[0] += cache.ttl_seconds + 1
+    assert cache.get(1) is None
+    assert cache.stats()["entries"] == 0
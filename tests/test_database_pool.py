@@ -0,0 +1,156 @@
+import threading
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+import main
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, sql, params=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+
+class FakeConnection:
+    """Havuzun kullandığı PooledConnection arayüzünün veritabanısız karşılığı."""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._checked_out = False
+        self.closed = 0
+        self.broken = False
+        self.rollbacks = 0
+        self.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.transaction_status
+
+    def close(self):
+        self._pool.release(self)
+
+    def close_physical(self):
+        self.closed = 1
+
+
+class FakeDatabasePool(main.DatabasePool):
+    def _connect(self):
+        conn = FakeConnection(self)
+        with self._cond:
+            self.created += 1
+        return conn
+
+
+def make_pool(**options):
+    settings = {"min_size": 0, "max_size": 2, "timeout": 0.2, "healthcheck_seconds": 30.0}
+    settings.update(options)
+    return FakeDatabasePool("dbname=test", **settings)
+
+
+def test_released_connection_is_reused():
+    pool = make_pool()
+    conn = pool.acquire()
+    conn.close()
+    assert pool.acquire() is conn
+    stats = pool.stats()
+    assert stats["created"] == 1
+    assert stats["checkouts"] == 2
+    assert stats["in_use"] == 1
+
+
+def test_open_prefills_min_size():
+    pool = make_pool(min_size=2)
+    pool.open()
+    assert pool.stats()["idle"] == 2
+    assert pool.stats()["created"] == 2
+
+
+def test_double_release_is_ignored():
+    pool = make_pool()
+    conn = pool.acquire()
+    conn.close()
+    conn.close()
+    stats = pool.stats()
+    assert stats["idle"] == 1
+    assert stats["size"] == 1
+
+
+def test_release_rolls_back_open_transaction():
+    pool = make_pool()
+    conn = pool.acquire()
+    conn.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    conn.close()
+    assert conn.rollbacks == 1
+    assert pool.stats()["idle"] == 1
+
+
+def test_acquire_times_out_when_pool_is_exhausted():
+    pool = make_pool(max_size=1, timeout=0.05)
+    pool.acquire()
+    with pytest.raises(main.DatabasePoolTimeout):
+        pool.acquire()
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_waiting_acquire_gets_connection_released_by_another_thread():
+    pool = make_pool(max_size=1, timeout=2.0)
+    conn = pool.acquire()
+    releaser = threading.Timer(0.05, conn.close)
+    releaser.start()
+    try:
+        assert pool.acquire() is conn
+    finally:
+        releaser.join()
+    assert pool.stats()["waits"] == 1
+
+
+def test_unhealthy_idle_connection_is_replaced():
+    pool = make_pool(healthcheck_seconds=0.0)
+    conn = pool.acquire()
+    conn.close()
+    conn.broken = True
+    replacement = pool.acquire()
+    assert replacement is not conn
+    assert conn.closed
+    stats = pool.stats()
+    assert stats["failed_healthchecks"] == 1
+    assert stats["discarded"] == 1
+    assert stats["size"] == 1
+
+
+def test_closed_connection_is_discarded_on_release():
+    pool = make_pool()
+    conn = pool.acquire()
+    conn.closed = 1
+    conn.close()
+    stats = pool.stats()
+    assert stats["size"] == 0
+    assert stats["discarded"] == 1
+
+
+def test_closed_pool_rejects_acquire_and_discards_returned_connections():
+    pool = make_pool()
+    conn = pool.acquire()
+    pool.close()
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+    conn.close()
+    assert conn.closed
+    assert pool.stats()["size"] == 0
@@ -0,0 +1,77 @@
+import pytest
+
+import main
+
+
+class FakeStore:
+    def __init__(self, size):
+        self.size = size
+
+
+@pytest.fixture(autouse=True)
+def fixed_store_sizes(monkeypatch):
+    # Boyut tahmini gerçek bir FAISS nesnesi gerektirir; önbelleğin kendi mantığı için sabit boyut yeterlidir.
+    monkeypatch.setattr(main, "estimate_faiss_index_bytes", lambda store: store.size)
+
+
+def test_least_recently_used_entry_is_evicted_by_count():
+    cache = main.FaissIndexCache(max_bytes=1000, max_entries=2)
+    first, second, third = FakeStore(10), FakeStore(10), FakeStore(10)
+    cache.put(1, first)
+    cache.put(2, second)
+    assert cache.get(1) is first # 1 artık en son kullanılan
+    cache.put(3, third)
+    assert cache.get(2) is None
+    assert cache.get(1) is first
+    assert cache.get(3) is third
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_are_evicted_until_under_byte_limit():
+    cache = main.FaissIndexCache(max_bytes=100, max_entries=10)
+    cache.put(1, FakeStore(60))
+    cache.put(2, FakeStore(30))
+    cache.put(3, FakeStore(30))
+    assert cache.get(1) is None
+    stats = cache.stats()
+    assert stats["bytes"] == 60
+    assert stats["entries"] == 2
+
+
+def test_store_larger_than_limit_is_not_cached():
+    cache = main.FaissIndexCache(max_bytes=100, max_entries=10)
+    cache.put(1, FakeStore(10))
+    cache.put(2, FakeStore(500))
+    assert cache.get(2) is None
+    assert cache.get(1) is not None
+    assert cache.stats()["bytes"] == 10
+
+
+def test_replacing_an_entry_does_not_double_count_bytes():
+    cache = main.FaissIndexCache(max_bytes=100, max_entries=10)
+    cache.put(1, FakeStore(40))
+    replacement = FakeStore(50)
+    cache.put(1, replacement)
+    assert cache.get(1) is replacement
+    assert cache.stats()["bytes"] == 50
+
+
+def test_invalidate_removes_entry():
+    cache = main.FaissIndexCache(max_bytes=100, max_entries=10)
+    cache.put(1, FakeStore(40))
+    cache.invalidate(1)
+    assert cache.get(1) is None
+    assert cache.stats()["bytes"] == 0
+
+
+def test_entry_is_dropped_when_manifest_stamp_changes():
+    stamps = {1: (1, 100, 10)}
+    cache = main.FaissIndexCache(max_bytes=100, max_entries=10, stamp_fn=stamps.get)
+    store = FakeStore(10)
+    cache.put(1, store, stamps[1])
+    assert cache.get(1) is store
+    stamps[1] = (2, 200, 12) # Başka bir worker manifest'i yeniden yazdı
+    assert cache.get(1) is None
+    stats = cache.stats()
+    assert stats["stale"] == 1
+    assert stats["bytes"] == 0
@@ -0,0 +1,122 @@
+import os
+
+import numpy as np
+import pytest
+from langchain.docstore.document import Document
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def faiss_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "FAISS_INDEX_DIR", str(tmp_path))
+    return tmp_path
+
+
+def make_store(doc_ids):
+    """Her parçanın vektörü kendi documents.id değeriyle doldurulmuş bir FAISS nesnesi."""
+    store = main._create_empty_faiss_index()
+    chunks = [Document(page_content=f"parça {doc_id}", metadata={"doc_id": doc_id}) for doc_id in doc_ids]
+    vectors = np.stack([np.full(main.GEMINI_EMBEDDING_DIM, doc_id, dtype=np.float32) for doc_id in doc_ids])
+    main.add_chunks_to_faiss_index(store, chunks, vectors)
+    return store
+
+
+def nearest_doc_id(store, value):
+    _, ids = store.index.search(np.full((1, main.GEMINI_EMBEDDING_DIM), value, dtype=np.float32), 1)
+    return int(ids[0][0])
+
+
+def test_empty_manifest_loads_nothing():
+    assert main._load_faiss_from_manifest({"base": None, "segments": [], "next_seq": 1}, writable=False) == (None, False)
+
+
+def write_base_with_changes(faiss_dir):
+    main._write_faiss_part(os.path.join(faiss_dir, "faiss_index_1"), make_store([1, 2]))
+    main._write_faiss_part(os.path.join(faiss_dir, "faiss_index_1.seg1"), make_store([2, 3])) # 2 tabanda zaten var
+    main._write_faiss_part(os.path.join(faiss_dir, "faiss_index_1.seg2"), make_store([4]))
+    return {
+        "base": "faiss_index_1",
+        "segments": ["faiss_index_1.seg1", "faiss_index_1.seg2"],
+        "removed_ids": [1],
+        "next_seq": 3,
+    }
+
+
+def test_writable_load_merges_segments_into_base_and_drops_removed_ids(faiss_dir):
+    store, converted = main._load_faiss_from_manifest(write_base_with_changes(faiss_dir), writable=True)
+
+    assert not converted
+    assert store.index.ntotal == 3
+    assert set(store.index_to_docstore_id) == {2, 3, 4}
+    assert store.docstore.search("4").page_content == "parça 4"
+    assert nearest_doc_id(store, 3) == 3
+    assert nearest_doc_id(store, 1) == 2 # Silinen 1 artık sonuç olarak dönmez
+
+
+def test_read_only_load_layers_changes_over_untouched_base(faiss_dir, monkeypatch):
+    monkeypatch.setattr(main, "load_index_policy", lambda store_key: main.default_index_policy())
+    store, _ = main._load_faiss_from_manifest(write_base_with_changes(faiss_dir), writable=False)
+
+    assert store.index.ntotal == 2 # Taban (mmap) olduğu gibi kalır
+    assert store._delta_index.ntotal == 2 # 3 ve 4; 2 tabandan gelir
+    assert list(store._removed_ids) == [1]
+    assert set(store.index_to_docstore_id) == {2, 3, 4}
+    assert main.chatbot_vector_count(store, 1, 1) == 3
+    assert store.docstore.search("4").page_content == "parça 4"
+    assert store.docstore.search("2").page_content == "parça 2"
+
+    def search(value, k=1):
+        query = [float(value)] * main.GEMINI_EMBEDDING_DIM
+        return [doc.metadata["doc_id"] for doc in main.search_faiss_store(store, 1, query, k)]
+
+    assert search(3) == [3]
+    assert search(1) == [2] # Silinen 1 seçiciyle dışlanır
+    assert search(4, k=3) == [4, 3, 2]
+    members = main.search_faiss_store(store, 1, [3.0] * main.GEMINI_EMBEDDING_DIM, 2, member_ids=np.array([2, 4]))
+    assert [doc.metadata["doc_id"] for doc in members] == [2, 4]
+
+
+def test_segment_only_store_without_base():
+    main.append_faiss_segment(make_store([5, 6]), 2)
+    store = main.load_or_create_faiss_index(2)
+    assert set(store.index_to_docstore_id) == {5, 6}
+
+
+def test_appends_tombstones_and_compaction_round_trip():
+    main.append_faiss_segment(make_store([1, 2]), 3)
+    main.append_faiss_segment(make_store([3]), 3)
+    main.append_faiss_tombstones([2], 3)
+
+    manifest = main.read_faiss_manifest(3)
+    assert len(manifest["segments"]) == 2
+    assert manifest["removed_ids"] == [2]
+    assert manifest["ntotal"] == 2
+    assert set(main.load_or_create_faiss_index(3).index_to_docstore_id) == {1, 3}
+
+    main.compact_faiss_index(3)
+
+    manifest = main.read_faiss_manifest(3)
+    assert manifest["segments"] == []
+    assert manifest["removed_ids"] == []
+    assert manifest["ntotal"] == 2
+    store = main.load_or_create_faiss_index(3)
+    assert set(store.index_to_docstore_id) == {1, 3}
+    assert store.docstore.search("3").page_content == "parça 3"
+
+
+def test_lazy_docstore_stays_readable_after_compaction_removes_its_file():
+    main.save_faiss_index(make_store([1]), 4)
+    store = main.load_or_create_faiss_index(4) # Yalnızca taban: mmap + tembel docstore
+    main.append_faiss_segment(make_store([2]), 4)
+    main.compact_faiss_index(4) # Eski taban dosyaları silinir
+    assert store.docstore.search("1").page_content == "parça 1"
+
+
+def test_tombstones_force_compaction_for_hnsw_and_above_fraction(monkeypatch):
+    monkeypatch.setattr(main, "FAISS_COMPACTION_SEGMENT_THRESHOLD", 8)
+    monkeypatch.setattr(main, "FAISS_COMPACTION_TOMBSTONE_FRACTION", 0.1)
+    assert main.faiss_pending_changes({"segments": ["a", "b"], "removed_ids": [], "ntotal": 100}) == 2
+    assert main.faiss_pending_changes({"segments": ["a"], "removed_ids": [1], "ntotal": 100}) == 1
+    assert main.faiss_pending_changes({"segments": ["a"], "removed_ids": list(range(20)), "ntotal": 100}) == 8
+    assert main.faiss_pending_changes({"segments": [], "removed_ids": [1], "ntotal": 1000, "index_type": "hnsw"}) == 8
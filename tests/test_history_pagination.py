@@ -0,0 +1,142 @@
+import asyncio
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import main
+
+STARTED_AT = datetime(2026, 1, 1, tzinfo=timezone.utc)
+SESSION_ID = uuid.UUID("00000000-0000-0000-0000-000000000001")
+
+
+def message_row(message_id):
+    return (message_id, "user" if message_id % 2 else "bot", f"mesaj {message_id}", STARTED_AT + timedelta(seconds=message_id))
+
+
+class PageCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.sql = None
+        self.params = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, sql, params=None):
+        self.sql = " ".join(sql.split())
+        self.params = params
+
+    def fetchall(self):
+        return list(self.rows)
+
+
+class PageConnection:
+    def __init__(self, rows):
+        self.page_cursor = PageCursor(rows)
+        self.closed = False
+
+    def cursor(self):
+        return self.page_cursor
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def connect(monkeypatch):
+    monkeypatch.setattr(main, "get_chat_session_start", lambda cursor, chatbot_id, session_id: STARTED_AT)
+
+    def connect(rows):
+        conn = PageConnection(rows)
+        monkeypatch.setattr(main, "get_db_connection", lambda: conn)
+        return conn
+
+    return connect
+
+
+def test_latest_page_is_read_newest_first_and_returned_oldest_first(connect):
+    conn = connect([message_row(i) for i in (5, 4, 3)])
+    messages, has_more = main.load_history_page(1, str(SESSION_ID), limit=2)
+    assert [message["id"] for message in messages] == [4, 5]
+    assert has_more
+    assert messages[0]["timestamp"] == message_row(4)[3].isoformat()
+    cursor = conn.page_cursor
+    assert "ORDER BY timestamp DESC, id DESC" in cursor.sql
+    assert "(timestamp, id) <" not in cursor.sql
+    assert cursor.params == [str(SESSION_ID), STARTED_AT, 3]
+    assert conn.closed
+
+
+def test_before_cursor_reads_older_page(connect):
+    conn = connect([message_row(i) for i in (2, 1)])
+    messages, has_more = main.load_history_page(1, str(SESSION_ID), limit=2, before=3)
+    assert [message["id"] for message in messages] == [1, 2]
+    assert not has_more
+    cursor = conn.page_cursor
+    assert "(timestamp, id) < (SELECT timestamp, id FROM chat_messages" in cursor.sql
+    assert "ORDER BY timestamp DESC, id DESC" in cursor.sql
+    assert cursor.params == [str(SESSION_ID), STARTED_AT, 3, str(SESSION_ID), STARTED_AT, 3]
+
+
+def test_since_cursor_reads_newer_messages_in_ascending_order(connect):
+    conn = connect([message_row(i) for i in (6, 7, 8)])
+    messages, has_more = main.load_history_page(1, str(SESSION_ID), limit=2, since=5)
+    assert [message["id"] for message in messages] == [6, 7]
+    assert has_more
+    cursor = conn.page_cursor
+    assert "(timestamp, id) > (SELECT timestamp, id FROM chat_messages" in cursor.sql
+    assert "ORDER BY timestamp ASC, id ASC" in cursor.sql
+    assert cursor.params[-1] == 3
+
+
+def page(ids):
+    return [{"id": message_id} for message_id in ids]
+
+
+def test_etag_depends_on_page_contents():
+    etag = main.history_page_etag(SESSION_ID, page([4, 5]), True)
+    assert etag == main.history_page_etag(SESSION_ID, page([4, 5]), True)
+    assert etag.startswith('W/"')
+    assert etag != main.history_page_etag(SESSION_ID, page([4, 5, 6]), True)
+    assert etag != main.history_page_etag(SESSION_ID, page([4, 5]), False)
+    assert etag != main.history_page_etag(uuid.uuid4(), page([4, 5]), True)
+    assert main.history_page_etag(SESSION_ID, [], False) == f'W/"{SESSION_ID}-None-None-0-0"'
+
+
+@pytest.fixture
+def history_page(monkeypatch):
+    monkeypatch.setattr(main, "load_history_page", lambda chatbot_id, session_id, limit, before=None, since=None: (page([4, 5]), True))
+
+
+def get_history(**options):
+    params = {"limit": 2, "before": None, "since": None, "if_none_match": None}
+    params.update(options)
+    return asyncio.run(main.get_chatbot_history(1, SESSION_ID, **params))
+
+
+def test_history_response_carries_etag_and_cursors(history_page):
+    response = get_history()
+    assert response.status_code == 200
+    assert response.headers["ETag"] == main.history_page_etag(SESSION_ID, page([4, 5]), True)
+    body = json.loads(response.body)
+    assert (body["oldest_id"], body["newest_id"], body["has_more"]) == (4, 5, True)
+
+
+def test_matching_if_none_match_returns_not_modified(history_page):
+    etag = main.history_page_etag(SESSION_ID, page([4, 5]), True)
+    response = get_history(if_none_match=f'W/"başka", {etag}')
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert get_history(if_none_match='W/"başka"').status_code == 200
+
+
+def test_before_and_since_together_are_rejected(history_page):
+    with pytest.raises(HTTPException) as exc_info:
+        get_history(before=3, since=5)
+    assert exc_info.value.status_code == 400
@@ -0,0 +1,104 @@
+import os
+import threading
+
+import pytest
+
+import main
+
+
+class RecordingCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.statements.append((" ".join(sql.split()), params))
+
+    def close(self):
+        pass
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self):
+        return RecordingCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    conn = RecordingConnection()
+    monkeypatch.setattr(main, "get_db_connection", lambda: conn)
+    return conn
+
+
+def test_owner_identifies_this_process():
+    assert main.job_owner().endswith(f":{os.getpid()}")
+
+
+def test_only_expired_leases_are_failed_after_startup(conn):
+    main.fail_interrupted_ingestion_jobs()
+    sql, params = conn.statements[-1]
+    assert "lease_expires_at < CURRENT_TIMESTAMP" in sql
+    assert params[1:] == (False, main.job_owner())
+
+
+def test_startup_also_fails_jobs_of_previous_instance(conn):
+    main.fail_interrupted_ingestion_jobs(startup=True)
+    _, params = conn.statements[-1]
+    assert params[1:] == (True, main.job_owner())
+
+
+def test_storage_moves_use_the_same_lease_scope(conn):
+    main.fail_interrupted_storage_moves(startup=True)
+    sql, params = conn.statements[-1]
+    assert sql.startswith("UPDATE storage_move_jobs SET status = 'failed'")
+    assert "lease_expires_at < CURRENT_TIMESTAMP" in sql
+    assert params[1:] == (True, main.job_owner())
+
+
+def test_renew_extends_only_own_active_jobs(conn):
+    keeper = main.JobLeaseKeeper(lease_seconds=30)
+    assert keeper.renew() == 2
+    tables = [sql.split()[1] for sql, _ in conn.statements]
+    assert tables == ["ingestion_jobs", "storage_move_jobs"]
+    for sql, params in conn.statements:
+        assert "owner = %s AND status IN ('queued', 'running')" in sql
+        assert params == (30, main.job_owner())
+    assert conn.commits == 1
+
+
+def test_keeper_renews_and_sweeps_until_closed(monkeypatch):
+    calls = []
+    swept = threading.Event()
+    keeper = main.JobLeaseKeeper(lease_seconds=0.03)
+    monkeypatch.setattr(keeper, "renew", lambda: calls.append("renew") or 2)
+
+    def sweep(startup=False):
+        calls.append("sweep")
+        swept.set()
+        return 1
+
+    monkeypatch.setattr(main, "fail_interrupted_ingestion_jobs", sweep)
+    monkeypatch.setattr(main, "fail_interrupted_storage_moves", lambda startup=False: 0)
+    keeper.start()
+    assert swept.wait(timeout=5)
+    keeper.close()
+    assert calls[:2] == ["renew", "sweep"]
+    stats = keeper.stats()
+    assert stats["renewals"] >= 2
+    assert stats["expired"] >= 1
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from langchain.docstore.document import Document
+
+import main
+
+
+class StatementCursor:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(" ".join(sql.split()))
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    cursor = StatementCursor()
+    embed_calls = []
+    next_id = [100]
+
+    def embed(texts):
+        embed_calls.append(len(texts))
+        return np.zeros((len(texts), main.GEMINI_EMBEDDING_DIM), dtype=np.float32), {"cache_hits": 0, "cache_misses": len(texts)}
+
+    def insert(cursor, chatbot_id, filename, chunks, vectors=None):
+        document_ids = list(range(next_id[0], next_id[0] + len(chunks)))
+        next_id[0] += len(chunks)
+        cursor.statements.append(f"INSERT {filename} {len(chunks)}")
+        return document_ids
+
+    monkeypatch.setattr(main, "INGESTION_STREAM_BATCH_SIZE", 4)
+    monkeypatch.setattr(main.cached_embeddings, "embed_documents_with_stats", embed)
+    monkeypatch.setattr(main, "insert_document_chunks", insert)
+    monkeypatch.setattr(main, "load_file_chunk_hashes", lambda cursor, chatbot_id, filename: {})
+    monkeypatch.setattr(main, "update_ingestion_job", lambda job_id, **fields: None)
+    writer = main.StreamingChunkWriter(cursor, job_id=1, chatbot_id=7, store_key=7)
+    writer.embed_calls = embed_calls
+    return writer
+
+
+def chunks(filename, count):
+    return [Document(page_content=f"{filename} parça {i}", metadata={}) for i in range(count)]
+
+
+def write_file(writer, filename, count):
+    writer.start_file(filename)
+    writer.add_chunks(chunks(filename, count))
+    return writer.finish_file(b"hash")
+
+
+def test_small_files_share_embedding_batches(writer):
+    results = [write_file(writer, name, 2) for name in ("a.txt", "b.txt", "c.txt")]
+    writer.flush()
+
+    assert writer.embed_calls == [4, 2] # ceil(6 / 4), dosya sayısı kadar değil
+    assert [result["chunks"] for result in results] == [2, 2, 2]
+    assert writer.chunks_added == 6
+    assert writer.segment.index.ntotal == 6
+    assert writer.embedding_cache_stats()["batches"] == 2
+
+
+def test_savepoint_covers_only_the_open_files_rows(writer):
+    write_file(writer, "a.txt", 2)
+    write_file(writer, "b.txt", 2)
+    statements = [sql for sql in writer.cursor.statements if not sql.startswith("INSERT INTO chatbot_files")]
+    # a.txt'nin tamponda bekleyen parçaları b.txt'nin savepoint'inden önce yazılır
+    assert statements == ["INSERT a.txt 2", "SAVEPOINT ingest_file;", "INSERT b.txt 2", "RELEASE SAVEPOINT ingest_file;"]
+
+
+def test_discarded_file_keeps_previous_files_rows(writer):
+    write_file(writer, "a.txt", 2)
+    writer.start_file("b.txt")
+    writer.add_chunks(chunks("b.txt", 3)) # a.txt'nin 2 parçası + b.txt'nin 2 parçası yazılır, 1 parça tamponda kalır
+    writer.discard_file()
+    writer.flush()
+
+    assert writer.cursor.statements[-2:] == ["ROLLBACK TO SAVEPOINT ingest_file;", "RELEASE SAVEPOINT ingest_file;"]
+    assert writer.cursor.statements.index("INSERT a.txt 2") < writer.cursor.statements.index("SAVEPOINT ingest_file;")
+    assert writer.embed_calls == [4] # Geri alınan dosyanın tampondaki parçası embed edilmez
+    assert set(writer.segment.index_to_docstore_id) == {100, 101}
+    assert writer.chunks_added == 2